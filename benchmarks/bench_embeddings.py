@@ -0,0 +1,129 @@
+"""
+Benchmark for the embedding backends.
+
+Loads each backend in a fresh interpreter (so memory is measured per
+worker) and reports load time, peak RSS, table embedding throughput,
+query embedding latency and retrieval recall on the fixture schema
+(stand_ins.FIXTURE_TABLES, padded with synthetic distractor tables).
+R@k is the share of fixture questions whose table is in the top k of the
+embedding search alone; "fused" is get_similar_tables, with BM25 fused in;
+"vs bert" is the overlap of each backend's top 5 with BERT's.
+
+    python -m benchmarks.bench_embeddings
+    python -m benchmarks.bench_embeddings --backends bert sentence-int8 onnx --distractors 1000
+
+Backends are EMBEDDING_BACKEND values with an optional -int8 suffix, plus
+"hashing" (no model) as a floor. Models are downloaded on first use.
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_BACKENDS = ["bert", "bert-int8", "sentence", "sentence-int8", "onnx", "onnx-int8", "hashing"]
+TOP = 5
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_backend(spec: str, model_name: str, distractors: int) -> dict:
+    """Runs in the child process; everything heavy is imported here."""
+    from psqlagent.modules.embedding_backends import create_embedding_backend
+    from psqlagent.modules.embeddings import DatabaseEmbedder
+    from benchmarks.stand_ins import HashingBackend, FIXTURE_QUESTIONS, fixture_schema, synthetic_tables
+
+    schema = fixture_schema()
+    definitions, search_texts = schema.definitions(), schema.search_texts()
+    for name, columns, _ in synthetic_tables(distractors):
+        definitions[name] = "; ".join(f"name: {column}, data_type: {data_type}" for column, data_type in columns)
+        search_texts[name] = " ".join([name, name] + [column for column, _ in columns])
+
+    baseline_mb = peak_rss_mb()
+    started_at = time.perf_counter()
+    if spec == "hashing":
+        backend = HashingBackend()
+    else:
+        backend_name, _, quantize = spec.partition("-")
+        backend = create_embedding_backend(backend_name, model_name=model_name, quantize=quantize)
+    embedder = DatabaseEmbedder(store_dir=None, backend=backend)
+    embedder.warm_up()
+    load_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    embedder.sync_tables(definitions, search_texts=search_texts)
+    tables_per_second = len(definitions) / (time.perf_counter() - started_at)
+
+    timings, results = [], []
+    for question, _ in FIXTURE_QUESTIONS:
+        started_at = time.perf_counter()
+        ranked = embedder.get_similar_tables_via_embeddings(question, TOP)
+        timings.append(time.perf_counter() - started_at)
+        results.append({"embedding": ranked, "fused": embedder.get_similar_tables(question, TOP)})
+
+    expected = [table for _, table in FIXTURE_QUESTIONS]
+    return {
+        "model": embedder.model_name,
+        "dim": embedder.dim,
+        "load_seconds": load_seconds,
+        "peak_mb": peak_rss_mb(),
+        "model_mb": peak_rss_mb() - baseline_mb,
+        "tables_per_second": tables_per_second,
+        "query_ms": statistics.median(timings) * 1000,
+        "recall_1": sum(table in result["embedding"][:1] for table, result in zip(expected, results)) / len(expected),
+        "recall_5": sum(table in result["embedding"] for table, result in zip(expected, results)) / len(expected),
+        "fused_5": sum(table in result["fused"][:TOP] for table, result in zip(expected, results)) / len(expected),
+        "top": [result["embedding"] for result in results],
+    }
+
+
+def run_child(spec: str, model_name: str, distractors: int) -> dict:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))}
+    command = [sys.executable, "-m", "benchmarks.bench_embeddings", "--child", spec,
+               "--distractors", str(distractors)] + (["--model-name", model_name] if model_name else [])
+    process = subprocess.run(command, capture_output=True, text=True, env=env)
+    if process.returncode != 0:
+        error = (process.stderr.strip().splitlines() or ["failed"])[-1]
+        return {"error": error}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=DEFAULT_BACKENDS)
+    parser.add_argument("--distractors", type=int, default=500,
+                        help="synthetic tables added to the fixture schema")
+    parser.add_argument("--model-name", help="model for every backend instead of its default, e.g. a local copy")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_backend(args.child, args.model_name, args.distractors)))
+        return
+
+    runs = {spec: run_child(spec, args.model_name, args.distractors) for spec in args.backends}
+    bert_top = runs.get("bert", {}).get("top")
+    print(f"{'backend':>14} {'dim':>5} {'load s':>7} {'peak MB':>8} {'model MB':>9} {'tables/s':>9} "
+          f"{'query ms':>9} {'R@1':>5} {'R@5':>5} {'fused':>6} {'vs bert':>8}")
+    for spec, run in runs.items():
+        if "error" in run:
+            print(f"{spec:>14}  skipped: {run['error']}")
+            continue
+        overlap = "n/a"
+        if bert_top is not None:
+            overlap = f"{statistics.mean(len(set(a) & set(b)) / TOP for a, b in zip(run['top'], bert_top)):.2f}"
+        print(f"{spec:>14} {run['dim']:>5} {run['load_seconds']:>7.2f} {run['peak_mb']:>8.0f} {run['model_mb']:>9.0f} "
+              f"{run['tables_per_second']:>9.0f} {run['query_ms']:>9.2f} {run['recall_1']:>5.2f} "
+              f"{run['recall_5']:>5.2f} {run['fused_5']:>6.2f} {overlap:>8}")
+
+
+if __name__ == "__main__":
+    main()
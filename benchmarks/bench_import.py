@@ -0,0 +1,108 @@
+"""
+Import-time benchmark and startup guard for the CLI and the API.
+
+Imports each entry point in a fresh interpreter (so nothing is already in
+sys.modules) and reports the median import time, the process wall time and
+which heavy dependencies got loaded. Exits non-zero if an entry point is
+slower than its budget or loads a dependency that should only be imported
+on first use.
+
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --repeat 10 --importtime 15
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Loaded on first use only: the embedding stack, autogen, the SQL Server
+# driver and the OpenAI client.
+HEAVY_MODULES = ("torch", "transformers", "sklearn", "autogen", "flaml", "pyodbc", "openai", "tiktoken")
+
+TARGETS = {
+    "cli": "import psqlagent.main",
+    "api": ("import importlib.util\n"
+            "spec = importlib.util.spec_from_file_location('api_main', os.path.join('psqlagent', 'api-main.py'))\n"
+            "spec.loader.exec_module(importlib.util.module_from_spec(spec))"),
+}
+
+DEFAULT_BUDGETS = {"cli": 0.5, "api": 1.5}
+
+SNIPPET = """
+import json, os, sys, time
+started_at = time.perf_counter()
+{code}
+seconds = time.perf_counter() - started_at
+print(json.dumps({{"seconds": seconds, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+# The entry points check these at import; nothing connects during the import.
+PLACEHOLDER_ENV = {"DATABASE_URL": "postgresql://localhost/placeholder", "SCHEMA_NAME": "public",
+                   "OPENAI_APIKEY": "placeholder"}
+
+
+def environment() -> dict:
+    env = {**PLACEHOLDER_ENV, **os.environ}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))
+    return env
+
+
+def import_once(code: str) -> dict:
+    started_at = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", SNIPPET.format(code=code, heavy=HEAVY_MODULES)],
+                            capture_output=True, text=True, env=environment(), check=True).stdout
+    wall = time.perf_counter() - started_at
+    return {**json.loads(output.strip().splitlines()[-1]), "wall": wall}
+
+
+def slowest_imports(code: str, n: int) -> list:
+    """The n modules with the largest cumulative import time, from -X importtime."""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", SNIPPET.format(code=code, heavy=())],
+                            capture_output=True, text=True, env=environment(), check=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):
+            modules.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(modules, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-cli-seconds", type=float, default=DEFAULT_BUDGETS["cli"])
+    parser.add_argument("--max-api-seconds", type=float, default=DEFAULT_BUDGETS["api"])
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="also list the N slowest top-level imports of each target")
+    args = parser.parse_args()
+    budgets = {"cli": args.max_cli_seconds, "api": args.max_api_seconds}
+
+    failures = []
+    print(f"{'target':>6} {'import s':>9} {'wall s':>8} {'budget s':>9}  heavy modules loaded")
+    for target in args.targets:
+        runs = [import_once(TARGETS[target]) for _ in range(args.repeat)]
+        seconds = statistics.median(run["seconds"] for run in runs)
+        wall = statistics.median(run["wall"] for run in runs)
+        heavy = sorted({name for run in runs for name in run["heavy"]})
+        print(f"{target:>6} {seconds:>9.3f} {wall:>8.3f} {budgets[target]:>9.3f}  {', '.join(heavy) or '-'}")
+        if seconds > budgets[target]:
+            failures.append(f"{target} imports in {seconds:.3f}s, over its {budgets[target]:.3f}s budget")
+        if heavy:
+            failures.append(f"{target} imports {', '.join(heavy)} at startup")
+        for cumulative, name in slowest_imports(TARGETS[target], args.importtime) if args.importtime else []:
+            print(f"{'':>6} {cumulative:>9.3f}  {name}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
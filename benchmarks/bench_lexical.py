@@ -0,0 +1,65 @@
+"""
+Micro-benchmark for lexical table retrieval.
+
+Builds the BM25 LexicalIndex over synthetic schemas and times searches
+for synthetic questions, next to the legacy word match that scanned every
+table name per query. "hit" is the share of questions whose top result
+is a table of the entity they ask about.
+
+    python -m benchmarks.bench_lexical --sizes 1000 10000 50000
+"""
+
+import argparse
+import re
+import time
+import numpy as np
+from psqlagent.modules.lexical import LexicalIndex
+from benchmarks.stand_ins import synthetic_tables, synthetic_questions
+
+
+def search_text(name, columns):
+    return " ".join([name, name] + [column for column, _ in columns])
+
+
+def legacy_wordmatch(query, names):
+    query_words = re.sub(r'[,";\']', '', query.lower()).split(" ")
+    return [name for name in names if name.lower() in query_words]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'tables':>8} {'build ms':>10} {'p50 us':>8} {'p99 us':>8} {'legacy us':>10} {'hit':>6}")
+    for size in args.sizes:
+        tables = synthetic_tables(size)
+        questions = synthetic_questions(tables, args.queries)
+        documents = {name: search_text(name, columns) for name, columns, _ in tables}
+
+        start = time.perf_counter()
+        index = LexicalIndex(documents)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        timings, hits = [], 0
+        for question in questions:
+            start = time.perf_counter()
+            results = index.search(question, args.k)
+            timings.append(time.perf_counter() - start)
+            entity = question.split(" of the latest ", 1)[1].rsplit(" records", 1)[0].replace(" ", "_")
+            hits += bool(results) and results[0][0].startswith(entity + "_")
+
+        names = list(documents)
+        start = time.perf_counter()
+        for question in questions[:50]:
+            legacy_wordmatch(question, names)
+        legacy_us = (time.perf_counter() - start) / min(50, len(questions)) * 1e6
+
+        p50, p99 = np.percentile(timings, [50, 99]) * 1e6
+        print(f"{size:>8} {build_ms:>10.1f} {p50:>8.1f} {p99:>8.1f} {legacy_us:>10.1f} {hits / len(questions):>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
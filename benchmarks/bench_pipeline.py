@@ -0,0 +1,315 @@
+"""
+Offline end-to-end benchmark of the /query pipeline and the CLI.
+
+For each size, generates a synthetic schema (SQLite file by default, or a
+bench_<size> schema in Postgres with --database-url), replaces OpenAI with a
+deterministic stub and BERT with a hashing embedder, then runs the API's
+answer_query (per mode) and the CLI's --fast path over synthetic questions.
+Every span recorded by psqlagent.modules.metrics is kept, and throughput plus
+p50/p95/p99 latency per stage are reported and written to a JSON file that
+later runs can be compared against.
+
+Caches are off unless --caches is given, so every query pays every stage.
+
+    python -m benchmarks.bench_pipeline --sizes 10 100 1000 10000 --queries 20
+    python -m benchmarks.bench_pipeline --sizes 100 --compare benchmarks/results/bench_pipeline-<time>.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+
+def configure_environment(workdir: str, caches: bool):
+    # Read by the psqlagent modules at import time, so set before importing them.
+    enabled = "true" if caches else "false"
+    os.environ.setdefault("OPENAI_APIKEY", "benchmark")
+    os.environ.setdefault("DATABASE_URL", "benchmark")
+    os.environ.setdefault("SCHEMA_NAME", "main")
+    os.environ["RESULTS_DIR"] = os.path.join(workdir, "results")
+    os.environ["EMBEDDING_STORE_DIR"] = os.path.join(workdir, "embeddings")
+    os.environ["COMPLETION_CACHE_PATH"] = os.path.join(workdir, "completions.sqlite3")
+    os.environ["COMPLETION_CACHE_ENABLED"] = enabled
+    os.environ["SEMANTIC_CACHE_ENABLED"] = enabled
+    os.environ["RESULT_CACHE_ENABLED"] = enabled
+
+
+def use_offline_tokenizer():
+    from psqlagent.modules import llm
+    from benchmarks.stand_ins import WhitespaceEncoding
+    try:
+        llm.get_encoding(llm.DEFAULT_MODEL)
+    except Exception as e:
+        print(f"tiktoken unavailable ({type(e).__name__}), counting whitespace tokens instead")
+        llm.get_encoding = lambda model=llm.DEFAULT_MODEL: WhitespaceEncoding()
+
+
+def load_api():
+    spec = importlib.util.spec_from_file_location("api_main", os.path.join(REPO_DIR, "psqlagent", "api-main.py"))
+    api = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(api)
+    # The API logs every span; the benchmark only wants the numbers.
+    api.logger.setLevel("WARNING")
+    return api
+
+
+class SpanRecorder:
+    """Keeps every span duration, per stage and per stage and agent."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def __call__(self, stage, labels, seconds):
+        self.samples[stage].append(seconds)
+        if "agent" in labels:
+            self.samples[f"{stage}[{labels['agent']}]"].append(seconds)
+
+    def reset(self):
+        self.samples = defaultdict(list)
+
+    def summary(self) -> dict:
+        return {
+            stage: {
+                "count": len(samples),
+                "mean_ms": float(np.mean(samples) * 1000),
+                "p50_ms": float(np.percentile(samples, 50) * 1000),
+                "p95_ms": float(np.percentile(samples, 95) * 1000),
+                "p99_ms": float(np.percentile(samples, 99) * 1000),
+            }
+            for stage, samples in sorted(self.samples.items())
+        }
+
+
+class Target:
+    """Where a synthetic schema lives and how to reach it."""
+
+    def __init__(self, size: int, tables: list, workdir: str, database_url: str = None):
+        from benchmarks import stand_ins
+        self.size = size
+        self.database_url = database_url
+        if database_url is None:
+            self.url = os.path.join(workdir, f"bench_{size}.sqlite3")
+            self.schema_name = "main"
+            if os.path.exists(self.url):
+                os.remove(self.url)
+            stand_ins.create_sqlite_database(self.url, tables)
+            return
+        import psycopg2
+        self.url = database_url
+        self.schema_name = f"bench_{size}"
+        with psycopg2.connect(database_url) as conn, conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {self.schema_name} CASCADE; CREATE SCHEMA {self.schema_name}")
+            for statement in stand_ins.table_ddl(tables, self.schema_name) + \
+                    stand_ins.table_rows(tables, 10, self.schema_name):
+                cur.execute(statement)
+
+    def blocking_manager(self):
+        if self.database_url is None:
+            from benchmarks.stand_ins import SQLiteManager
+            return SQLiteManager()
+        from psqlagent.modules.db import PostgresManager
+        return PostgresManager(schema_name=self.schema_name)
+
+    def async_manager(self):
+        if self.database_url is None:
+            from psqlagent.modules.db.async_dbmanager import ThreadedDatabaseManager
+            return ThreadedDatabaseManager(self.blocking_manager())
+        from psqlagent.modules.db.async_postgres import AsyncPostgresManager
+        return AsyncPostgresManager(schema_name=self.schema_name)
+
+    async def close(self):
+        if self.database_url is not None:
+            from psqlagent.modules.db import async_postgres
+            await async_postgres.close_pools()
+
+    def drop(self):
+        if self.database_url is None:
+            os.remove(self.url)
+            return
+        import psycopg2
+        with psycopg2.connect(self.database_url) as conn, conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {self.schema_name} CASCADE")
+
+
+async def run_queries(api, target, questions, mode: str, concurrency: int):
+    from psqlagent.modules.metrics import span
+    api.create_database_manager = target.async_manager
+    api.DATABASE_URL = target.url
+    api.SCHEMA_NAME = target.schema_name
+    api.app.state.query_semaphore = asyncio.Semaphore(api.QUERY_CONCURRENCY)
+    limit = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def run_one(question):
+        nonlocal failures
+        async with limit:
+            with span("query", mode=mode):
+                success, _, _ = await api.answer_query(question, mode)
+            failures += not success
+
+    await asyncio.gather(*(run_one(question) for question in questions))
+    return failures
+
+
+def run_cli(api, target, questions):
+    """The CLI's --fast path: whole-schema context and a single LLM call."""
+    from psqlagent.modules.fast_path import run_fast_path
+    from psqlagent.modules.llm import add_cap_ref
+    from psqlagent.modules.metrics import span
+    failures = 0
+    with target.blocking_manager() as db:
+        db.connect_with_url(target.url)
+        for question in questions:
+            with span("cli"):
+                table_definitions = db.get_schema_context(question)
+                prompt = add_cap_ref(
+                    question,
+                    f"Use these {api.POSTGRES_TABLE_DEFINITIONS_CAP_REF} to satisfy the database query. "
+                    f"Have in mind the SCHEMA_NAME is {target.schema_name}",
+                    api.POSTGRES_TABLE_DEFINITIONS_CAP_REF,
+                    table_definitions)
+                failures += not run_fast_path(prompt, db).succeeded
+    return failures
+
+
+def measure(recorder, fn, verbose: bool = False) -> dict:
+    recorder.reset()
+    # The orchestrator and autogen print every turn; keep that out of the report.
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started_at = time.perf_counter()
+    with output:
+        failures = fn()
+    wall_seconds = time.perf_counter() - started_at
+    queries = len(recorder.samples.get("query") or recorder.samples.get("cli") or [])
+    return {
+        "wall_seconds": wall_seconds,
+        "queries": queries,
+        "failures": failures,
+        "throughput_qps": queries / wall_seconds if wall_seconds else 0.0,
+        "stages": recorder.summary(),
+    }
+
+
+def print_run(size: int, pipeline: str, run: dict):
+    print(f"\n{size} tables, {pipeline}: {run['queries']} queries in {run['wall_seconds']:.2f}s "
+          f"({run['throughput_qps']:.2f} q/s, {run['failures']} failed)")
+    print(f"  {'stage':<40} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for stage, stats in run["stages"].items():
+        print(f"  {stage:<40} {stats['count']:>6} {stats['p50_ms']:>10.2f} "
+              f"{stats['p95_ms']:>10.2f} {stats['p99_ms']:>10.2f}")
+
+
+def compare(baseline: dict, current: dict):
+    print(f"\nCompared with {baseline.get('created_at')} ({baseline.get('git_commit')})")
+    print(f"  {'size':>6} {'pipeline':<12} {'stage':<40} {'p50 ms':>18} {'p95 ms':>18} {'change':>8}")
+    for size, pipelines in current["runs"].items():
+        for pipeline, run in pipelines.items():
+            baseline_run = baseline.get("runs", {}).get(size, {}).get(pipeline)
+            if baseline_run is None:
+                continue
+            for stage, stats in run["stages"].items():
+                before = baseline_run["stages"].get(stage)
+                if before is None:
+                    continue
+                change = (stats["p50_ms"] / before["p50_ms"] - 1) * 100 if before["p50_ms"] else 0.0
+                print(f"  {size:>6} {pipeline:<12} {stage:<40} "
+                      f"{before['p50_ms']:>8.2f}->{stats['p50_ms']:<8.2f} "
+                      f"{before['p95_ms']:>8.2f}->{stats['p95_ms']:<8.2f} {change:>+7.1f}%")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10_000])
+    parser.add_argument("--queries", type=int, default=20, help="questions per size and pipeline")
+    parser.add_argument("--modes", nargs="+", default=["agents", "fast"], help="/query modes to run")
+    parser.add_argument("--no-cli", action="store_true", help="skip the CLI pipeline")
+    parser.add_argument("--concurrency", type=int, default=1, help="concurrent /query requests")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated OpenAI round trip")
+    parser.add_argument("--caches", action="store_true",
+                        help="keep the completion, semantic and result caches on")
+    parser.add_argument("--database-url", help="Postgres URL; the default is a SQLite stand-in")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/bench_pipeline-<time>.json)")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="psqlagent-bench-")
+    configure_environment(workdir, args.caches)
+    use_offline_tokenizer()
+
+    from benchmarks import stand_ins
+    from psqlagent.modules import metrics
+    from psqlagent.modules.semantic_cache import SemanticCache
+    from psqlagent.modules.subschema import ColumnRetriever
+    api = load_api()
+    stand_ins.StubOpenAI(args.llm_latency_ms).install()
+    embedder = stand_ins.hashing_embedder(os.environ["EMBEDDING_STORE_DIR"])
+    api.app.state.database_embedder = embedder
+    api.app.state.semantic_cache = SemanticCache(embedder)
+    api.app.state.column_retriever = ColumnRetriever(embedder)
+    recorder = SpanRecorder()
+    metrics.span_listeners.append(recorder)
+    # One loop for the whole run: asyncpg pools can't move between loops.
+    loop = asyncio.new_event_loop()
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "args": vars(args),
+        "runs": {},
+    }
+    for size in args.sizes:
+        tables = stand_ins.synthetic_tables(size)
+        questions = stand_ins.synthetic_questions(tables, args.queries)
+        target = Target(size, tables, workdir, args.database_url)
+        runs = results["runs"][str(size)] = {}
+        try:
+            for mode in args.modes:
+                runs[f"query:{mode}"] = measure(recorder, lambda: loop.run_until_complete(
+                    run_queries(api, target, questions, mode, args.concurrency)), args.verbose)
+                print_run(size, f"query:{mode}", runs[f"query:{mode}"])
+            if not args.no_cli:
+                runs["cli"] = measure(recorder, lambda: run_cli(api, target, questions), args.verbose)
+                print_run(size, "cli", runs["cli"])
+        finally:
+            loop.run_until_complete(target.close())
+            target.drop()
+    loop.close()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Calibration of the semantic cache threshold.
+
+Embeds pairs of fixture questions that are paraphrases (same SQL) and
+pairs that are not (same shape, different table, filter or measure) with
+each backend, and reports the cosine similarities of both. "calibrated"
+is the lowest threshold that matches no non-paraphrase, "recall" the
+share of paraphrases it still matches, and "guarded fp" the
+non-paraphrases above the configured threshold that the same tables and
+literals guard lets through. Put the calibrated values in SEMANTIC_CACHE_THRESHOLDS.
+
+    python -m benchmarks.bench_semantic_cache
+    python -m benchmarks.bench_semantic_cache --backends bert sentence onnx
+
+Backends are EMBEDDING_BACKEND values plus "hashing" (no model); models
+are downloaded on first use.
+"""
+
+import argparse
+import statistics
+import numpy as np
+from benchmarks.stand_ins import HashingBackend, fixture_schema
+from psqlagent.modules.embedding_backends import create_embedding_backend, DEFAULT_MODELS
+from psqlagent.modules.embeddings import DatabaseEmbedder
+from psqlagent.modules.semantic_cache import SemanticCache, normalize, question_literals, semantic_cache_threshold
+
+PARAPHRASE_PAIRS = [
+    ("How many customers signed up last month?", "What is the number of new customer signups in the previous month?"),
+    ("Which country has the most customers?", "In which country do we have the largest number of customers?"),
+    ("How many orders are still pending?", "Count the orders whose status is pending"),
+    ("List the most expensive products", "Show the products with the highest list price"),
+    ("Which vendors are based in Germany?", "List the suppliers located in Germany"),
+    ("What is the average delivery time per carrier?", "For each carrier, how long do deliveries take on average?"),
+    ("How much money did we refund last year?", "What was the total refunded amount in the last year?"),
+    ("Which employees earn more than their manager?", "List the staff whose salary is higher than their manager's"),
+    ("What is the total marketing spend per channel?", "How much did we spend on campaigns in each channel?"),
+    ("How many support tickets are still open?", "Count the support tickets that have not been closed"),
+    ("What is the average rating of each product?", "Show the mean review rating per product"),
+    ("Which invoices are overdue?", "List the invoices past their due date"),
+]
+NON_PARAPHRASE_PAIRS = [
+    ("How many customers signed up last month?", "How many customers signed up this month?"),
+    ("How many customers signed up last month?", "How many orders were placed last month?"),
+    ("Which country has the most customers?", "Which country has the most suppliers?"),
+    ("How many orders are still pending?", "How many orders were cancelled?"),
+    ("List the most expensive products", "List the cheapest products"),
+    ("Which vendors are based in Germany?", "Which vendors are based in France?"),
+    ("What is the average delivery time per carrier?", "How many shipments does each carrier handle?"),
+    ("How much money did we refund last year?", "How much money did we receive in payments last year?"),
+    ("What is the total marketing spend per channel?", "How many leads did each campaign convert?"),
+    ("How many support tickets are still open?", "How many support tickets were opened today?"),
+    ("What is the average rating of each product?", "What is the average price of each product?"),
+    ("Which invoices are overdue?", "Which subscriptions were cancelled?"),
+]
+
+
+def similarities(embedder, pairs) -> np.ndarray:
+    first = normalize(embedder.embed_texts([a for a, _ in pairs]))
+    second = normalize(embedder.embed_texts([b for _, b in pairs]))
+    return (first * second).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["bert", "sentence", "onnx", "hashing"])
+    parser.add_argument("--model-name", help="model for every backend instead of its default, e.g. a local copy")
+    args = parser.parse_args()
+
+    schema = fixture_schema()
+    print(f"{'backend':>10} {'para min':>9} {'para med':>9} {'non max':>8} {'non med':>8} "
+          f"{'calibrated':>11} {'recall':>7} {'configured':>11} {'recall':>7} {'fp':>4} {'guarded fp':>11}")
+    for backend_name in args.backends:
+        try:
+            backend = HashingBackend() if backend_name == "hashing" else create_embedding_backend(
+                backend_name, model_name=args.model_name or DEFAULT_MODELS[backend_name])
+        except Exception as e:
+            print(f"{backend_name:>10}  skipped: {e}")
+            continue
+        embedder = DatabaseEmbedder(store_dir=None, backend=backend)
+        cache = SemanticCache(embedder, path=None)
+        paraphrases = similarities(embedder, PARAPHRASE_PAIRS)
+        non_paraphrases = similarities(embedder, NON_PARAPHRASE_PAIRS)
+        calibrated = float(non_paraphrases.max()) + 0.005
+        configured = semantic_cache_threshold(backend.kind)
+        false_positives = [pair for pair, score in zip(NON_PARAPHRASE_PAIRS, non_paraphrases) if score >= configured]
+        guarded = [(a, b) for a, b in false_positives
+                   if cache.mentioned_tables(schema, a) == cache.mentioned_tables(schema, b)
+                   and question_literals(a) == question_literals(b)]
+        print(f"{backend_name:>10} {paraphrases.min():>9.3f} {statistics.median(paraphrases):>9.3f} "
+              f"{non_paraphrases.max():>8.3f} {statistics.median(non_paraphrases):>8.3f} "
+              f"{calibrated:>11.3f} {(paraphrases >= calibrated).mean():>7.2f} "
+              f"{configured:>11.3f} {(paraphrases >= configured).mean():>7.2f} "
+              f"{len(false_positives):>4} {len(guarded):>11}")
+
+
+if __name__ == "__main__":
+    main()
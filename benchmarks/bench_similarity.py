@@ -0,0 +1,73 @@
+"""
+Micro-benchmark for table similarity search.
+
+Compares the per-pair sklearn loop the embedder used to run with the
+vectorized EmbeddingIndex (exact and, when hnswlib is installed, ANN)
+on random embeddings. The legacy column times a single pass of the loop;
+the old code repeated that pass once per table.
+
+    python -m benchmarks.bench_similarity --sizes 100 10000 100000
+"""
+
+import argparse
+import time
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from psqlagent.modules.retrieval import EmbeddingIndex
+
+DIM = 768
+
+
+def time_call(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000
+
+
+def legacy_search(query, embeddings, k):
+    similarities = {
+        table: cosine_similarity(query, table_embeddings)[0][0]
+        for table, table_embeddings in embeddings.items()
+    }
+    return sorted(similarities, key=similarities.get, reverse=True)[:k]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--legacy-max", type=int, default=10_000,
+                        help="skip the legacy per-pair loop above this many tables")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    query = rng.standard_normal((1, DIM)).astype(np.float32)
+    print(f"{'tables':>8} {'legacy ms':>10} {'exact ms':>10} {'ann ms':>10} {'build ms':>10}")
+    for size in args.sizes:
+        matrix = rng.standard_normal((size, DIM)).astype(np.float32)
+        names = [f"table_{i}" for i in range(size)]
+
+        start = time.perf_counter()
+        exact = EmbeddingIndex(names, matrix, ann_threshold=0)
+        build_ms = (time.perf_counter() - start) * 1000
+        exact_ms = time_call(lambda: exact.search(query, args.k), args.repeat)
+
+        ann = EmbeddingIndex(names, matrix, ann_threshold=1)
+        ann_ms = time_call(lambda: ann.search(query, args.k), args.repeat) if ann.ann is not None else None
+
+        legacy_ms = None
+        if size <= args.legacy_max:
+            embeddings = {name: matrix[i:i + 1] for i, name in enumerate(names)}
+            legacy_ms = time_call(lambda: legacy_search(query, embeddings, args.k), 1)
+
+        def fmt(value):
+            return f"{value:10.2f}" if value is not None else f"{'n/a':>10}"
+        print(f"{size:>8} {fmt(legacy_ms)} {fmt(exact_ms)} {fmt(ann_ms)} {fmt(build_ms)}")
+
+
+if __name__ == "__main__":
+    main()
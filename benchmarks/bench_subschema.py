@@ -0,0 +1,100 @@
+"""
+Benchmark for column-level retrieval with foreign-key expansion.
+
+Answers the fixture questions (stand_ins.FIXTURE_QUESTIONS and the join
+questions in FIXTURE_JOIN_QUESTIONS) against the fixture schema, padded
+with synthetic distractor tables, and compares the TABLE_DEFINITIONS
+context built from the top 3 tables (the table path) with the one built
+from the sub-schema, which merges the table path's tables in whole. "recall" is the share of needed tables in the
+context, "complete" the share of questions with every needed table, and
+"columns" the mean number of columns shown.
+
+    python -m benchmarks.bench_subschema
+    python -m benchmarks.bench_subschema --backend sentence --distractors 2000
+
+The hashing backend needs no model; other backends are EMBEDDING_BACKEND
+values and are downloaded on first use.
+"""
+
+import argparse
+import statistics
+import time
+from benchmarks.bench_pipeline import use_offline_tokenizer
+from benchmarks.stand_ins import (
+    FIXTURE_JOIN_QUESTIONS, FIXTURE_QUESTIONS, HashingBackend, fixture_schema, synthetic_tables)
+from psqlagent.modules import llm
+from psqlagent.modules.db.schema import Column, ForeignKey, Table
+from psqlagent.modules.embedding_backends import create_embedding_backend
+from psqlagent.modules.embeddings import DatabaseEmbedder
+from psqlagent.modules.schema_context import SchemaContextBuilder, SCHEMA_CONTEXT_TOKEN_BUDGET
+from psqlagent.modules.subschema import ColumnRetriever
+
+
+def add_distractors(schema, n_tables: int):
+    for name, columns, foreign_keys in synthetic_tables(n_tables):
+        schema.tables[name] = Table(
+            name=name, primary_key=["id"],
+            columns=[Column(name=column, data_type=data_type) for column, data_type in columns],
+            foreign_keys=[ForeignKey(name=f"{name}_{column}_fkey", columns=[column], ref_table=ref_table,
+                                     ref_columns=["id"]) for column, ref_table in foreign_keys])
+
+
+def shown_tables(context: str, schema) -> set:
+    return {line.split("(", 1)[0] for line in context.splitlines()} & set(schema.tables)
+
+
+def shown_columns(context: str) -> int:
+    return sum(len([part for part in line.split("(", 1)[1].rstrip(")").split(", ") if not part.startswith("+")])
+               for line in context.splitlines()[1:] if "(" in line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="hashing")
+    parser.add_argument("--model-name")
+    parser.add_argument("--distractors", type=int, default=500)
+    parser.add_argument("--token-budget", type=int, default=SCHEMA_CONTEXT_TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    use_offline_tokenizer()
+    schema = fixture_schema()
+    add_distractors(schema, args.distractors)
+    backend = HashingBackend() if args.backend == "hashing" else \
+        create_embedding_backend(args.backend, model_name=args.model_name)
+    embedder = DatabaseEmbedder(store_dir=None, backend=backend)
+    embedder.sync_tables(schema.definitions(), search_texts=schema.search_texts())
+    column_retriever = ColumnRetriever(embedder)
+    started_at = time.perf_counter()
+    column_retriever.sync(schema)
+    print(f"{len(schema.tables)} tables, {len(schema.columns_by_key())} columns indexed "
+          f"in {time.perf_counter() - started_at:.2f}s with {embedder.model_name}")
+
+    builder = SchemaContextBuilder(args.token_budget)
+    questions = [(question, [table]) for question, table in FIXTURE_QUESTIONS] + FIXTURE_JOIN_QUESTIONS
+    print(f"{'questions':>10} {'path':>10} {'tokens':>7} {'columns':>8} {'recall':>7} {'complete':>9} {'ms':>7}")
+    for label, subset in [("single", questions[:len(FIXTURE_QUESTIONS)]),
+                          ("join", questions[len(FIXTURE_QUESTIONS):])]:
+        for path in ["tables", "subschema"]:
+            tokens, columns, recall, complete, timings = [], [], [], [], []
+            for question, needed in subset:
+                started_at = time.perf_counter()
+                if path == "tables":
+                    tables = [schema.tables[name] for name in embedder.get_similar_tables(question)]
+                    context = builder.build(tables, question)
+                else:
+                    subschema = column_retriever.subschema(schema, question, embedder.get_similar_tables(question))
+                    context = builder.build([schema.tables[name] for name in subschema.tables], question,
+                                            subschema.columns)
+                timings.append(time.perf_counter() - started_at)
+                found = shown_tables(context, schema) & set(needed)
+                tokens.append(llm.count_tokens(context))
+                columns.append(shown_columns(context))
+                recall.append(len(found) / len(needed))
+                complete.append(len(found) == len(needed))
+            print(f"{label:>10} {path:>10} {statistics.mean(tokens):>7.0f} {statistics.mean(columns):>8.1f} "
+                  f"{statistics.mean(recall):>7.2f} {statistics.mean(complete):>9.2f} "
+                  f"{statistics.median(timings) * 1000:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
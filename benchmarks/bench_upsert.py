@@ -0,0 +1,94 @@
+"""
+Throughput benchmark for bulk upserts.
+
+Loads the same rows (half updates of existing ids, half inserts) through
+the per-row upsert, which commits every row, and through upsert_many at
+each batch size, into a scratch table that is dropped afterwards.
+
+    python -m benchmarks.bench_upsert --database-url postgresql://... --rows 100000
+    python -m benchmarks.bench_upsert --engine SqlServer --schema dbo --database-url "Driver=..."
+"""
+
+import argparse
+import datetime
+import os
+import random
+import time
+from psqlagent.modules import db as database
+
+TABLE = "psqlagent_bench_upsert"
+
+
+def make_rows(n_rows: int, n_existing: int, seed: int = 42) -> list:
+    """n_rows rows; the first half reuse ids 1..n_existing, the rest are new."""
+    rng = random.Random(seed)
+    now = datetime.datetime(2024, 1, 1)
+    n_updates = min(n_rows // 2, n_existing)
+    ids = rng.sample(range(1, n_existing + 1), n_updates) + list(range(n_existing + 1, n_existing + 1 + n_rows - n_updates))
+    return [{"id": row_id, "name": f"name {row_id}", "amount": round(rng.uniform(0, 1000), 2),
+             "note": None if row_id % 7 == 0 else f"note \"{row_id}\", updated",
+             "updated_at": now + datetime.timedelta(seconds=row_id)} for row_id in ids]
+
+
+def execute(manager, sql: str, fetch: bool = False):
+    with manager.conn.cursor() as cur:
+        cur.execute(sql)
+        row = cur.fetchone() if fetch else None
+    manager.conn.commit()
+    return row
+
+
+def reset_table(manager, table: str, n_existing: int):
+    # TIMESTAMP is a row version in SQL Server.
+    timestamp_type = "DATETIME2" if manager.engine == "sqlserver" else "TIMESTAMP"
+    execute(manager, f"DROP TABLE IF EXISTS {table}")
+    execute(manager, f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, name VARCHAR(100), "
+                     f"amount NUMERIC(12, 2), note VARCHAR(200), updated_at {timestamp_type})")
+    manager.upsert_many(table, make_rows(n_existing, 0, seed=1))
+
+
+def measure(manager, table: str, rows: list, n_existing: int, load) -> dict:
+    reset_table(manager, table, n_existing)
+    started_at = time.perf_counter()
+    load(rows)
+    seconds = time.perf_counter() - started_at
+    count = execute(manager, f"SELECT COUNT(*) FROM {table}", fetch=True)[0]
+    return {"rows": len(rows), "seconds": seconds, "rows_per_second": len(rows) / seconds, "table_rows": count}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--engine", default="Postgres", help="Postgres or SqlServer")
+    parser.add_argument("--schema", default="public")
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--per-row-rows", type=int, default=2_000,
+                        help="rows for the per-row path, which is too slow for the full --rows")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[500, 5_000, 20_000])
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("--database-url or DATABASE_URL is required")
+
+    table = f"{args.schema}.{TABLE}"
+    manager = database.create_database_manager(args.engine, args.schema)
+    with manager:
+        manager.connect_with_url(args.database_url)
+        try:
+            print(f"{'method':>22} {'rows':>8} {'seconds':>9} {'rows/s':>10} {'table rows':>11}")
+            per_row = make_rows(args.per_row_rows, args.per_row_rows // 2)
+            result = measure(manager, table, per_row, args.per_row_rows // 2,
+                             lambda rows: [manager.upsert(table, row) for row in rows])
+            print(f"{'upsert (per row)':>22} {result['rows']:>8} {result['seconds']:>9.2f} "
+                  f"{result['rows_per_second']:>10.0f} {result['table_rows']:>11}")
+            rows = make_rows(args.rows, args.rows // 2)
+            for batch_size in args.batch_sizes:
+                result = measure(manager, table, rows, args.rows // 2,
+                                 lambda rows: manager.upsert_many(table, rows, batch_size=batch_size))
+                print(f"{f'upsert_many ({batch_size})':>22} {result['rows']:>8} {result['seconds']:>9.2f} "
+                      f"{result['rows_per_second']:>10.0f} {result['table_rows']:>11}")
+        finally:
+            execute(manager, f"DROP TABLE IF EXISTS {table}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Offline stand-ins for the benchmarks: a SQLite-backed DatabaseManager, a
+hashing embedding backend for the DatabaseEmbedder, a deterministic
+replacement for the OpenAI API and a synthetic schema generator.
+"""
+
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+from psqlagent.modules.db.dbmanager import DatabaseManager
+from psqlagent.modules.db.results import ResultHandle, stream_cursor
+from psqlagent.modules.db.schema import Column, ForeignKey, Schema, Table
+from psqlagent.modules.embedding_backends import EmbeddingBackend
+
+WORDS = [
+    "customer", "order", "invoice", "payment", "product", "supplier", "shipment", "warehouse",
+    "employee", "department", "account", "ledger", "campaign", "lead", "ticket", "contract",
+    "region", "store", "vendor", "refund", "subscription", "plan", "device", "session",
+]
+COLUMN_WORDS = [
+    "name", "status", "amount", "total", "quantity", "price", "email", "phone", "city", "country",
+    "description", "category", "score", "rating", "notes", "code", "currency", "discount",
+]
+COLUMN_TYPES = ["INTEGER", "TEXT", "NUMERIC(10,2)", "TIMESTAMP", "BOOLEAN", "VARCHAR(255)"]
+SQL_TYPES = {"INTEGER": "1", "TEXT": "'x'", "NUMERIC(10,2)": "1.5", "TIMESTAMP": "'2024-01-01'",
+             "BOOLEAN": "true", "VARCHAR(255)": "'y'"}
+
+
+# A small hand-written schema with questions whose answer needs a known
+# table, for measuring retrieval recall: (table, columns, comment).
+FIXTURE_TABLES = [
+    ("customers", ["customer_id", "first_name", "last_name", "email", "signup_date", "country"],
+     "People and companies that buy from us"),
+    ("orders", ["order_id", "customer_id", "order_date", "status", "total_amount"], "Purchase orders placed by customers"),
+    ("order_items", ["order_id", "product_id", "quantity", "unit_price", "discount"], "Line items of each order"),
+    ("products", ["product_id", "name", "category_id", "supplier_id", "list_price", "sku"], "Catalogue of items for sale"),
+    ("categories", ["category_id", "name", "parent_category_id"], "Product category tree"),
+    ("suppliers", ["supplier_id", "company_name", "contact_email", "country"], "Vendors we buy stock from"),
+    ("inventory", ["product_id", "warehouse_id", "quantity_on_hand", "reorder_level"], "Stock levels per warehouse"),
+    ("warehouses", ["warehouse_id", "city", "capacity", "manager_id"], "Storage locations"),
+    ("shipments", ["shipment_id", "order_id", "carrier", "shipped_at", "delivered_at", "tracking_number"],
+     "Deliveries of orders to customers"),
+    ("payments", ["payment_id", "order_id", "amount", "method", "paid_at"], "Money received for orders"),
+    ("refunds", ["refund_id", "payment_id", "amount", "reason", "refunded_at"], "Money returned to customers"),
+    ("invoices", ["invoice_id", "order_id", "issued_at", "due_date", "amount_due"], "Bills sent to customers"),
+    ("employees", ["employee_id", "full_name", "department_id", "hire_date", "salary", "manager_id"], "Staff"),
+    ("departments", ["department_id", "name", "budget"], "Organisational units"),
+    ("support_tickets", ["ticket_id", "customer_id", "subject", "priority", "opened_at", "closed_at"],
+     "Customer support requests"),
+    ("product_reviews", ["review_id", "product_id", "customer_id", "rating", "review_text"], "Customer ratings of products"),
+    ("marketing_campaigns", ["campaign_id", "name", "channel", "start_date", "end_date", "spend"], "Advertising campaigns"),
+    ("campaign_leads", ["lead_id", "campaign_id", "email", "converted"], "Prospects generated by campaigns"),
+    ("subscriptions", ["subscription_id", "customer_id", "plan_id", "started_at", "cancelled_at"], "Recurring customer plans"),
+    ("plans", ["plan_id", "name", "monthly_price", "billing_period"], "Subscription price plans"),
+    ("web_sessions", ["session_id", "customer_id", "started_at", "page_views", "device"], "Website visits"),
+    ("coupons", ["coupon_id", "code", "percent_off", "expires_at"], "Discount codes"),
+    ("exchange_rates", ["currency", "rate_to_usd", "valid_on"], "Daily currency conversion rates"),
+    ("tax_rates", ["country", "region", "rate"], "Sales tax per region"),
+]
+FIXTURE_QUESTIONS = [
+    ("How many customers signed up last month?", "customers"),
+    ("Which country has the most customers?", "customers"),
+    ("What was the total revenue from orders in March?", "orders"),
+    ("How many orders are still pending?", "orders"),
+    ("Which products sell the most units?", "order_items"),
+    ("What is the average discount applied per line item?", "order_items"),
+    ("List the most expensive products", "products"),
+    ("Which vendors are based in Germany?", "suppliers"),
+    ("Which items are below their reorder level?", "inventory"),
+    ("How much storage capacity does each city have?", "warehouses"),
+    ("What is the average delivery time per carrier?", "shipments"),
+    ("Which payment methods are used most?", "payments"),
+    ("How much money did we return to customers this year?", "refunds"),
+    ("What are the most common reasons for refunds?", "refunds"),
+    ("Which bills are past their due date?", "invoices"),
+    ("What is the average salary per department?", "employees"),
+    ("Who was hired most recently?", "employees"),
+    ("Which department has the largest budget?", "departments"),
+    ("How many high priority support requests are open?", "support_tickets"),
+    ("Which products have the worst ratings?", "product_reviews"),
+    ("How much did we spend on advertising per channel?", "marketing_campaigns"),
+    ("What share of prospects converted?", "campaign_leads"),
+    ("How many subscriptions were cancelled this quarter?", "subscriptions"),
+    ("Which price plan is the cheapest per month?", "plans"),
+    ("How many page views do mobile visits get?", "web_sessions"),
+    ("Which discount codes expire this week?", "coupons"),
+    ("What is today's euro to dollar conversion rate?", "exchange_rates"),
+    ("What is the sales tax in California?", "tax_rates"),
+]
+
+
+# Questions that need a join, with every table the SQL has to touch.
+FIXTURE_JOIN_QUESTIONS = [
+    ("Total refunded amount per customer country", ["refunds", "payments", "orders", "customers"]),
+    ("Which suppliers' products have the worst review ratings?", ["product_reviews", "products", "suppliers"]),
+    ("Revenue per product category last month", ["order_items", "orders", "products", "categories"]),
+    ("Which carriers deliver the orders of customers in France?", ["shipments", "orders", "customers"]),
+    ("Average salary of employees managing warehouses per city", ["warehouses", "employees"]),
+    ("How many support tickets do customers on the premium plan open?",
+     ["support_tickets", "customers", "subscriptions", "plans"]),
+    ("Conversion rate of leads per campaign channel", ["campaign_leads", "marketing_campaigns"]),
+    ("Stock on hand per product category", ["inventory", "products", "categories"]),
+]
+
+# Foreign keys the fixture's column names don't imply.
+FIXTURE_FOREIGN_KEYS = {
+    ("categories", "parent_category_id"): "categories",
+    ("warehouses", "manager_id"): "employees",
+    ("employees", "manager_id"): "employees",
+}
+
+
+def fixture_schema() -> Schema:
+    """
+    FIXTURE_TABLES as a Schema, so its definitions are embedded like a real
+    one. A leading x_id column is the primary key and other x_id columns
+    reference the table first keyed by them.
+    """
+    keys = {}
+    for name, columns, _ in FIXTURE_TABLES:
+        if columns[0].endswith("_id"):
+            keys.setdefault(columns[0], name)
+    tables = {}
+    for name, columns, comment in FIXTURE_TABLES:
+        primary_key = [columns[0]] if keys.get(columns[0]) == name else []
+        foreign_keys = []
+        for column in columns:
+            ref_table = FIXTURE_FOREIGN_KEYS.get((name, column)) or keys.get(column)
+            if ref_table is not None and column not in primary_key:
+                ref_column = next(key for key, table in keys.items() if table == ref_table)
+                foreign_keys.append(ForeignKey(name=f"{name}_{column}_fkey", columns=[column],
+                                               ref_table=ref_table, ref_columns=[ref_column]))
+        tables[name] = Table(name=name, comment=comment, primary_key=primary_key, foreign_keys=foreign_keys,
+                             columns=[Column(name=column, data_type="integer" if column.endswith("_id") else "text")
+                                      for column in columns])
+    return Schema(name="fixture", tables=tables)
+
+
+def synthetic_tables(n_tables: int, seed: int = 42) -> list:
+    """
+    Deterministic table specs: (name, [(column, type)], [(column, ref_table)]).
+    Every table has an integer id; about a third reference an earlier table.
+    """
+    rng = random.Random(seed)
+    tables = []
+    for idx in range(n_tables):
+        name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{idx}"
+        columns = [("id", "INTEGER")]
+        foreign_keys = []
+        if tables and rng.random() < 0.35:
+            ref_table = rng.choice(tables)[0]
+            columns.append((f"{ref_table.rsplit('_', 1)[0]}_id", "INTEGER"))
+            foreign_keys.append((columns[-1][0], ref_table))
+        for col_idx in range(rng.randint(4, 24)):
+            columns.append((f"{rng.choice(COLUMN_WORDS)}_{col_idx}", rng.choice(COLUMN_TYPES)))
+        columns.append(("created_at", "TIMESTAMP"))
+        tables.append((name, columns, foreign_keys))
+    return tables
+
+
+def synthetic_questions(tables: list, n_questions: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(n_questions):
+        name, columns, _ = rng.choice(tables)
+        words = name.rsplit("_", 1)[0].replace("_", " ")
+        column = rng.choice(columns[1:])[0].rsplit("_", 1)[0]
+        questions.append(f"show the {column} of the latest {words} records")
+    return questions
+
+
+def table_ddl(tables: list, schema: str = None) -> list:
+    prefix = f"{schema}." if schema else ""
+    statements = []
+    for name, columns, foreign_keys in tables:
+        definitions = [f"{column} {data_type}" + (" PRIMARY KEY" if column == "id" else "")
+                       for column, data_type in columns]
+        definitions += [f"FOREIGN KEY ({column}) REFERENCES {prefix}{ref_table} (id)"
+                        for column, ref_table in foreign_keys]
+        statements.append(f"CREATE TABLE {prefix}{name} ({', '.join(definitions)})")
+    return statements
+
+
+def table_rows(tables: list, rows_per_table: int, schema: str = None) -> list:
+    prefix = f"{schema}." if schema else ""
+    statements = []
+    for name, columns, _ in tables:
+        for row in range(1, rows_per_table + 1):
+            values = [str(row) if column == "id" or column.endswith("_id") else SQL_TYPES[data_type]
+                      for column, data_type in columns]
+            statements.append(f"INSERT INTO {prefix}{name} VALUES ({', '.join(values)})")
+    return statements
+
+
+def create_sqlite_database(path: str, tables: list, rows_per_table: int = 10):
+    conn = sqlite3.connect(path)
+    conn.executescript(";\n".join(["BEGIN"] + table_ddl(tables) + table_rows(tables, rows_per_table) + ["COMMIT"]))
+    conn.close()
+
+
+class SQLiteManager(DatabaseManager):
+    """
+    Stand-in for the Postgres and SQL Server managers on a SQLite file.
+    SQLite keeps no per-table write counters, so results are never cached.
+    """
+    engine = "sqlite"
+
+    def __init__(self, schema_name="main"):
+        self.conn = None
+        self.url = None
+        self.schema_name = schema_name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.conn:
+            self.conn.close()
+
+    def connect_with_url(self, url):
+        self.url = url
+        self.conn = sqlite3.connect(url, check_same_thread=False)
+
+    def execute_sql(self, sql):
+        try:
+            cur = self.conn.execute(sql)
+            if cur.description is None:
+                self.conn.commit()
+                return ResultHandle.for_statement(cur.rowcount)
+            return stream_cursor(cur)
+        except Exception as e:
+            self.conn.rollback()
+            print("Error executing SQL:", e)
+
+    def explain(self, sql):
+        return self.conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+
+    def get_schema_version(self):
+        return self.conn.execute("PRAGMA schema_version").fetchone()[0]
+
+    def introspect_schema(self, table_names: list = None) -> Schema:
+        # The pragma table functions return every table's details in one query each.
+        names = [row[0] for row in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+            if table_names is None or row[0] in table_names]
+        tables = {name: {"name": name, "columns": [], "primary_key": [], "foreign_keys": [], "indexes": []}
+                  for name in names}
+        for table, column, data_type, not_null, pk in self.conn.execute(
+                "SELECT m.name, p.name, p.type, p.\"notnull\", p.pk FROM sqlite_master m "
+                "JOIN pragma_table_info(m.name) p WHERE m.type = 'table' ORDER BY m.name, p.cid"):
+            if table in tables:
+                tables[table]["columns"].append({"name": column, "data_type": data_type.lower(),
+                                                 "nullable": not not_null})
+                if pk:
+                    tables[table]["primary_key"].append(column)
+        for table, fk_id, ref_table, column, ref_column in self.conn.execute(
+                "SELECT m.name, f.id, f.\"table\", f.\"from\", f.\"to\" FROM sqlite_master m "
+                "JOIN pragma_foreign_key_list(m.name) f WHERE m.type = 'table' ORDER BY m.name, f.id, f.seq"):
+            if table in tables:
+                foreign_keys = tables[table]["foreign_keys"]
+                if not foreign_keys or foreign_keys[-1]["name"] != f"{table}_fk_{fk_id}":
+                    foreign_keys.append({"name": f"{table}_fk_{fk_id}", "columns": [],
+                                         "ref_table": ref_table, "ref_columns": []})
+                foreign_keys[-1]["columns"].append(column)
+                foreign_keys[-1]["ref_columns"].append(ref_column)
+        return Schema.from_dicts(self.schema_name, list(tables.values()))
+
+
+class HashingBackend(EmbeddingBackend):
+    """
+    Embeddings that are signed hashes of the text's words instead of model
+    outputs: deterministic, fast and needs no model download.
+    """
+    def __init__(self, dim: int = 768):
+        self.name = "hashing"
+        self.kind = "hashing"
+        self.dim = dim
+
+    def token_lengths(self, texts: list) -> list:
+        return [len(text.split()) for text in texts]
+
+    def embed(self, texts: list) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for idx, text in enumerate(texts):
+            for word in re.findall(r"[a-z0-9]+", text.lower()):
+                digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+                embeddings[idx, digest % self.dim] += 1.0 if digest & (1 << 63) else -1.0
+        return embeddings
+
+
+def hashing_embedder(store_dir: str = None, dim: int = 768):
+    """
+    A DatabaseEmbedder on the HashingBackend. Everything downstream (store,
+    index, similarity search) is the real code.
+    """
+    from psqlagent.modules.embeddings import DatabaseEmbedder
+    return DatabaseEmbedder(store_dir=store_dir, backend=HashingBackend(dim))
+
+
+class StubOpenAI:
+    """
+    Deterministic replacement for openai.ChatCompletion.create. Requests
+    with functions get a run_sql call on the first table of the
+    TABLE_DEFINITIONS, fast path prompts get the same SQL as text and every
+    other request is APPROVED. latency_ms simulates the API round trip.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, fast_path_marker: str = "Respond with the SQL only"):
+        self.latency_ms = latency_ms
+        self.fast_path_marker = fast_path_marker
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def install(self):
+        import openai
+        openai.ChatCompletion.create = self.create
+
+    @staticmethod
+    def sql_for(text: str) -> str:
+        schema = re.search(r"SCHEMA_NAME is (\w+)", text)
+        table = re.search(r"^(\w+)\(", text.split("TABLE_DEFINITIONS", 1)[-1], re.MULTILINE)
+        if table is None:
+            return "SELECT 1"
+        prefix = f"{schema.group(1)}." if schema else ""
+        return f"SELECT * FROM {prefix}{table.group(1)} LIMIT 10"
+
+    def create(self, model=None, messages=None, functions=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        # The shared agents keep earlier conversations; answer the latest request.
+        texts = [str(message.get("content") or "") for message in messages or []]
+        text = next((text for text in reversed(texts) if "TABLE_DEFINITIONS" in text), "\n".join(texts))
+        message = {"role": "assistant", "content": "APPROVED"}
+        if functions:
+            message = {"role": "assistant", "content": None, "function_call": {
+                "name": "run_sql", "arguments": json.dumps({"sql": self.sql_for(text)})}}
+        elif self.fast_path_marker in text:
+            message["content"] = f"```sql\n{self.sql_for(text)}\n```"
+        prompt_tokens = sum(len(text.split()) for text in texts)
+        completion_tokens = len(str(message.get("content") or message.get("function_call")).split())
+        return {
+            "id": f"stub-{self.calls}",
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+
+class WhitespaceEncoding:
+    """Token counter used when tiktoken can't load its encodings offline."""
+
+    def encode(self, text: str) -> list:
+        return text.split()
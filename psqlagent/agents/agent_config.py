@@ -1,6 +1,17 @@
+import functools
+import json
+import autogen
+from psqlagent.modules import llm
+from psqlagent.modules.completion_cache import completion_key, get_completion_cache, COMPLETION_CACHE_ENABLED
 from psqlagent.modules.db.dbmanager import DatabaseManager
+from psqlagent.modules.db.async_dbmanager import AsyncDatabaseManager
+from psqlagent.modules.metrics import span, record_llm_call
+
+# Request options that don't change the completion, kept out of the cache key.
+NON_SEMANTIC_LLM_CONFIG_KEYS = ("config_list", "functions", "request_timeout", "use_cache", "seed")
 
 base_config = {
+    # autogen's own cache is off; completions are cached by use_completion_cache instead.
     "use_cache": False,
     "temperature": 0,
     "config_list": [{"model": "gpt-4"}],
@@ -28,6 +39,101 @@ run_sql_config = {
 }
 
 def build_function_map_run_query(db: DatabaseManager):
+    if isinstance(db, AsyncDatabaseManager):
+        # Agents call functions synchronously from a worker thread.
+        return {
+            "run_sql": db.run_sql_blocking
+        }
     return {
         "run_sql": db.run_sql
     }
+
+
+def run_sql_released(sql):
+    raise RuntimeError("run_sql was called after the conversation released its database connection")
+
+
+def build_function_map_released():
+    """Function map for agents whose database connection was released, e.g. back to the pool."""
+    return {
+        "run_sql": run_sql_released
+    }
+
+
+def history_token_counter(agent) -> llm.HistoryTokenCounter:
+    """The agent's running token totals per chat history, created on first use."""
+    counter = getattr(agent, "_history_token_counter", None)
+    if counter is None:
+        counter = agent._history_token_counter = llm.HistoryTokenCounter()
+    return counter
+
+
+def function_tokens(agent, functions, model) -> int:
+    """Tokens of the function definitions sent with each of the agent's calls, counted once per model."""
+    if not functions:
+        return 0
+    counts = agent.__dict__.setdefault("_function_tokens", {})
+    if model not in counts:
+        counts[model] = llm.count_tokens(json.dumps(functions), model)
+    return counts[model]
+
+
+def cached_oai_reply(agent, messages=None, sender=None, config=None, use_cache=True):
+    """
+    Serves the agent's LLM reply from the completion cache, falling back to
+    generate_oai_reply (and caching its reply) on a miss. Every call is
+    timed and its tokens recorded, cached or not, in the metrics and in the
+    agent's token_usage if it has one (set by the Orchestrator), so billing
+    and metrics come from the same count. As in llm.prompt, only
+    temperature 0 completions are cached; other temperatures are meant to vary.
+    """
+    llm_config = agent.llm_config if config is None else config
+    if llm_config is False:
+        return False, None
+    use_cache = use_cache and llm_config.get("temperature") == 0
+    if messages is None:
+        messages = agent._oai_messages[sender]
+
+    models = [entry.get("model") for entry in llm_config.get("config_list") or []]
+    model = models[0] if models and models[0] else llm.DEFAULT_MODEL
+    with span("llm_call", agent=agent.name, model=model) as llm_span:
+        key = completion_key(
+            models,
+            agent._oai_system_message + [
+                {field: value for field, value in message.items() if field != "context"}
+                for message in messages
+            ],
+            llm_config.get("functions"),
+            {field: value for field, value in llm_config.items() if field not in NON_SEMANTIC_LLM_CONFIG_KEYS})
+        completion_cache = get_completion_cache() if use_cache else None
+        reply = completion_cache.get(key, agent=agent.name) if use_cache else None
+        cached = reply is not None
+        final = True
+        if not cached:
+            final, reply = agent.generate_oai_reply(messages, sender, config)
+            if use_cache and final and reply is not None:
+                completion_cache.put(key, reply, model=",".join(models))
+
+        input_tokens = history_token_counter(agent).count(
+            (sender.name if sender is not None else None, model), agent._oai_system_message + messages, model)
+        input_tokens += function_tokens(agent, llm_config.get("functions"), model)
+        output_tokens = llm.count_message_tokens(reply, model)
+        llm_span.labels["cache"] = "hit" if cached else "miss"
+        llm_span.set(input_tokens=input_tokens, output_tokens=output_tokens)
+        record_llm_call(agent.name, model, input_tokens, output_tokens, cached)
+        token_usage = getattr(agent, "token_usage", None)
+        if token_usage is not None:
+            token_usage.add(agent.name, model, input_tokens, output_tokens)
+    return final, reply
+
+def use_completion_cache(agent: autogen.ConversableAgent, enabled: bool = COMPLETION_CACHE_ENABLED):
+    """
+    Puts cached_oai_reply in front of the agent's own LLM reply; with the
+    cache disabled it still times the agent's LLM calls.
+    """
+    if agent.llm_config:
+        # generate_oai_reply is the last reply function; function calls,
+        # code execution and termination are still handled before the cache.
+        agent.register_reply([autogen.Agent, None], functools.partial(cached_oai_reply, use_cache=enabled),
+                             position=len(agent._reply_func_list) - 1)
+    return agent
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+from psqlagent.modules import llm
 from psqlagent.modules.db.dbmanager import DatabaseManager
 from psqlagent.modules.orchestrator import Orchestrator
 from autogen import (
@@ -16,7 +18,14 @@ from psqlagent.agents.prompts import (
     DATA_ANALYST_PROMPT,
     PRODUCT_MANAGER_PROMPT
 )
-from psqlagent.agents.agent_config import base_config, run_sql_config, build_function_map_run_query
+from psqlagent.agents.pool import agent_team_pool
+from psqlagent.agents.agent_config import (
+    base_config,
+    run_sql_config,
+    build_function_map_run_query,
+    build_function_map_released,
+    use_completion_cache
+)
 
 # Terminate msg function
 def is_termination_msg(content):
@@ -26,67 +35,99 @@ def is_termination_msg(content):
     return False
 
 
-# Agent definitions
-user_proxy = UserProxyAgent(
-    name="Admin",
-    system_message=USER_PROXY_PROMPT,
-    code_execution_config=False,
-    human_input_mode="NEVER",
-    is_termination_msg=is_termination_msg
-)
-
-secretary = AssistantAgent(
-    name="Secretary",
-    llm_config=base_config,
-    system_message=SECRETARY_PROMPT,
-    code_execution_config=False,
-    human_input_mode="NEVER",
-    is_termination_msg=is_termination_msg
-)
+# Agent definitions; built on first use so importing this module stays cheap.
+def build_user_proxy() -> UserProxyAgent:
+    return UserProxyAgent(
+        name="Admin",
+        system_message=USER_PROXY_PROMPT,
+        code_execution_config=False,
+        human_input_mode="NEVER",
+        is_termination_msg=is_termination_msg
+    )
 
-translator = AssistantAgent(
-    name="Translator",
-    llm_config=base_config,
-    system_message=TRANSLATOR_PROMPT,
-    code_execution_config=False,
-    human_input_mode="NEVER",
-    is_termination_msg=is_termination_msg
-)
+def build_secretary() -> AssistantAgent:
+    return use_completion_cache(AssistantAgent(
+        name="Secretary",
+        llm_config=base_config,
+        system_message=SECRETARY_PROMPT,
+        code_execution_config=False,
+        human_input_mode="NEVER",
+        is_termination_msg=is_termination_msg
+    ))
 
+def build_translator() -> AssistantAgent:
+    return use_completion_cache(AssistantAgent(
+        name="Translator",
+        llm_config=base_config,
+        system_message=TRANSLATOR_PROMPT,
+        code_execution_config=False,
+        human_input_mode="NEVER",
+        is_termination_msg=is_termination_msg
+    ))
 
-engineer =  AssistantAgent(
+def build_engineer() -> AssistantAgent:
+    return use_completion_cache(AssistantAgent(
         name="Engineer",
         llm_config=run_sql_config,
         system_message=DATA_ENGINEER_PROMPT,
         code_execution_config=False,
         human_input_mode="NEVER",
         is_termination_msg=is_termination_msg
-    )
+    ))
 
-def build_analyst_agent(db: DatabaseManager) -> AssistantAgent:
-    return AssistantAgent(
+def build_analyst_agent(db: DatabaseManager = None) -> AssistantAgent:
+    """Without db, run_sql is bound later with register_function."""
+    return use_completion_cache(AssistantAgent(
         name="SrDataAnalyst",
         llm_config=base_config,
         system_message=DATA_ANALYST_PROMPT,
         code_execution_config=False,
         human_input_mode="NEVER",
         is_termination_msg=is_termination_msg,
-        function_map=build_function_map_run_query(db)
-    )
+        function_map=build_function_map_run_query(db) if db is not None else None
+    ))
 
-planner = AssistantAgent(
-    name="ProductManager",
-    system_message=PRODUCT_MANAGER_PROMPT,
-    code_execution_config=False,
-    llm_config=base_config,
-    human_input_mode="NEVER",
-    is_termination_msg=is_termination_msg
-)
+def build_planner() -> AssistantAgent:
+    return use_completion_cache(AssistantAgent(
+        name="ProductManager",
+        system_message=PRODUCT_MANAGER_PROMPT,
+        code_execution_config=False,
+        llm_config=base_config,
+        human_input_mode="NEVER",
+        is_termination_msg=is_termination_msg
+    ))
+
+
+def build_team() -> list:
+    """A new user proxy, engineer, analyst and planner, in conversation order."""
+    # The agents call OpenAI through autogen, which needs the key set.
+    llm.get_openai()
+    return [build_user_proxy(), build_engineer(), build_analyst_agent(), build_planner()]
+
+
+@contextmanager
+def team_orchestrator(team: str, db: DatabaseManager):
+    """
+    Yields an Orchestrator over a team checked out of the agent pool, with
+    the analyst's run_sql bound to db, and returns the team afterwards with
+    run_sql unbound, since db's connection is released once the caller is done.
+    """
+    agents = agent_team_pool.checkout()
+    orchestrator = None
+    try:
+        agents[2].register_function(function_map=build_function_map_run_query(db))
+        orchestrator = Orchestrator(name=f"{team} Orchestrator", agents=agents)
+        yield orchestrator
+    finally:
+        # Replies a broadcast stopped waiting for may still run: they must not
+        # reach db's connection once it is back in the pool.
+        agents[2].register_function(function_map=build_function_map_released())
+        # They may also still write to these agents.
+        agent_team_pool.checkin(agents, discard=orchestrator is None or orchestrator.abandoned_replies)
 
 
 def build_team_orchestrator(team: str, db: DatabaseManager) -> Orchestrator:
-    team_orchestrator = Orchestrator(
-        name=f"{team} Orchestrator",
-        agents=[user_proxy, engineer, build_analyst_agent(db), planner]
-    )
-    return team_orchestrator
+    """An Orchestrator over a new team of its own, outside the pool."""
+    agents = build_team()
+    agents[2].register_function(function_map=build_function_map_run_query(db))
+    return Orchestrator(name=f"{team} Orchestrator", agents=agents)
@@ -0,0 +1,133 @@
+"""
+Purpose:
+    Pool of pre-built agent teams. Every conversation checks out a team of
+    its own, reset to an empty history, so concurrent queries don't share
+    conversation state and prompts don't grow from one request to the next.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+# One team per concurrent conversation; the API sizes both from QUERY_CONCURRENCY.
+AGENT_POOL_SIZE = int(os.getenv('AGENT_POOL_SIZE', os.getenv('QUERY_CONCURRENCY', '4')))
+AGENT_POOL_CHECKOUT_TIMEOUT = float(os.getenv('AGENT_POOL_CHECKOUT_TIMEOUT', '300'))
+
+
+class AgentPoolTimeout(Exception):
+    pass
+
+
+class AgentTeamPool:
+    def __init__(self, build_team, size=AGENT_POOL_SIZE, checkout_timeout=AGENT_POOL_CHECKOUT_TIMEOUT):
+        """build_team() returns a new list of agents."""
+        if size < 1:
+            raise ValueError("Agent pool size must be at least 1")
+        self._build_team = build_team
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+
+        self._idle = deque()
+        self._built = 0
+        self._cond = threading.Condition()
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def fill(self):
+        """Builds teams until the pool is full, e.g. before the API starts serving."""
+        while True:
+            with self._cond:
+                if self._built >= self.size:
+                    return
+                self._built += 1
+            team = self._build()
+            with self._cond:
+                self._idle.append(team)
+                self._cond.notify()
+
+    def checkout(self) -> list:
+        """
+        Returns an idle team with every agent reset (empty history, fresh
+        auto-reply counters), building one while the pool isn't full and
+        waiting up to checkout_timeout once it is.
+        """
+        started_at = time.monotonic()
+        team = self._reserve(started_at + self.checkout_timeout)
+        if team is None:
+            team = self._build()
+        for agent in team:
+            agent.reset()
+        waited = time.monotonic() - started_at
+        with self._cond:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return team
+
+    def checkin(self, team, discard=False):
+        """Returns team to the pool; discarded teams are rebuilt on a later checkout."""
+        with self._cond:
+            if discard:
+                self._built -= 1
+                self.discarded += 1
+            else:
+                self._idle.append(team)
+            self._cond.notify()
+
+    def _reserve(self, deadline):
+        """Takes an idle team, or a slot for a new one (returned as None)."""
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._built < self.size:
+                    self._built += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise AgentPoolTimeout(
+                        f"Timed out after {self.checkout_timeout}s waiting for an agent team")
+                self._cond.wait(remaining)
+
+    def _build(self) -> list:
+        try:
+            team = self._build_team()
+        except Exception:
+            with self._cond:
+                self._built -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.created += 1
+        return team
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "built": self._built,
+                "idle": len(self._idle),
+                "in_use": self._built - len(self._idle),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "discarded": self.discarded,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+def build_data_team() -> list:
+    # agents.py imports autogen, which takes seconds; it is loaded with the first team.
+    from psqlagent.agents.agents import build_team
+    return build_team()
+
+
+agent_team_pool = AgentTeamPool(build_data_team)
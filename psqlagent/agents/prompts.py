@@ -5,3 +5,4 @@ TRANSLATOR_PROMPT = "Translator. You follow an approved plan. Your task is recei
 DATA_ENGINEER_PROMPT = "Data engineer. Generate the initial SQL based on the requeriments provided. Send it to the Sr Data Analyst. to be executed"
 DATA_ANALYST_PROMPT = """Sr Data Analyst. You run the SQL query using the run_sql function, Send the response in a readable way. You must use the run_sql function. """
 PRODUCT_MANAGER_PROMPT = """Product Manager. Validate the response to make sure it is correct. """ + COMPLETION_PROMPT
+FAST_PATH_SQL_PROMPT = """Data engineer. Write a single read-only SQL query that answers the user request using only the TABLE_DEFINITIONS above. Respond with the SQL only, no explanation. """
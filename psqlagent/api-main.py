@@ -1,14 +1,29 @@
+import asyncio
+import json
+import time
 import uvicorn
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from psqlagent.modules.llm import add_cap_ref, prompt as llm_prompt
+from fastapi.responses import PlainTextResponse
+from psqlagent.modules.llm import add_cap_ref, prompt as llm_prompt, TokenUsage
+from psqlagent.agents.pool import agent_team_pool
 from dotenv import load_dotenv
 import os
-from psqlagent.agents.agents import build_team_orchestrator
 from psqlagent.modules import embeddings
-from psqlagent.modules.db.postgres import PostgresManager
-from psqlagent.modules.db.sqlserver import SQLServerManager
-from psqlagent.modules.db.dbmanager import DatabaseManager
+from psqlagent.modules.completion_cache import get_completion_cache
+from psqlagent.modules.fast_path import run_fast_path_async, query_path_stats, QUERY_MODES
+from psqlagent.modules.semantic_cache import SemanticCache, approved_sql, question_embedder, SEMANTIC_CACHE_ENABLED
+from psqlagent.modules.subschema import ColumnRetriever, SUBSCHEMA_ENABLED
+from psqlagent.modules import db as database
+from psqlagent.modules.db.async_dbmanager import AsyncDatabaseManager
+from psqlagent.modules.db import async_postgres
+from psqlagent.modules.db.catalog_cache import catalog_cache
+from psqlagent.modules.db.guard import QueryRejected
+from psqlagent.modules.db.pool import pool_stats
+from psqlagent.modules.db.result_cache import result_cache
+from psqlagent.modules.metrics import configure_logging, logger, metrics, new_request_id, span
 
 load_dotenv()
 assert os.getenv(
@@ -21,12 +36,38 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 SCHEMA_NAME = os.getenv('SCHEMA_NAME')
 OPENAI_APIKEY = os.getenv('OPENAI_APIKEY')
 DATABASE_ENGINE = os.getenv('DATABASE_ENGINE')
+DATABASE_POOLING = os.getenv('DATABASE_POOLING', 'true').lower() == 'true'
+# Conversations run on agent teams from a pool of the same size (AGENT_POOL_SIZE).
+QUERY_CONCURRENCY = int(os.getenv('QUERY_CONCURRENCY', '4'))
+# "fast" tries a single LLM call first and escalates to the agents if it fails.
+QUERY_MODE = os.getenv('QUERY_MODE', 'agents')
 
 POSTGRES_TABLE_DEFINITIONS_CAP_REF = "TABLE_DEFINITIONS"
 TABLE_RESPONSE_FORMAT_CAP_REF = "TABLE_FORMAT"
 SQL_QUERY_DELIMITER = "--------"
 
-app = FastAPI()
+configure_logging()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the embedding model once per worker and warm it up before serving.
+    database_embedder = embeddings.get_database_embedder()
+    database_embedder.warm_up()
+    app.state.database_embedder = database_embedder
+    app.state.semantic_cache = None
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache_embedder = question_embedder(database_embedder)
+        semantic_cache_embedder.warm_up()
+        app.state.semantic_cache = SemanticCache(semantic_cache_embedder)
+    app.state.column_retriever = ColumnRetriever(database_embedder)
+    app.state.query_semaphore = asyncio.Semaphore(QUERY_CONCURRENCY)
+    # Most queries reach the agents unless the fast path is the default.
+    if QUERY_MODE == "agents":
+        await run_in_threadpool(agent_team_pool.fill)
+    yield
+    await async_postgres.close_pools()
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "http://localhost:4200",
 ]
@@ -38,22 +79,101 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    # Every log line and span of the request carries this id.
+    current_request_id = new_request_id(request.headers.get("X-Request-ID"))
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = current_request_id
+    return response
+
 @app.get("/")
 async def read_root():
     return {"Hello": "World"}
 
+@app.get("/catalog/stats")
+async def catalog_stats():
+    return catalog_cache.stats()
+
+@app.get("/results/cache/stats")
+async def result_cache_stats():
+    return result_cache.stats()
+
+@app.get("/semantic-cache/stats")
+async def semantic_cache_stats():
+    if app.state.semantic_cache is None:
+        return {"enabled": False}
+    return app.state.semantic_cache.stats()
+
+@app.get("/llm/cache/stats")
+async def completion_cache_stats():
+    return await run_in_threadpool(get_completion_cache().stats)
+
+@app.get("/query/stats")
+async def query_stats():
+    return query_path_stats.stats()
+
+@app.get("/db/pool/stats")
+async def db_pool_stats():
+    return {**pool_stats(), **async_postgres.pool_stats()}
+
+@app.get("/agents/pool/stats")
+async def agent_pool_stats():
+    return agent_team_pool.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/query")
-async def query(user_query: str):
-    with create_database_manager() as db:
-        db.connect_with_url(DATABASE_URL)
-
-        map_table_name_to_table_def = db.get_table_definition_map_for_embedding("*")
-        database_embedder = embeddings.DatabaseEmbedder()
-        for name, table_def in map_table_name_to_table_def.items():
-            database_embedder.add_table(name, table_def)
-        
-        similar_tables = database_embedder.get_similar_tables(user_query)
-        table_definitions = db.get_tables_definition_for_prompt(similar_tables)
+async def query(user_query: str, mode: str = QUERY_MODE):
+    if mode not in QUERY_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {QUERY_MODES}")
+    with span("query", mode=mode):
+        return await answer_query(user_query, mode)
+
+async def answer_query(user_query: str, mode: str):
+    started_at = time.perf_counter()
+    # DB calls are awaited; embedding and the agent conversation (blocking
+    # torch and OpenAI calls) run in the threadpool, so the loop stays free.
+    async with create_database_manager() as db:
+        await db.connect_with_url(DATABASE_URL)
+
+        # Paraphrases of an already answered question reuse its approved
+        # SQL and skip the agent conversation entirely.
+        schema = await db.get_schema()
+        schema_fingerprint = schema.fingerprint()
+        question_embedding = None
+        question_tables = frozenset()
+        if SEMANTIC_CACHE_ENABLED:
+            question_embedding = await run_in_threadpool(app.state.semantic_cache.embed, user_query)
+            question_tables = app.state.semantic_cache.mentioned_tables(schema, user_query)
+            cached = app.state.semantic_cache.lookup(
+                db.catalog_id, schema_fingerprint, user_query, question_embedding, question_tables)
+            if cached is not None:
+                try:
+                    result = await db.run_sql(cached["sql"])
+                except QueryRejected as e:
+                    # The data grew since the SQL was approved; let the agents rewrite it.
+                    logger.info(f"Semantic cache SQL rejected: {e}")
+                    result = None
+                if result is not None:
+                    query_path_stats.record("semantic_cache", time.perf_counter() - started_at)
+                    return True, semantic_cache_messages(cached, result), TokenUsage().to_dict()
+
+        map_table_name_to_table_def = await db.get_table_definition_map_for_embedding("*")
+        if SUBSCHEMA_ENABLED:
+            # The table path's tables, plus the matched columns and the join path between their tables.
+            subschema = await run_in_threadpool(
+                find_subschema, app.state.database_embedder, app.state.column_retriever,
+                map_table_name_to_table_def, schema, db.catalog_id, user_query)
+            table_definitions = await db.get_schema_context(
+                user_query, subschema.tables, column_names=subschema.columns)
+        else:
+            similar_tables = await run_in_threadpool(
+                find_similar_tables, app.state.database_embedder,
+                map_table_name_to_table_def, schema.search_texts(), db.catalog_id, user_query)
+            table_definitions = await db.get_schema_context(user_query, similar_tables)
 
         prompt = add_cap_ref(
             user_query,
@@ -61,24 +181,67 @@ async def query(user_query: str):
             POSTGRES_TABLE_DEFINITIONS_CAP_REF,
             table_definitions)
 
-        datateam_orchestrator = build_team_orchestrator(
-            "Data Engineering Orchestrator", db)
+        usage = TokenUsage()
+        if mode == "fast":
+            fast_path = await run_fast_path_async(prompt, db)
+            usage.merge(fast_path.usage)
+            if fast_path.succeeded:
+                # Unreviewed SQL never goes into the semantic cache of approved SQL.
+                query_path_stats.record("fast", time.perf_counter() - started_at, usage.cost, usage.total_tokens)
+                return True, fast_path.messages(), usage.to_dict()
+            query_path_stats.record_escalation(fast_path.escalation_reason)
+
+        # Each conversation holds an agent team, so they are limited to QUERY_CONCURRENCY.
+        async with app.state.query_semaphore:
+            success, messages, datateam_usage = await run_in_threadpool(run_data_team, prompt, db)
+        usage.merge(datateam_usage)
+        sql = approved_sql(success, messages)
+        if sql is not None:
+            await store_approved_sql(db, schema_fingerprint, user_query, sql, question_embedding, question_tables)
+        query_path_stats.record(
+            "escalated" if mode == "fast" else "agents", time.perf_counter() - started_at,
+            usage.cost, usage.total_tokens, success)
+        return success, messages, usage.to_dict()
+
+async def store_approved_sql(db, schema_fingerprint, user_query, sql, question_embedding, question_tables):
+    if SEMANTIC_CACHE_ENABLED:
+        await run_in_threadpool(
+            app.state.semantic_cache.store, db.catalog_id, schema_fingerprint,
+            user_query, sql, question_embedding, question_tables)
+
+def find_similar_tables(database_embedder, map_table_name_to_table_def, search_texts, store_name, user_query):
+    database_embedder.sync_tables(map_table_name_to_table_def, store_name=store_name, search_texts=search_texts)
+    return database_embedder.get_similar_tables(user_query)
+
+def find_subschema(database_embedder, column_retriever, map_table_name_to_table_def, schema, store_name, user_query):
+    similar_tables = find_similar_tables(
+        database_embedder, map_table_name_to_table_def, schema.search_texts(), store_name, user_query)
+    column_retriever.sync(schema, store_name=store_name)
+    return column_retriever.subschema(schema, user_query, similar_tables)
+
+def semantic_cache_messages(cached, result):
+    # Same shape as the data team's messages: the SQL call, its result and the approval.
+    return [
+        {"content": None, "function_call": {"name": "run_sql", "arguments": json.dumps({"sql": cached["sql"]})}},
+        {"role": "function", "name": "run_sql", "content": str(result)},
+        f"APPROVED (answered from the semantic cache, matching \"{cached['question']}\" "
+        f"with similarity {cached['similarity']:.3f})",
+    ]
+
+def run_data_team(prompt, db):
+    # autogen takes seconds to import; only conversations that reach the agents pay for it.
+    from psqlagent.agents.agents import team_orchestrator
+    with team_orchestrator("Data Engineering Orchestrator", db) as datateam_orchestrator:
         success, messages = datateam_orchestrator.sequential_conversation(
             prompt)
-        datateam_cost, datateam_tokens = datateam_orchestrator.get_cost_and_tokens()
-        print(f"Datateam cost: {datateam_cost}")
-        print(f"Datateam no. tokens: {datateam_tokens}")
-        
-        return success, messages
-
-def create_database_manager(database_type = DATABASE_ENGINE, schema_name = SCHEMA_NAME) -> DatabaseManager:
-    print(f"Creating database manager for {database_type}")
-    if database_type == "SqlServer":
-        return SQLServerManager(schema_name=schema_name)
-    if database_type == "Postgres":
-        return PostgresManager(schema_name=schema_name)
-    
-    raise ValueError("Invalid database type")
+    datateam_cost, datateam_tokens = datateam_orchestrator.get_cost_and_tokens()
+    logger.info(f"Datateam cost: {datateam_cost}")
+    logger.info(f"Datateam no. tokens: {datateam_tokens}")
+
+    return success, messages, datateam_orchestrator.usage
+
+def create_database_manager(database_type = DATABASE_ENGINE, schema_name = SCHEMA_NAME) -> AsyncDatabaseManager:
+    return database.create_async_database_manager(database_type, schema_name, pooled=DATABASE_POOLING)
 
 
 def main():
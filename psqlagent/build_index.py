@@ -0,0 +1,81 @@
+"""
+Purpose:
+    Admin command that pre-builds the table and column embedding indexes for
+    a whole schema, so the API never pays for embedding on a user request.
+"""
+
+import argparse
+import os
+import sys
+import time
+from dotenv import load_dotenv
+from psqlagent.modules import embeddings
+from psqlagent.modules.db import create_database_manager
+from psqlagent.modules.subschema import ColumnRetriever, SUBSCHEMA_ENABLED
+
+load_dotenv()
+
+
+def print_progress(started_at: float, unit: str = "tables"):
+    def progress(done: int, total: int):
+        elapsed = time.perf_counter() - started_at
+        rate = done / elapsed if elapsed else 0.0
+        sys.stdout.write(f"\rEmbedded {done}/{total} {unit} ({rate:.1f} {unit}/s)")
+        sys.stdout.flush()
+        if done == total:
+            sys.stdout.write("\n")
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-build the table embedding index for a schema")
+    parser.add_argument("--database-url", default=os.getenv('DATABASE_URL'))
+    parser.add_argument("--engine", default=os.getenv('DATABASE_ENGINE', 'Postgres'))
+    parser.add_argument("--schema", default=os.getenv('SCHEMA_NAME'))
+    parser.add_argument("--batch-size", type=int, default=embeddings.EMBEDDING_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if not args.database_url or not args.schema:
+        print("Please provide a database url and schema (or set DATABASE_URL and SCHEMA_NAME)")
+        return
+
+    with create_database_manager(args.engine, args.schema) as db:
+        db.connect_with_url(args.database_url)
+
+        started_at = time.perf_counter()
+        map_table_name_to_table_def = db.get_table_definition_map_for_embedding("*")
+        print(f"Introspected {len(map_table_name_to_table_def)} tables "
+              f"in {time.perf_counter() - started_at:.2f}s")
+
+        started_at = time.perf_counter()
+        database_embedder = embeddings.get_database_embedder()
+        print(f"Loaded {database_embedder.model_name} in {time.perf_counter() - started_at:.2f}s")
+
+        store = database_embedder.open_store(db.catalog_id)
+        stale_tables = store.stale_tables(map_table_name_to_table_def)
+        print(f"{len(stale_tables)} tables to embed, "
+              f"{len(map_table_name_to_table_def) - len(stale_tables)} up to date")
+
+        started_at = time.perf_counter()
+        database_embedder.sync_tables(
+            map_table_name_to_table_def,
+            store_name=db.catalog_id,
+            batch_size=args.batch_size,
+            progress=print_progress(started_at))
+        elapsed = time.perf_counter() - started_at
+        rate = len(stale_tables) / elapsed if elapsed else 0.0
+        print(f"Indexed {len(stale_tables)} tables in {elapsed:.2f}s ({rate:.1f} tables/s) "
+              f"into {store.directory}")
+
+        if SUBSCHEMA_ENABLED:
+            schema = db.get_schema()
+            column_retriever = ColumnRetriever(database_embedder)
+            started_at = time.perf_counter()
+            column_retriever.sync(schema, store_name=db.catalog_id, batch_size=args.batch_size,
+                                  progress=print_progress(started_at, "columns"))
+            print(f"Indexed {len(schema.columns_by_key())} columns in {time.perf_counter() - started_at:.2f}s "
+                  f"into {column_retriever.embedder.store.directory}")
+
+
+if __name__ == '__main__':
+    main()
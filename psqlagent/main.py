@@ -1,17 +1,11 @@
-from psqlagent.modules.llm import add_cap_ref, prompt as llm_prompt
+from psqlagent.modules.llm import add_cap_ref, get_openai, prompt as llm_prompt
 import argparse
+import time
 from psqlagent.modules.db import PostgresManager
 from dotenv import load_dotenv
 import os
-from autogen import (
-    AssistantAgent,
-    UserProxyAgent,
-    GroupChat,
-    GroupChatManager,
-    config_list_from_json,
-    config_list_from_models
-)
-from psqlagent.utils.prompts import (
+from psqlagent.modules.fast_path import run_fast_path
+from psqlagent.agents.prompts import (
     USER_PROXY_PROMPT,
     SECRETARY_PROMPT,
     TRANSLATOR_PROMPT,
@@ -39,6 +33,8 @@ SQL_QUERY_DELIMITER = "--------"
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("prompt", help="Initial prompt for the AI")
+    parser.add_argument("--fast", action="store_true",
+                        help="Try a single LLM call first and only start the agents if it fails")
     args = parser.parse_args()
 
     if not args.prompt:
@@ -48,7 +44,7 @@ def main():
     with PostgresManager(schema_name=SCHEMA_NAME) as db:
 
         db.connect_with_url(DATABASE_URL)
-        table_definitions = db.get_table_definition_for_prompt('*')
+        table_definitions = db.get_schema_context(args.prompt)
 
         prompt = add_cap_ref(
             args.prompt,
@@ -56,6 +52,27 @@ def main():
             POSTGRES_TABLE_DEFINITIONS_CAP_REF,
             table_definitions)
 
+        if args.fast:
+            started_at = time.perf_counter()
+            fast_path = run_fast_path(prompt, db)
+            cost, tokens = fast_path.get_cost_and_tokens()
+            print(f"Fast path took {time.perf_counter() - started_at:.2f}s, cost: {cost}, no. tokens: {tokens}")
+            if fast_path.succeeded:
+                print(f"SQL: {fast_path.sql}")
+                print(fast_path.result)
+                return
+            print(f"Fast path failed ({fast_path.escalation_reason}), starting the agents")
+
+        # autogen takes seconds to import, so the fast path doesn't load it.
+        from autogen import (
+            AssistantAgent,
+            UserProxyAgent,
+            GroupChat,
+            GroupChatManager,
+            config_list_from_models
+        )
+        get_openai()
+
         gpt4_config = {
             "seed": 42,
             "temperature": 0,
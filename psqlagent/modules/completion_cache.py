@@ -0,0 +1,173 @@
+"""
+Purpose:
+    Persistent cache of LLM completions, keyed by a hash of everything that
+    determines the response (model, messages, functions and sampling params).
+    Backed by a single sqlite file in WAL mode so every uvicorn worker on the
+    host shares it safely.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+COMPLETION_CACHE_ENABLED = os.getenv('COMPLETION_CACHE_ENABLED', 'true').lower() == 'true'
+COMPLETION_CACHE_PATH = os.getenv('COMPLETION_CACHE_PATH', os.path.join('.cache', 'completions.sqlite3'))
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv('COMPLETION_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+# Reads only touch memory; last-used times and hit counts are written at most this often (and on every put).
+COMPLETION_CACHE_FLUSH_SECONDS = float(os.getenv('COMPLETION_CACHE_FLUSH_SECONDS', '5'))
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS completions (
+        key TEXT PRIMARY KEY,
+        model TEXT,
+        response TEXT NOT NULL,
+        bytes INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS completions_last_used_at ON completions (last_used_at);
+    CREATE TABLE IF NOT EXISTS completion_stats (
+        agent TEXT PRIMARY KEY,
+        hits INTEGER NOT NULL DEFAULT 0,
+        misses INTEGER NOT NULL DEFAULT 0
+    );
+"""
+
+
+def completion_key(model, messages, functions=None, params: dict = None) -> str:
+    """Content address of a completion request; dict key order doesn't matter."""
+    request = {"model": model, "messages": messages, "functions": functions, "params": params}
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    def __init__(self, path: str = COMPLETION_CACHE_PATH, max_bytes: int = COMPLETION_CACHE_MAX_BYTES,
+                 flush_seconds: float = COMPLETION_CACHE_FLUSH_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_seconds = flush_seconds
+        self._local = threading.local()
+        # Pending writes of get(): key -> last used time, and agent -> [hits, misses].
+        self._touched = {}
+        self._counts = {}
+        self._pending_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads; keep one per thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, agent: str = None):
+        """Returns the cached response for key, or None. Counts a hit or miss for agent."""
+        row = self._connect().execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+        with self._pending_lock:
+            if row is not None:
+                self._touched[key] = time.time()
+            counts = self._counts.setdefault(agent or "default", [0, 0])
+            counts[0 if row is not None else 1] += 1
+            due = time.monotonic() - self._flushed_at >= self.flush_seconds
+        if due:
+            self.flush()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, response, model: str = None):
+        encoded = json.dumps(response)
+        size = len(encoded.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, response, bytes, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, encoded, size, now, now))
+            self._write_pending(conn)
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn):
+        # Least recently used rows go first until the cache fits its budget.
+        total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM completions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        keys = []
+        for key, size in conn.execute("SELECT key, bytes FROM completions ORDER BY last_used_at"):
+            keys.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        conn.executemany("DELETE FROM completions WHERE key = ?", keys)
+
+    def flush(self):
+        """Writes the last-used times and hit counts gathered by get() since the last flush."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write_pending(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _write_pending(self, conn):
+        with self._pending_lock:
+            touched, self._touched = self._touched, {}
+            counts, self._counts = self._counts, {}
+            self._flushed_at = time.monotonic()
+        # An entry evicted meanwhile just isn't updated.
+        conn.executemany("UPDATE completions SET last_used_at = MAX(last_used_at, ?) WHERE key = ?",
+                         [(used_at, key) for key, used_at in touched.items()])
+        conn.executemany(
+            "INSERT INTO completion_stats (agent, hits, misses) VALUES (?, ?, ?) "
+            "ON CONFLICT (agent) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+            [(agent, hits, misses) for agent, (hits, misses) in counts.items()])
+
+    def clear(self):
+        with self._pending_lock:
+            self._touched, self._counts = {}, {}
+        conn = self._connect()
+        conn.execute("DELETE FROM completions")
+        conn.execute("DELETE FROM completion_stats")
+
+    def stats(self) -> dict:
+        """Cache size and hit/miss counts per agent, across all worker processes."""
+        self.flush()
+        conn = self._connect()
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM completions").fetchone()
+        agents = {}
+        for agent, hits, misses in conn.execute("SELECT agent, hits, misses FROM completion_stats ORDER BY agent"):
+            lookups = hits + misses
+            agents[agent] = {"hits": hits, "misses": misses, "hit_rate": hits / lookups if lookups else 0.0}
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "agents": agents}
+
+
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> CompletionCache:
+    """Returns the process-wide completion cache, opening it on first use."""
+    global _completion_cache
+    with _completion_cache_lock:
+        if _completion_cache is None:
+            _completion_cache = CompletionCache()
+        return _completion_cache
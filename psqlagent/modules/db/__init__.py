@@ -0,0 +1,31 @@
+from psqlagent.modules.db.dbmanager import DatabaseManager
+from psqlagent.modules.db.postgres import PostgresManager
+from psqlagent.modules.metrics import logger
+
+
+def create_database_manager(database_type, schema_name, pooled=False) -> DatabaseManager:
+    logger.info(f"Creating database manager for {database_type}")
+    # pyodbc needs the ODBC driver manager, so it is only imported for SQL Server.
+    if database_type == "SqlServer":
+        from psqlagent.modules.db.sqlserver import SQLServerManager
+        return SQLServerManager(schema_name=schema_name, pooled=pooled)
+    if database_type == "Postgres":
+        return PostgresManager(schema_name=schema_name, pooled=pooled)
+
+    raise ValueError("Invalid database type")
+
+
+def create_async_database_manager(database_type, schema_name, pooled=True):
+    """
+    Async managers for the API. Postgres uses asyncpg's own pool, so pooled
+    only applies to SQL Server.
+    """
+    logger.info(f"Creating async database manager for {database_type}")
+    if database_type == "SqlServer":
+        from psqlagent.modules.db.sqlserver import AsyncSQLServerManager
+        return AsyncSQLServerManager(schema_name=schema_name, pooled=pooled)
+    if database_type == "Postgres":
+        from psqlagent.modules.db.async_postgres import AsyncPostgresManager
+        return AsyncPostgresManager(schema_name=schema_name)
+
+    raise ValueError("Invalid database type")
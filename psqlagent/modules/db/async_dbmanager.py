@@ -0,0 +1,203 @@
+import asyncio
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from psqlagent.modules.db.catalog_cache import catalog_cache
+from psqlagent.modules.db.dbmanager import DatabaseManager
+from psqlagent.modules.db.guard import check_plan, needs_plan_check, plan_failed
+from psqlagent.modules.db.manager_common import ManagerCommon
+from psqlagent.modules.db.result_cache import result_cache
+from psqlagent.modules.db.schema import Schema
+from psqlagent.modules.metrics import logger, span, in_context
+from psqlagent.modules.schema_context import SchemaContextBuilder, SCHEMA_CONTEXT_TOKEN_BUDGET
+
+class AsyncDatabaseManager(ManagerCommon, ABC):
+    """
+    Non-blocking counterpart of DatabaseManager for use on an event loop.
+    Shares the process-wide catalog cache with the blocking managers.
+    """
+    # Set when the manager is closed and its connection released.
+    closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.closed = True
+        await self.close()
+
+    @abstractmethod
+    async def connect_with_url(self, url):
+        pass
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+    async def run_sql(self, sql, plan=None):
+        with span("run_sql", engine=self.engine, cache="bypass") as run_sql_span:
+            limited_sql = self.limit_rows(sql)
+            key, version = await self.result_cache_key(limited_sql)
+            handle = None
+            if version is not None:
+                handle = await asyncio.to_thread(result_cache.lookup, key, version)
+                run_sql_span.labels["cache"] = "miss" if handle is None else "hit"
+            if handle is None:
+                if self.sql_guard_enabled:
+                    await self.check_sql_plan(limited_sql, plan)
+                handle = await self.execute_guarded(limited_sql)
+                if version is not None:
+                    await asyncio.to_thread(result_cache.store, key, version, handle)
+                else:
+                    self.record_write(sql)
+            self.mark_row_limit(handle, sql, limited_sql)
+            return handle
+
+    async def check_sql_plan(self, sql, plan=None):
+        if not needs_plan_check(sql):
+            return
+        try:
+            estimate = await self.get_plan_estimate(sql, plan)
+        except Exception as e:
+            raise plan_failed(e)
+        check_plan(estimate, self.max_plan_cost)
+
+    async def get_plan_estimate(self, sql, plan=None):
+        return None
+
+    async def execute_guarded(self, sql):
+        if not self.guard_timeout_ms:
+            return await self.execute_sql(sql)
+        async with self.statement_timeout(self.guard_timeout_ms):
+            return await self.execute_sql(sql)
+
+    @asynccontextmanager
+    async def statement_timeout(self, timeout_ms):
+        yield
+
+    @abstractmethod
+    async def execute_sql(self, sql):
+        pass
+
+    async def explain(self, sql):
+        pass
+
+    async def get_table_versions(self, table_names: list):
+        return None
+
+    async def result_cache_key(self, sql):
+        if not self.may_cache(sql):
+            return None, None
+        try:
+            tables = self.cached_tables(sql, await self.get_schema())
+            version = await self.get_table_versions(tables) if tables else None
+        except Exception as e:
+            logger.warning(f"Could not read table versions for the result cache: {e}")
+            return None, None
+        return self.result_key(sql), version
+
+    def check_open(self):
+        if self.closed:
+            raise RuntimeError("The database manager is closed and its connection released")
+
+    @abstractmethod
+    async def introspect_schema(self, table_names: list = None) -> Schema:
+        pass
+
+    @abstractmethod
+    async def get_schema_version(self):
+        pass
+
+    def run_sql_blocking(self, sql):
+        """
+        Runs run_sql on the manager's event loop from another thread.
+        Agents call their functions synchronously from worker threads, so
+        this is what gets registered in their function maps. Raises
+        RuntimeError once the manager is closed, e.g. for a broadcast branch
+        that outlived its request.
+        """
+        self.check_open()
+        return asyncio.run_coroutine_threadsafe(self.run_sql(sql), self.loop).result()
+
+    async def get_schema(self) -> Schema:
+        version = await self.get_schema_version()
+        schema = catalog_cache.lookup(self.catalog_key, version)
+        if schema is None:
+            with span("schema_introspection", engine=self.engine):
+                schema = await self.introspect_schema()
+            catalog_cache.store(self.catalog_key, version, schema)
+        return schema
+
+    async def get_tables(self, table_names: list) -> list:
+        return (await self.get_schema()).select(table_names)
+
+    async def get_table_definition_map_for_embedding(self, table_name) -> dict:
+        return (await self.get_schema()).definition_map(table_name)
+
+    async def get_tables_definition_for_prompt(self, table_names: list, column_names: dict = None):
+        return (await self.get_schema()).prompt_definitions(table_names, column_names)
+
+    async def get_schema_context(self, query: str, table_names: list = None,
+                                 token_budget: int = SCHEMA_CONTEXT_TOKEN_BUDGET, column_names: dict = None) -> str:
+        schema = await self.get_schema()
+        return SchemaContextBuilder(token_budget).build(schema.select(table_names), query, column_names)
+
+
+class ThreadedDatabaseManager(AsyncDatabaseManager):
+    """
+    Adapts a blocking DatabaseManager to the async interface by running every
+    call on a dedicated thread, so the connection is only ever used by one
+    thread and the event loop never blocks on the driver.
+    """
+
+    def __init__(self, manager: DatabaseManager):
+        self.manager = manager
+        self.loop = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{manager.engine}-db")
+
+    @property
+    def engine(self):
+        return self.manager.engine
+
+    @property
+    def url(self):
+        return self.manager.url
+
+    @property
+    def schema_name(self):
+        return self.manager.schema_name
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, in_context(fn), *args)
+
+    async def connect_with_url(self, url):
+        self.loop = asyncio.get_running_loop()
+        self.manager.__enter__()
+        await self._call(self.manager.connect_with_url, url)
+
+    async def close(self):
+        await self._call(self.manager.__exit__, None, None, None)
+        self._executor.shutdown(wait=False)
+
+    async def run_sql(self, sql, plan=None):
+        # The wrapped manager already goes through the result cache.
+        return await self._call(self.manager.run_sql, sql, plan)
+
+    def limit_rows(self, sql) -> str:
+        return self.manager.limit_rows(sql)
+
+    async def execute_sql(self, sql):
+        return await self._call(self.manager.execute_sql, sql)
+
+    async def explain(self, sql):
+        return await self._call(self.manager.explain, sql)
+
+    async def introspect_schema(self, table_names: list = None) -> Schema:
+        return await self._call(self.manager.introspect_schema, table_names)
+
+    async def get_schema_version(self):
+        return await self._call(self.manager.get_schema_version)
+
+    def run_sql_blocking(self, sql):
+        self.check_open()
+        return self._executor.submit(in_context(self.manager.run_sql), sql).result()
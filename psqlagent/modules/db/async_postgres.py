@@ -0,0 +1,194 @@
+import asyncio
+import json
+import time
+import asyncpg
+from contextlib import asynccontextmanager
+from psqlagent.modules.db.async_dbmanager import AsyncDatabaseManager
+from psqlagent.modules.db.guard import postgres_plan_estimate, timed_out
+from psqlagent.modules.db.postgres import (
+    SchemaChangeListener,
+    SCHEMA_FINGERPRINT_QUERY as PG_SCHEMA_FINGERPRINT_QUERY,
+    SCHEMA_INTROSPECTION_QUERY as PG_SCHEMA_INTROSPECTION_QUERY,
+    TABLE_VERSIONS_QUERY as PG_TABLE_VERSIONS_QUERY,
+)
+from psqlagent.modules.db.pool import (
+    DATABASE_POOL_MIN_SIZE,
+    DATABASE_POOL_MAX_SIZE,
+    DATABASE_POOL_IDLE_TIMEOUT,
+    DATABASE_POOL_CHECKOUT_TIMEOUT,
+    DATABASE_STATEMENT_TIMEOUT_MS,
+)
+from psqlagent.modules.db.results import ResultHandle, ResultWriter, RESULTS_BATCH_SIZE
+from psqlagent.modules.db.schema import Schema
+from psqlagent.modules.metrics import logger
+
+# asyncpg uses positional $n parameters instead of psycopg2's named ones.
+SCHEMA_FINGERPRINT_QUERY = PG_SCHEMA_FINGERPRINT_QUERY.replace("%(schema_name)s", "$1")
+SCHEMA_INTROSPECTION_QUERY = (PG_SCHEMA_INTROSPECTION_QUERY
+                              .replace("%(schema_name)s", "$1")
+                              .replace("%(table_names)s", "$2"))
+TABLE_VERSIONS_QUERY = (PG_TABLE_VERSIONS_QUERY
+                        .replace("%(schema_name)s", "$1")
+                        .replace("%(table_names)s", "$2"))
+
+_pools = {}
+_pool_stats = {}
+_pools_lock = asyncio.Lock()
+
+
+async def get_pool(url) -> asyncpg.Pool:
+    """Returns the process-wide asyncpg pool for url, creating it on first use."""
+    async with _pools_lock:
+        if url not in _pools:
+            _pools[url] = await asyncpg.create_pool(
+                url,
+                min_size=DATABASE_POOL_MIN_SIZE,
+                max_size=DATABASE_POOL_MAX_SIZE,
+                max_inactive_connection_lifetime=DATABASE_POOL_IDLE_TIMEOUT,
+                server_settings={"statement_timeout": str(DATABASE_STATEMENT_TIMEOUT_MS)},
+            )
+            _pool_stats[url] = {"checkouts": 0, "timeouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+        return _pools[url]
+
+
+async def close_pools():
+    """Closes every pool; they are bound to the event loop that created them."""
+    async with _pools_lock:
+        for pool in _pools.values():
+            await pool.close()
+        _pools.clear()
+        _pool_stats.clear()
+
+
+def pool_stats() -> dict:
+    stats = {}
+    for index, (url, pool) in enumerate(_pools.items()):
+        counters = _pool_stats[url]
+        stats[f"asyncpg-{index}"] = {
+            "size": pool.get_size(),
+            "idle": pool.get_idle_size(),
+            "in_use": pool.get_size() - pool.get_idle_size(),
+            "min_size": pool.get_min_size(),
+            "max_size": pool.get_max_size(),
+            **counters,
+            "wait_seconds_avg": counters["wait_seconds_total"] / counters["checkouts"] if counters["checkouts"] else 0.0,
+        }
+    return stats
+
+
+class AsyncPostgresManager(AsyncDatabaseManager):
+    engine = "postgres"
+
+    def __init__(self, schema_name='public'):
+        self.conn = None
+        self.pool = None
+        self.url = None
+        self.loop = None
+        self.schema_name = schema_name
+
+    async def connect_with_url(self, url):
+        self.url = url
+        self.loop = asyncio.get_running_loop()
+        self.pool = await get_pool(url)
+        counters = _pool_stats[url]
+        started_at = time.monotonic()
+        try:
+            self.conn = await self.pool.acquire(timeout=DATABASE_POOL_CHECKOUT_TIMEOUT)
+        except asyncio.TimeoutError:
+            counters["timeouts"] += 1
+            raise
+        waited = time.monotonic() - started_at
+        counters["checkouts"] += 1
+        counters["wait_seconds_total"] += waited
+        counters["wait_seconds_max"] = max(counters["wait_seconds_max"], waited)
+
+    async def close(self):
+        if self.conn is not None:
+            await self.pool.release(self.conn)
+            self.conn = None
+
+    async def execute_sql(self, sql):
+        try:
+            statement = await self.conn.prepare(sql)
+            columns = [attribute.name for attribute in statement.get_attributes()]
+            if not columns:
+                await statement.fetch()
+                # Status messages look like "UPDATE 3" or "INSERT 0 3".
+                status = (statement.get_statusmsg() or "").split()
+                return ResultHandle.for_statement(int(status[-1]) if status and status[-1].isdigit() else 0)
+            # Cursors stream rows in prefetch-sized batches inside a transaction;
+            # file writes run in a thread so the event loop isn't blocked on disk.
+            writer = await asyncio.to_thread(ResultWriter, columns)
+            try:
+                async with self.conn.transaction():
+                    batch = []
+                    async for record in statement.cursor(prefetch=RESULTS_BATCH_SIZE):
+                        batch.append(tuple(record))
+                        if len(batch) >= RESULTS_BATCH_SIZE:
+                            await asyncio.to_thread(writer.write_rows, batch)
+                            batch = []
+                    await asyncio.to_thread(writer.write_rows, batch)
+            except BaseException:
+                await asyncio.to_thread(writer.discard)
+                raise
+            return await asyncio.to_thread(writer.close)
+        except asyncpg.exceptions.QueryCanceledError:
+            raise timed_out()
+        except Exception as e:
+            logger.error(f"Error executing SQL: {e}")
+
+    async def explain(self, sql):
+        return json.loads(await self.conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}"))
+
+    async def get_plan_estimate(self, sql, plan=None):
+        return postgres_plan_estimate(await self.explain(sql) if plan is None else plan)
+
+    @asynccontextmanager
+    async def statement_timeout(self, timeout_ms):
+        timeout_ms = min(timeout for timeout in (timeout_ms, DATABASE_STATEMENT_TIMEOUT_MS) if timeout)
+        await self.conn.execute(f"SET statement_timeout = {int(timeout_ms)}")
+        try:
+            yield
+        finally:
+            await self.conn.execute(f"SET statement_timeout = {int(DATABASE_STATEMENT_TIMEOUT_MS)}")
+
+    async def get_table_versions(self, table_names: list):
+        # Outside a transaction every statement gets a fresh stats snapshot.
+        rows = await self.conn.fetch(TABLE_VERSIONS_QUERY, self.schema_name, list(table_names))
+        return tuple(tuple(row) for row in rows)
+
+    async def introspect_schema(self, table_names: list = None) -> Schema:
+        rows = await self.conn.fetch(
+            SCHEMA_INTROSPECTION_QUERY,
+            self.schema_name,
+            list(table_names) if table_names is not None else None)
+        tables = [
+            {
+                "name": row[0],
+                "comment": row[1],
+                "columns": json.loads(row[2]),
+                "primary_key": json.loads(row[3]),
+                "foreign_keys": json.loads(row[4]),
+                "indexes": json.loads(row[5]),
+            }
+            for row in rows
+        ]
+        return Schema.from_dicts(self.schema_name, tables)
+
+    async def get_schema_version(self):
+        # The LISTEN connection is shared with the blocking managers; polling
+        # it does not wait on the network, only starting it does.
+        listener = SchemaChangeListener.for_url(self.url)
+        if not listener.started:
+            try:
+                await asyncio.to_thread(listener.start)
+            except Exception as e:
+                logger.warning(f"Could not start schema change listener: {e}")
+        generation = listener.poll()
+        if generation is not None:
+            return ("notify", generation)
+        fingerprint = listener.recent_fingerprint(self.schema_name)
+        if fingerprint is None:
+            fingerprint = await self.conn.fetchval(SCHEMA_FINGERPRINT_QUERY, self.schema_name)
+            listener.store_fingerprint(self.schema_name, fingerprint)
+        return ("fingerprint", fingerprint)
@@ -0,0 +1,66 @@
+import threading
+
+
+class CatalogCache:
+    """
+    Process-wide cache of schema catalogs.
+    Entries are keyed by (engine, database, schema) and tagged with the schema
+    version reported by the database manager when they were loaded. An entry is
+    served from memory until the manager reports a different version.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def lookup(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                self.invalidations += 1
+                del self._entries[key]
+            return None
+
+    def store(self, key, version, catalog):
+        with self._lock:
+            self._entries[key] = (version, catalog)
+
+    def get(self, key, version, loader):
+        """
+        Returns the cached catalog for key if it was loaded at version,
+        otherwise calls loader() and caches its result.
+        """
+        catalog = self.lookup(key, version)
+        if catalog is None:
+            catalog = loader()
+            self.store(key, version, catalog)
+        return catalog
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+            elif self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+catalog_cache = CatalogCache()
@@ -1,18 +1,50 @@
+import itertools
+import os
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from psqlagent.modules.db.catalog_cache import catalog_cache
+from psqlagent.modules.db.guard import check_plan, needs_plan_check, plan_failed
+from psqlagent.modules.db.manager_common import ManagerCommon
+from psqlagent.modules.db.result_cache import result_cache
+from psqlagent.modules.db.schema import Schema
+from psqlagent.modules.metrics import logger, span
+from psqlagent.modules.schema_context import SchemaContextBuilder, SCHEMA_CONTEXT_TOKEN_BUDGET
 
-class DatabaseManager(ABC):
+UPSERT_BATCH_SIZE = int(os.getenv('UPSERT_BATCH_SIZE', '5000'))
+
+
+def batched(rows, batch_size: int):
+    """Yields lists of up to batch_size items from any iterable."""
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, batch_size)):
+        yield batch
+
+
+class DatabaseManager(ManagerCommon, ABC):
     def __enter__(self):
         pass
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         pass
-    
+
     def connect_with_url(self, url):
         pass
 
     def upsert(self, table_name, _dict):
         pass
 
+    def upsert_many(self, table_name, rows, key_columns=("id",), batch_size=UPSERT_BATCH_SIZE) -> int:
+        """
+        Inserts or updates rows (dicts with the same keys) matched on
+        key_columns, in batches of batch_size within a single transaction;
+        when a key repeats, the last row wins. Returns the number of rows.
+        """
+        count = 0
+        for row in rows:
+            self.upsert(table_name, row)
+            count += 1
+        return count
+
     def delete(self, table_name, _id):
         pass
 
@@ -22,28 +54,151 @@ class DatabaseManager(ABC):
     def get_all(self, table_name, limit=100):
         pass
 
-    def run_sql(self, sql):
+    def run_sql(self, sql, plan=None):
+        """
+        Runs sql and streams any rows to a new result artifact, serving
+        repeated reads from the result cache while the tables they read are
+        unchanged. Returns a ResultHandle with the artifact path and row count.
+        Raises QueryRejected if the SQL guard rejects sql. plan is the explain
+        output of limit_rows(sql), for callers that already planned it.
+        """
+        with span("run_sql", engine=self.engine, cache="bypass") as run_sql_span:
+            # The row limit is pure text, so cached results are found without planning.
+            limited_sql = self.limit_rows(sql)
+            key, version = self.result_cache_key(limited_sql)
+            handle = None
+            if version is not None:
+                handle = result_cache.lookup(key, version)
+                run_sql_span.labels["cache"] = "miss" if handle is None else "hit"
+            if handle is None:
+                if self.sql_guard_enabled:
+                    self.check_sql_plan(limited_sql, plan)
+                handle = self.execute_guarded(limited_sql)
+                if version is not None:
+                    result_cache.store(key, version, handle)
+                else:
+                    self.record_write(sql)
+            self.mark_row_limit(handle, sql, limited_sql)
+            return handle
+
+    def check_sql_plan(self, sql, plan=None):
+        """
+        Checks the estimated plan of sql, or plan if it was already explained.
+        Raises QueryRejected if the plan is too expensive, sql can't be planned
+        or is a statement the guard doesn't run (see needs_plan_check).
+        """
+        if not needs_plan_check(sql):
+            return
+        try:
+            estimate = self.get_plan_estimate(sql, plan)
+        except Exception as e:
+            raise plan_failed(e)
+        check_plan(estimate, self.max_plan_cost)
+
+    def get_plan_estimate(self, sql, plan=None):
+        """
+        Returns the PlanEstimate of sql, from plan (its explain output) if
+        given, or None if the engine can't tell (skips the check).
+        """
+        return None
+
+    def execute_guarded(self, sql):
+        if not self.guard_timeout_ms:
+            return self.execute_sql(sql)
+        with self.statement_timeout(self.guard_timeout_ms):
+            return self.execute_sql(sql)
+
+    @contextmanager
+    def statement_timeout(self, timeout_ms):
+        """Limits statements run inside the block to timeout_ms where the engine supports it."""
+        yield
+
+    def execute_sql(self, sql):
+        """Runs sql against the database, bypassing the result cache."""
         pass
 
-    def save_results(self, result_data):
+    def explain(self, sql):
+        """
+        Returns the estimated plan of sql without running it.
+        Raises the driver's error if sql does not parse or plan.
+        """
         pass
-    
+
+    def get_table_versions(self, table_names: list):
+        """
+        Returns a hashable stamp that changes whenever rows of table_names
+        are written, or None if the engine can't tell (disables caching).
+        """
+        return None
+
+    def result_cache_key(self, sql):
+        """Returns (key, version) for sql; version is None when sql can't be cached."""
+        if not self.may_cache(sql):
+            return None, None
+        try:
+            tables = self.cached_tables(sql, self.get_schema())
+            version = self.get_table_versions(tables) if tables else None
+        except Exception as e:
+            logger.warning(f"Could not read table versions for the result cache: {e}")
+            return None, None
+        return self.result_key(sql), version
+
     @abstractmethod
-    def get_table_definitions(self, table_name):
+    def introspect_schema(self, table_names: list = None) -> Schema:
+        """
+        Loads columns, primary keys, foreign keys and indexes for all tables of
+        the schema (or only table_names) in a single round trip.
+        """
         pass
-    
+
     @abstractmethod
-    def get_all_table_names(self):
+    def get_schema_version(self):
+        """
+        Returns a cheap, hashable token that changes whenever the schema changes.
+        Used to decide whether the cached catalog is still valid.
+        """
         pass
-    
-    @abstractmethod
+
+    def get_schema(self) -> Schema:
+        """
+        Returns the schema model, served from the process-wide catalog cache
+        while the schema version is unchanged.
+        """
+        version = self.get_schema_version()
+        return catalog_cache.get(self.catalog_key, version, self.load_schema)
+
+    def load_schema(self) -> Schema:
+        with span("schema_introspection", engine=self.engine):
+            return self.introspect_schema()
+
+    def invalidate_catalog(self):
+        catalog_cache.invalidate(self.catalog_key)
+
+    def get_tables(self, table_names: list) -> list:
+        return self.get_schema().select(table_names)
+
+    def get_all_table_names(self):
+        return self.get_schema().table_names()
+
+    def get_table_definitions(self, table_name):
+        tables = self.get_tables([table_name])
+        return tables[0].definition if tables else ""
+
     def get_table_definition_for_prompt(self, table_name):
-        pass
+        return self.get_schema().prompt_definitions(None if table_name == '*' else [table_name])
 
-    @abstractmethod
     def get_table_definition_map_for_embedding(self, table_name) -> dict:
-        pass
-    
-    @abstractmethod
-    def get_tables_definition_for_prompt(self, table_names: list):
-        pass
\ No newline at end of file
+        return self.get_schema().definition_map(table_name)
+
+    def get_tables_definition_for_prompt(self, table_names: list, column_names: dict = None):
+        """column_names (table name -> set of column names) limits the columns listed per table."""
+        return self.get_schema().prompt_definitions(table_names, column_names)
+
+    def get_schema_context(self, query: str, table_names: list = None,
+                           token_budget: int = SCHEMA_CONTEXT_TOKEN_BUDGET, column_names: dict = None) -> str:
+        """
+        Compact definitions of table_names (all tables if None) ranked by
+        relevance to query and bounded to token_budget tokens; column_names
+        as in get_tables_definition_for_prompt.
+        """
+        return SchemaContextBuilder(token_budget).build(self.get_schema().select(table_names), query, column_names)
@@ -0,0 +1,138 @@
+"""
+Purpose:
+    Guard agent-generated SQL before it runs. Reads without a row limit get
+    one, every statement is estimated with EXPLAIN (Postgres) or SHOWPLAN
+    (SQL Server) and rejected when its plan is too expensive, and the
+    rejection reason is short enough for the agent to act on and retry.
+"""
+
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from psqlagent.modules.db.result_cache import blank_literals, is_query, is_read_only
+
+SQL_GUARD_ENABLED = os.getenv('SQL_GUARD_ENABLED', 'true').lower() == 'true'
+# Postgres plan cost units (sequential page reads); 1e6 is roughly a full scan of 8 GB.
+SQL_GUARD_MAX_COST = float(os.getenv('SQL_GUARD_MAX_COST', '1000000'))
+# SQL Server estimated subtree cost units.
+SQL_GUARD_MAX_SUBTREE_COST = float(os.getenv('SQL_GUARD_MAX_SUBTREE_COST', '1000'))
+# Estimated rows of the statement's result.
+SQL_GUARD_MAX_ROWS = float(os.getenv('SQL_GUARD_MAX_ROWS', '10000000'))
+# Added to reads that don't limit their rows; 0 disables.
+SQL_GUARD_ROW_LIMIT = int(os.getenv('SQL_GUARD_ROW_LIMIT', '1000'))
+# Applied on top of DATABASE_STATEMENT_TIMEOUT_MS, the tighter one wins; 0 disables.
+SQL_GUARD_STATEMENT_TIMEOUT_MS = int(os.getenv('SQL_GUARD_STATEMENT_TIMEOUT_MS', '30000'))
+
+RETRY_HINT = "Add selective filters, join on key columns or aggregate, then try again."
+
+# Statements EXPLAIN can plan: queries and DML.
+PLANNABLE_SQL_PATTERN = re.compile(
+    r"\s*(\(\s*)*(select|values|table|with|insert|update|delete|merge)\b", re.IGNORECASE)
+
+
+class QueryRejected(Exception):
+    """Raised instead of running a statement; the message is what the agent sees."""
+
+
+@dataclass
+class PlanEstimate:
+    cost: float
+    rows: float
+
+
+def postgres_plan_estimate(plan) -> PlanEstimate:
+    """Estimate of the top plan node of EXPLAIN (FORMAT JSON) output."""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    return PlanEstimate(cost=float(root["Total Cost"]), rows=float(root["Plan Rows"]))
+
+
+def showplan_estimate(plan_xml: str) -> PlanEstimate:
+    """Estimate of the costliest statement of a SHOWPLAN_XML batch, or None if it has none."""
+    statements = [element for element in ET.fromstring(plan_xml).iter()
+                  if element.tag.endswith("StmtSimple") and element.get("StatementSubTreeCost")]
+    if not statements:
+        return None
+    costliest = max(statements, key=lambda element: float(element.get("StatementSubTreeCost")))
+    return PlanEstimate(cost=float(costliest.get("StatementSubTreeCost")),
+                        rows=float(costliest.get("StatementEstRows") or 0))
+
+
+def top_level(sql: str) -> str:
+    """sql with literals, comments and everything inside parentheses blanked out."""
+    chars = []
+    depth = 0
+    for char in blank_literals(sql):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        chars.append(char if depth == 0 and char != ")" else " ")
+    return "".join(chars)
+
+
+def add_row_limit(sql: str, engine: str, row_limit: int = SQL_GUARD_ROW_LIMIT) -> str:
+    """
+    Returns sql with LIMIT (Postgres) or TOP (SQL Server) row_limit added if
+    it is a query that doesn't limit its rows yet; anything else (including
+    EXPLAIN and SHOW) is returned as given, so callers can compare the two
+    to tell whether a limit was added.
+    """
+    if not row_limit or not is_query(sql):
+        return sql
+    stripped = sql.strip().rstrip(";").strip()
+    outer = top_level(stripped).lower()
+    if engine == "sqlserver":
+        # TOP goes on the first top-level SELECT (the one after any CTEs),
+        # which only limits the whole result when there is no set operation.
+        select = re.search(r"\bselect(\s+(distinct|all)\b)?", outer)
+        if (select is None or not re.match(r"\s*(select|with)\b", outer)
+                or re.search(r"\b(top|offset|fetch|union|intersect|except)\b", outer)):
+            return sql
+        return f"{stripped[:select.end()]} TOP ({row_limit}){stripped[select.end():]}"
+    if re.search(r"\b(limit|fetch)\b", outer):
+        return sql
+    # On its own line so a trailing line comment can't swallow it.
+    return f"{stripped}\nLIMIT {row_limit}"
+
+
+def needs_plan_check(sql: str) -> bool:
+    """
+    Whether sql's plan has to be checked before it runs. EXPLAIN and SHOW
+    can't be planned but don't run anything costly, so they are let through;
+    DDL and other statements are rejected outright.
+    """
+    code = blank_literals(sql).strip().rstrip(";")
+    if ";" not in code and PLANNABLE_SQL_PATTERN.match(code):
+        return True
+    if is_read_only(sql):
+        return False
+    raise QueryRejected(
+        "Query rejected: only single SELECT, WITH, VALUES, TABLE, INSERT, UPDATE, DELETE, MERGE, "
+        "EXPLAIN and SHOW statements are run.")
+
+
+def check_plan(estimate: PlanEstimate, max_cost: float, max_rows: float = SQL_GUARD_MAX_ROWS):
+    """Raises QueryRejected if estimate is above max_cost or max_rows (0 disables either)."""
+    if estimate is None:
+        return
+    if max_cost and estimate.cost > max_cost:
+        raise QueryRejected(
+            f"Query rejected before running: its estimated cost {estimate.cost:,.0f} is above the "
+            f"limit of {max_cost:,.0f} (about {estimate.rows:,.0f} rows). {RETRY_HINT}")
+    if max_rows and estimate.rows > max_rows:
+        raise QueryRejected(
+            f"Query rejected before running: it is estimated to produce {estimate.rows:,.0f} rows, "
+            f"above the limit of {max_rows:,.0f}. {RETRY_HINT}")
+
+
+def plan_failed(error: Exception) -> QueryRejected:
+    message = str(error).strip().splitlines()[0] if str(error).strip() else type(error).__name__
+    return QueryRejected(f"Query rejected before running, it could not be planned: {message}")
+
+
+def timed_out() -> QueryRejected:
+    return QueryRejected(f"Query cancelled: it ran past the statement timeout. {RETRY_HINT}")
@@ -0,0 +1,76 @@
+"""
+Purpose:
+    Decisions shared by the blocking and the async database managers: the
+    row limit, whether and under which key a result is cached, what a write
+    invalidates. Both managers call these around their own I/O, so they only
+    differ in calling the driver directly or awaiting it.
+"""
+
+import hashlib
+from psqlagent.modules.db.guard import (
+    add_row_limit, SQL_GUARD_ENABLED, SQL_GUARD_MAX_COST, SQL_GUARD_ROW_LIMIT, SQL_GUARD_STATEMENT_TIMEOUT_MS,
+)
+from psqlagent.modules.db.result_cache import (
+    result_cache, is_cacheable, is_read_only, normalize_sql, referenced_tables, unknown_relations,
+    RESULT_CACHE_ENABLED,
+)
+from psqlagent.modules.db.results import RESULTS_FORMAT
+from psqlagent.modules.db.schema import Schema
+
+
+class ManagerCommon:
+    engine = None
+    result_cache_enabled = RESULT_CACHE_ENABLED
+    # Set once this manager runs a write; its connection may then see
+    # uncommitted rows, which must not be cached or answered from the cache.
+    has_written = False
+    sql_guard_enabled = SQL_GUARD_ENABLED
+    max_plan_cost = SQL_GUARD_MAX_COST
+
+    def limit_rows(self, sql) -> str:
+        """sql as run_sql runs it: with the guard's row limit added to unlimited reads."""
+        return add_row_limit(sql, self.engine) if self.sql_guard_enabled else sql
+
+    @property
+    def guard_timeout_ms(self):
+        """Timeout of guarded statements, or None to run them unbounded."""
+        return SQL_GUARD_STATEMENT_TIMEOUT_MS if self.sql_guard_enabled else None
+
+    def may_cache(self, sql) -> bool:
+        return self.result_cache_enabled and not self.has_written and is_cacheable(sql)
+
+    def cached_tables(self, sql, schema: Schema) -> list:
+        """
+        Tables whose versions key the cached result of sql; empty when sql
+        reads relations outside the schema, which have no versions to check.
+        """
+        table_names = schema.table_names()
+        if unknown_relations(sql, table_names, self.schema_name):
+            return []
+        return referenced_tables(sql, table_names)
+
+    def result_key(self, sql):
+        return self.catalog_key, normalize_sql(sql), RESULTS_FORMAT
+
+    def record_write(self, sql):
+        if self.result_cache_enabled and not is_read_only(sql):
+            # Writes only reach the table stats once committed and flushed,
+            # so drop this catalog's results rather than wait for the versions.
+            self.has_written = True
+            result_cache.invalidate(self.catalog_key)
+
+    @staticmethod
+    def mark_row_limit(handle, sql, limited_sql):
+        """Flags handle as cut at the row limit when the guard added the limit and it was reached."""
+        if handle is not None and limited_sql != sql and handle.row_count >= SQL_GUARD_ROW_LIMIT:
+            handle.row_limit = SQL_GUARD_ROW_LIMIT
+
+    @property
+    def catalog_key(self):
+        return (self.engine, self.url, self.schema_name)
+
+    @property
+    def catalog_id(self) -> str:
+        """Filesystem-safe identifier of the catalog; the url is hashed so credentials don't leak."""
+        digest = hashlib.sha256(repr(self.catalog_key).encode("utf-8")).hexdigest()[:16]
+        return f"{self.engine}-{self.schema_name}-{digest}"
@@ -0,0 +1,223 @@
+"""
+Purpose:
+    Process-wide connection pools shared by the database managers, so each
+    request checks out an open connection instead of paying the connect,
+    TLS and auth handshake.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from psqlagent.modules.metrics import logger
+
+DATABASE_POOL_MIN_SIZE = int(os.getenv('DATABASE_POOL_MIN_SIZE', '1'))
+DATABASE_POOL_MAX_SIZE = int(os.getenv('DATABASE_POOL_MAX_SIZE', '10'))
+DATABASE_POOL_IDLE_TIMEOUT = float(os.getenv('DATABASE_POOL_IDLE_TIMEOUT', '300'))
+DATABASE_POOL_CHECKOUT_TIMEOUT = float(os.getenv('DATABASE_POOL_CHECKOUT_TIMEOUT', '30'))
+DATABASE_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('DATABASE_POOL_HEALTH_CHECK_INTERVAL', '30'))
+DATABASE_STATEMENT_TIMEOUT_MS = int(os.getenv('DATABASE_STATEMENT_TIMEOUT_MS', '0'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, name, connect, is_healthy, reset,
+                 min_size=DATABASE_POOL_MIN_SIZE,
+                 max_size=DATABASE_POOL_MAX_SIZE,
+                 idle_timeout=DATABASE_POOL_IDLE_TIMEOUT,
+                 checkout_timeout=DATABASE_POOL_CHECKOUT_TIMEOUT,
+                 health_check_interval=DATABASE_POOL_HEALTH_CHECK_INTERVAL):
+        """
+        connect() opens a new connection, is_healthy(conn) pings it and
+        reset(conn) returns it to a clean state (e.g. rolls back) on checkin.
+        """
+        if min_size > max_size:
+            raise ValueError("Pool min_size must not exceed max_size")
+        self.name = name
+        self._connect = connect
+        self._is_healthy = is_healthy
+        self._reset = reset
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+
+        # Idle connections as (conn, returned_at); newest on the right.
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.created = 0
+        self.closed = 0
+        self.health_check_failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def fill(self):
+        """Opens connections until min_size are available."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            conn = self._open()
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def checkout(self):
+        started_at = time.monotonic()
+        deadline = started_at + self.checkout_timeout
+        while True:
+            conn, returned_at = self._reserve(deadline)
+            if conn is None:
+                conn = self._open()
+            elif (time.monotonic() - returned_at > self.health_check_interval
+                  and not self._check_health(conn)):
+                continue
+            waited = time.monotonic() - started_at
+            with self._cond:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            return conn
+
+    def checkin(self, conn, discard=False):
+        if not discard:
+            try:
+                self._reset(conn)
+            except Exception as e:
+                logger.warning(f"Discarding connection from pool {self.name}: {e}")
+                discard = True
+        if discard:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _reserve(self, deadline):
+        """
+        Takes an idle connection, or a slot for a new one (returned as None),
+        waiting until deadline if the pool is exhausted.
+        """
+        with self._cond:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f"Timed out after {self.checkout_timeout}s waiting for a connection from pool {self.name}")
+                self._cond.wait(remaining)
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.created += 1
+        return conn
+
+    def _check_health(self, conn) -> bool:
+        try:
+            if self._is_healthy(conn):
+                return True
+        except Exception:
+            pass
+        with self._cond:
+            self.health_check_failures += 1
+        self._discard(conn)
+        return False
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self.closed += 1
+
+    def _evict_idle(self):
+        # Called with the lock held; the oldest idle connections are on the left.
+        now = time.monotonic()
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][1] > self.idle_timeout):
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self.closed += 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "closed": self.closed,
+                "health_check_failures": self.health_check_failures,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_avg": self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(engine, url, connect, is_healthy, reset) -> ConnectionPool:
+    """Returns the process-wide pool for (engine, url), creating and filling it on first use."""
+    key = (engine, url)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:12]
+            pool = ConnectionPool(f"{engine}-{digest}", connect, is_healthy, reset)
+            _pools[key] = pool
+    pool.fill()
+    return pool
+
+
+def pool_stats() -> dict:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.name: pool.stats() for pool in pools}
@@ -1,20 +1,306 @@
+import io
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import uuid
 import psycopg2
-from psqlagent.modules.db.dbmanager import DatabaseManager
+import psycopg2.errors
+import psycopg2.extensions
+from contextlib import contextmanager
+from psqlagent.modules.db.dbmanager import DatabaseManager, batched, UPSERT_BATCH_SIZE
+from psqlagent.modules.db.guard import postgres_plan_estimate, timed_out
+from psqlagent.modules.db.pool import get_pool, DATABASE_STATEMENT_TIMEOUT_MS
+from psqlagent.modules.db.results import ResultHandle, stream_cursor, RESULTS_BATCH_SIZE
+from psqlagent.modules.db.schema import Schema
+from psqlagent.modules.metrics import logger
+
+SCHEMA_CHANGE_CHANNEL = "psqlagent_schema_changes"
+SCHEMA_CHANGE_TRIGGER = "psqlagent_schema_changes"
+SCHEMA_CHANGE_FUNCTION = "psqlagent_notify_schema_change"
+# Without the event trigger the schema version is a fingerprint of the
+# catalog; it is reused for this many seconds, so DDL is seen at most that late.
+SCHEMA_FINGERPRINT_TTL = float(os.getenv('SCHEMA_FINGERPRINT_TTL', '5'))
+
+SCHEMA_CHANGE_TRIGGER_DDL = f"""
+    CREATE OR REPLACE FUNCTION {SCHEMA_CHANGE_FUNCTION}() RETURNS event_trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM pg_notify('{SCHEMA_CHANGE_CHANNEL}', tg_tag);
+    END;
+    $$;
+    DROP EVENT TRIGGER IF EXISTS {SCHEMA_CHANGE_TRIGGER};
+    CREATE EVENT TRIGGER {SCHEMA_CHANGE_TRIGGER} ON ddl_command_end
+        EXECUTE FUNCTION {SCHEMA_CHANGE_FUNCTION}();
+"""
+
+SCHEMA_FINGERPRINT_QUERY = """
+    WITH tables AS (
+        SELECT c.oid, c.xmin
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %(schema_name)s AND c.relkind IN ('r', 'p')
+    )
+    SELECT md5(
+        coalesce((
+            SELECT string_agg(t.oid::text || ':' || t.xmin::text || ':' || a.attnum::text || ':' || a.xmin::text,
+                              ',' ORDER BY t.oid, a.attnum)
+            FROM tables t
+            JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum > 0
+        ), '') || '|' ||
+        coalesce((
+            SELECT string_agg(con.oid::text || ':' || con.xmin::text, ',' ORDER BY con.oid)
+            FROM pg_constraint con
+            JOIN tables t ON t.oid = con.conrelid
+        ), '') || '|' ||
+        coalesce((
+            SELECT string_agg(ix.indexrelid::text || ':' || ix.xmin::text, ',' ORDER BY ix.indexrelid)
+            FROM pg_index ix
+            JOIN tables t ON t.oid = ix.indrelid
+        ), '')
+    );
+"""
+
+# One row per table with columns, keys and indexes aggregated as json, so the
+# whole schema is loaded in a single round trip.
+SCHEMA_INTROSPECTION_QUERY = """
+    SELECT
+        c.relname,
+        obj_description(c.oid, 'pg_class'),
+        coalesce((
+            SELECT json_agg(json_build_object(
+                'name', a.attname,
+                'data_type', format_type(a.atttypid, a.atttypmod),
+                'nullable', NOT a.attnotnull,
+                'comment', col_description(c.oid, a.attnum)
+            ) ORDER BY a.attnum)
+            FROM pg_attribute a
+            WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        ), '[]'::json),
+        coalesce((
+            SELECT json_agg(a.attname ORDER BY k.ord)
+            FROM pg_constraint con
+            CROSS JOIN unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+            WHERE con.conrelid = c.oid AND con.contype = 'p'
+        ), '[]'::json),
+        coalesce((
+            SELECT json_agg(json_build_object(
+                'name', con.conname,
+                'columns', (
+                    SELECT json_agg(a.attname ORDER BY k.ord)
+                    FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+                    JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+                ),
+                'ref_table', ref.relname,
+                'ref_columns', (
+                    SELECT json_agg(a.attname ORDER BY k.ord)
+                    FROM unnest(con.confkey) WITH ORDINALITY AS k(attnum, ord)
+                    JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum
+                )
+            ) ORDER BY con.conname)
+            FROM pg_constraint con
+            JOIN pg_class ref ON ref.oid = con.confrelid
+            WHERE con.conrelid = c.oid AND con.contype = 'f'
+        ), '[]'::json),
+        coalesce((
+            SELECT json_agg(json_build_object(
+                'name', i.relname,
+                'columns', coalesce((
+                    SELECT json_agg(a.attname ORDER BY k.ord)
+                    FROM unnest(ix.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+                    JOIN pg_attribute a ON a.attrelid = ix.indrelid AND a.attnum = k.attnum
+                ), '[]'::json),
+                'is_unique', ix.indisunique,
+                'is_primary', ix.indisprimary
+            ) ORDER BY i.relname)
+            FROM pg_index ix
+            JOIN pg_class i ON i.oid = ix.indexrelid
+            WHERE ix.indrelid = c.oid
+        ), '[]'::json)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %(schema_name)s
+      AND c.relkind IN ('r', 'p')
+      AND (%(table_names)s::text[] IS NULL OR c.relname = ANY(%(table_names)s::text[]))
+    ORDER BY c.relname;
+"""
+
+# Write counters per table, plus the relfilenode, which TRUNCATE changes
+# without touching the counters.
+TABLE_VERSIONS_QUERY = """
+    SELECT s.relname, s.n_tup_ins + s.n_tup_upd + s.n_tup_del, c.relfilenode
+    FROM pg_stat_user_tables s
+    JOIN pg_class c ON c.oid = s.relid
+    WHERE s.schemaname = %(schema_name)s AND s.relname = ANY(%(table_names)s::text[])
+    ORDER BY s.relname;
+"""
+
+
+class SchemaChangeListener:
+    """
+    Holds a dedicated LISTEN connection per database url and counts the DDL
+    notifications sent by the schema change event trigger. The notification
+    count is used as the schema version, so checking it costs no round trip.
+    When the trigger is missing, it keeps the latest catalog fingerprint of
+    each schema for SCHEMA_FINGERPRINT_TTL seconds instead.
+    """
+    _listeners = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, url):
+        self.url = url
+        self.conn = None
+        self.generation = 0
+        self.started = False
+        self._lock = threading.Lock()
+        # schema name -> (monotonic time read, fingerprint)
+        self._fingerprints = {}
+
+    @classmethod
+    def for_url(cls, url):
+        with cls._registry_lock:
+            if url not in cls._listeners:
+                cls._listeners[url] = cls(url)
+            return cls._listeners[url]
+
+    def start(self):
+        """
+        Starts listening if the event trigger is installed.
+        Returns False when the trigger is missing so callers can fall back to
+        fingerprinting the catalog.
+        """
+        with self._lock:
+            self.started = True
+            self._close()
+            conn = psycopg2.connect(self.url)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT 1 FROM pg_event_trigger WHERE evtname = %s AND evtenabled <> 'D'",
+                    (SCHEMA_CHANGE_TRIGGER,))
+                if cur.fetchone() is None:
+                    conn.close()
+                    return False
+                cur.execute(f"LISTEN {SCHEMA_CHANGE_CHANNEL}")
+            self.conn = conn
+            # Changes may have happened while nobody was listening.
+            self.generation += 1
+            return True
+
+    def poll(self):
+        """Returns the current schema generation, or None if not listening."""
+        with self._lock:
+            if self.conn is None:
+                return None
+            try:
+                self.conn.poll()
+            except psycopg2.Error as e:
+                logger.warning(f"Schema change listener lost its connection: {e}")
+                self._close()
+                self.started = False
+                return None
+            if self.conn.notifies:
+                self.generation += len(self.conn.notifies)
+                self.conn.notifies.clear()
+            return self.generation
+
+    def recent_fingerprint(self, schema_name):
+        """The fingerprint of schema_name stored less than SCHEMA_FINGERPRINT_TTL seconds ago, or None."""
+        read_at, fingerprint = self._fingerprints.get(schema_name, (None, None))
+        if read_at is None or time.monotonic() - read_at >= SCHEMA_FINGERPRINT_TTL:
+            return None
+        return fingerprint
+
+    def store_fingerprint(self, schema_name, fingerprint):
+        self._fingerprints[schema_name] = (time.monotonic(), fingerprint)
+
+    def _close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def returns_rows(sql) -> bool:
+    """Whether sql can be run through a server-side (DECLARE ... CURSOR) cursor."""
+    return re.match(r"\s*(\(\s*)*(select|values|table)\b", sql, re.IGNORECASE) is not None
+
+
+def copy_csv_value(value) -> str:
+    # Unquoted empty is NULL in COPY's CSV format; everything else is quoted.
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        value = "\\x" + bytes(value).hex()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def copy_csv(rows: list, columns: list) -> io.StringIO:
+    """rows (dicts) as a COPY ... (FORMAT csv) input."""
+    return io.StringIO("".join(
+        ",".join(copy_csv_value(row[column]) for column in columns) + "\n" for row in rows))
+
+
+def is_connection_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+    conn.rollback()
+    return True
+
+
+def reset_connection(conn):
+    if conn.closed:
+        raise psycopg2.InterfaceError("connection already closed")
+    conn.rollback()
+
 
 class PostgresManager(DatabaseManager):
-    def __init__(self, schema_name='public'):
+    engine = "postgres"
+
+    def __init__(self, schema_name='public', pooled=False,
+                 statement_timeout_ms=DATABASE_STATEMENT_TIMEOUT_MS):
         self.conn = None
+        self.url = None
+        self.pool = None
         self.schema_name = schema_name
+        self.pooled = pooled
+        self.statement_timeout_ms = statement_timeout_ms
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.conn is not None:
-            self.conn.close()
+            if self.pool is not None:
+                self.pool.checkin(self.conn, discard=bool(self.conn.closed))
+            else:
+                self.conn.close()
+            self.conn = None
 
     def connect_with_url(self, url):
-        self.conn = psycopg2.connect(url)
+        self.url = url
+        if self.pooled:
+            self.pool = get_pool(self.engine, url, lambda: psycopg2.connect(url),
+                                 is_connection_healthy, reset_connection)
+            self.conn = self.pool.checkout()
+        else:
+            self.conn = psycopg2.connect(url)
+        # Pooled connections may carry another request's timeout, so always set it.
+        if self.pool is not None or self.statement_timeout_ms:
+            self.set_statement_timeout(self.statement_timeout_ms)
+
+    def set_statement_timeout(self, timeout_ms):
+        with self.conn.cursor() as cur:
+            cur.execute("SET statement_timeout = %s", (int(timeout_ms),))
+        self.conn.commit()
 
     def upsert(self, table_name, _dict):
         keys = _dict.keys()
@@ -28,6 +314,42 @@ class PostgresManager(DatabaseManager):
             cur.execute(query, list(values))
             self.conn.commit()
 
+    def upsert_many(self, table_name, rows, key_columns=("id",), batch_size=UPSERT_BATCH_SIZE) -> int:
+        # Each batch is COPYed into a temporary staging table and merged with
+        # one INSERT ... ON CONFLICT; DISTINCT ON keeps the last row per key,
+        # since ON CONFLICT can't update the same row twice in one statement.
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+        columns = list(first.keys())
+        column_list = ", ".join(columns)
+        key_list = ", ".join(key_columns)
+        updates = [column for column in columns if column not in key_columns]
+        on_conflict = ("DO UPDATE SET " + ", ".join(f"{column} = excluded.{column}" for column in updates)
+                       if updates else "DO NOTHING")
+        staging = f"psqlagent_upsert_{uuid.uuid4().hex[:12]}"
+        count = 0
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+                            f"SELECT {column_list} FROM {table_name} WITH NO DATA")
+                cur.execute(f"ALTER TABLE {staging} ADD COLUMN psqlagent_seq bigserial")
+                for batch in batched(itertools.chain([first], rows), batch_size):
+                    cur.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)",
+                                    copy_csv(batch, columns))
+                    cur.execute(f"INSERT INTO {table_name} ({column_list}) "
+                                f"SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging} "
+                                f"ORDER BY {key_list}, psqlagent_seq DESC "
+                                f"ON CONFLICT ({key_list}) {on_conflict}")
+                    cur.execute(f"TRUNCATE {staging}")
+                    count += len(batch)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return count
+
     def delete(self, table_name, _id):
         query = f"DELETE FROM {table_name} WHERE id = %s"
 
@@ -53,69 +375,117 @@ class PostgresManager(DatabaseManager):
 
         return rows
 
-    def run_sql(self, sql):
+    def execute_sql(self, sql):
         try:
+            if returns_rows(sql):
+                # A named cursor keeps the result set on the server and
+                # fetchmany pulls it in batches, so memory stays bounded.
+                with self.conn.cursor(name=f"psqlagent_{uuid.uuid4().hex}") as cur:
+                    cur.itersize = RESULTS_BATCH_SIZE
+                    cur.execute(sql)
+                    return stream_cursor(cur)
             with self.conn.cursor() as cur:
                 cur.execute(sql)
-                return self.save_results(cur.fetchall())
+                if cur.description is None:
+                    return ResultHandle.for_statement(cur.rowcount)
+                return stream_cursor(cur)
+        except psycopg2.errors.QueryCanceled:
+            self.conn.rollback()
+            raise timed_out()
         except Exception as e:
-            print("Error executing SQL:", e)
-
-    def save_results(self, result_data):
-        with open("results.txt", "w") as file:
-            file.write(str(result_data))
-        return "Successfully delivered results to json file."
-
-    def get_table_definitions(self, table_name):
-        select_query = """
-            SELECT column_name, data_type, character_maximum_length
-            FROM information_schema.columns
-            WHERE table_name = %s;
-        """
-        with self.conn.cursor() as cursor:
-            cursor.execute(select_query, (table_name,))
-            results = cursor.fetchall()
-            definition = [
-                f"name: {row[0]}, data_type: {row[1]}" +
-                (f"({row[2]})" if row[2] else "")
-                for row in results
+            # A failed statement aborts the transaction; roll back so the
+            # agent's next query on this connection can still run.
+            self.conn.rollback()
+            logger.error(f"Error executing SQL: {e}")
+
+    def explain(self, sql):
+        with self.rollback_on_error(), self.conn.cursor() as cur:
+            cur.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+            return cur.fetchone()[0]
+
+    def get_plan_estimate(self, sql, plan=None):
+        return postgres_plan_estimate(self.explain(sql) if plan is None else plan)
+
+    @contextmanager
+    def statement_timeout(self, timeout_ms):
+        # SET LOCAL only lasts until the transaction ends, so a failed
+        # statement's rollback restores the session timeout by itself.
+        timeout_ms = min(timeout for timeout in (timeout_ms, self.statement_timeout_ms) if timeout)
+        with self.conn.cursor() as cur:
+            cur.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+        try:
+            yield
+        finally:
+            if self.conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+                with self.conn.cursor() as cur:
+                    cur.execute("SET LOCAL statement_timeout = %s", (int(self.statement_timeout_ms),))
+
+    @contextmanager
+    def rollback_on_error(self):
+        """Rolls back a failed catalog read, which would otherwise abort the rest of the transaction."""
+        try:
+            yield
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def get_table_versions(self, table_names: list):
+        # Other sessions only flush their counters once idle, up to about ten
+        # seconds after they commit, so a hit can be that much behind them.
+        with self.rollback_on_error(), self.conn.cursor() as cur:
+            # The stats snapshot is otherwise frozen for the rest of the transaction.
+            cur.execute("SELECT pg_stat_clear_snapshot();" + TABLE_VERSIONS_QUERY, {
+                "schema_name": self.schema_name,
+                "table_names": list(table_names),
+            })
+            return tuple(cur.fetchall())
+
+    def introspect_schema(self, table_names: list = None) -> Schema:
+        with self.rollback_on_error(), self.conn.cursor() as cur:
+            cur.execute(SCHEMA_INTROSPECTION_QUERY, {
+                "schema_name": self.schema_name,
+                "table_names": list(table_names) if table_names is not None else None,
+            })
+            tables = [
+                {
+                    "name": row[0],
+                    "comment": row[1],
+                    "columns": row[2],
+                    "primary_key": row[3],
+                    "foreign_keys": row[4],
+                    "indexes": row[5],
+                }
+                for row in cur.fetchall()
             ]
-            return "; ".join(definition)
+        return Schema.from_dicts(self.schema_name, tables)
 
-    def get_all_table_names(self):
-        query = f"SELECT tablename FROM pg_tables WHERE schemaname = '{self.schema_name}'"
+    def install_schema_change_trigger(self):
+        """
+        Installs the event trigger that notifies catalog caches of DDL changes.
+        Requires superuser (or event trigger) privileges.
+        """
         with self.conn.cursor() as cur:
-            cur.execute(query)
-            table_names = [row[0] for row in cur.fetchall()]
+            cur.execute(SCHEMA_CHANGE_TRIGGER_DDL)
+            self.conn.commit()
+        SchemaChangeListener.for_url(self.url).start()
 
-        return table_names
+    def get_schema_fingerprint(self):
+        with self.rollback_on_error(), self.conn.cursor() as cur:
+            cur.execute(SCHEMA_FINGERPRINT_QUERY, {"schema_name": self.schema_name})
+            return cur.fetchone()[0]
 
-    def get_table_definition_for_prompt(self, table_name):
-        table_definitions = []
-        if table_name == '*':
-            table_names = self.get_all_table_names()
-        else:
-            table_names = [table_name]
-        for name in table_names:
-            definition = self.get_table_definitions(name)
-            table_definitions.append(
-                f"TABLE_NAME {name}, COLUMNS: {{definition}}")
-        return "\n".join(table_definitions)
-
-    def get_table_definition_map_for_embedding(self, table_name) -> dict:
-        if table_name == '*':
-            table_names = self.get_all_table_names()
-        else:
-            table_names = [table_name]
-        definitions = {}
-        for name in table_names:
-            definitions[name] = self.get_table_definitions(name)
-        return definitions
-
-    def get_tables_definition_for_prompt(self, table_names: list):
-        table_definitions = []
-        for name in table_names:
-            definition = self.get_table_definitions(name)
-            table_definitions.append(
-                f"TABLE_NAME {name}: COLUMNS: [{definition}]")
-        return "\n".join(table_definitions)
\ No newline at end of file
+    def get_schema_version(self):
+        listener = SchemaChangeListener.for_url(self.url)
+        if not listener.started:
+            try:
+                listener.start()
+            except psycopg2.Error as e:
+                logger.warning(f"Could not start schema change listener: {e}")
+        generation = listener.poll()
+        if generation is not None:
+            return ("notify", generation)
+        fingerprint = listener.recent_fingerprint(self.schema_name)
+        if fingerprint is None:
+            fingerprint = self.get_schema_fingerprint()
+            listener.store_fingerprint(self.schema_name, fingerprint)
+        return ("fingerprint", fingerprint)
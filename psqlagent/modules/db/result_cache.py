@@ -0,0 +1,337 @@
+"""
+Purpose:
+    Cache run_sql results across conversations and users. Entries are keyed
+    by the normalized SQL text and tagged with a version stamp of every table
+    the query reads, so a cached result is served only until one of those
+    tables is written to (or its TTL runs out).
+"""
+
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from psqlagent.modules.db.results import ResultHandle, RESULTS_DIR
+from psqlagent.modules.metrics import logger
+
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', '300'))
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1000'))
+
+# String literals and quoted identifiers are kept verbatim; everything else is
+# case- and whitespace-insensitive.
+SQL_TOKEN_PATTERN = re.compile(
+    r"""(?P<literal>'(?:[^']|'')*'|"(?:[^"]|"")*"|\[[^\]]*\])"""
+    r"""|(?P<comment>--[^\n]*|/\*.*?\*/)"""
+    r"""|(?P<space>\s+)""",
+    re.DOTALL)
+
+# Statements whose result depends on more than the tables they read.
+VOLATILE_SQL_PATTERN = re.compile(
+    r"\b(now|random|nextval|setval|currval|clock_timestamp|statement_timestamp|timeofday"
+    r"|current_date|current_time|current_timestamp|localtime|localtimestamp"
+    r"|getdate|getutcdate|sysdatetime|sysutcdatetime|sysdatetimeoffset|newid|rand)\b",
+    re.IGNORECASE)
+
+QUERY_SQL_PATTERN = re.compile(r"\s*(\(\s*)*(select|values|table|with)\b", re.IGNORECASE)
+DATA_MODIFYING_SQL_PATTERN = re.compile(
+    r"\b(insert|update|delete|merge|into)\b|\bfor\s+(no\s+key\s+)?(update|share)\b", re.IGNORECASE)
+EXPLAIN_SQL_PATTERN = re.compile(
+    r"\s*explain(?P<options>\s*\([^)]*\)|(\s+(analyze|analyse|verbose))*)\s", re.IGNORECASE)
+SHOW_SQL_PATTERN = re.compile(r"\s*show\b", re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    """Lowercases sql outside of literals, drops comments and collapses whitespace."""
+    parts = []
+    position = 0
+    for match in SQL_TOKEN_PATTERN.finditer(sql):
+        parts.append(sql[position:match.start()].lower())
+        if match.group("literal"):
+            parts.append(match.group("literal"))
+        else:
+            parts.append(" ")
+        position = match.end()
+    parts.append(sql[position:].lower())
+    return re.sub(r"\s+", " ", "".join(parts)).strip().rstrip(";").strip()
+
+
+def blank_literals(sql: str) -> str:
+    """sql with literals, quoted identifiers and comments blanked out, keeping every offset."""
+    return SQL_TOKEN_PATTERN.sub(lambda match: " " * len(match.group(0)), sql)
+
+
+def is_query(sql: str) -> bool:
+    """
+    Whether sql is a single SELECT, VALUES, TABLE or WITH statement that
+    only reads rows. Data-modifying CTEs sit inside parentheses, so their
+    keywords are looked for anywhere in the statement.
+    """
+    code = blank_literals(sql).strip().rstrip(";")
+    return (QUERY_SQL_PATTERN.match(code) is not None
+            and ";" not in code
+            and DATA_MODIFYING_SQL_PATTERN.search(code) is None)
+
+
+def is_read_only(sql: str) -> bool:
+    """Whether running sql can't write: a query, SHOW, or EXPLAIN (EXPLAIN ANALYZE only of a query)."""
+    code = blank_literals(sql)
+    if ";" in code.strip().rstrip(";"):
+        return False
+    explain = EXPLAIN_SQL_PATTERN.match(code)
+    if explain:
+        # EXPLAIN ANALYZE runs the statement it explains.
+        if re.search(r"\banaly[sz]e\b", explain.group("options"), re.IGNORECASE):
+            return is_query(sql[explain.end():])
+        return True
+    return SHOW_SQL_PATTERN.match(code) is not None or is_query(sql)
+
+
+def is_cacheable(sql: str) -> bool:
+    """Only queries without volatile functions are cached."""
+    return is_query(sql) and VOLATILE_SQL_PATTERN.search(blank_literals(sql)) is None
+
+
+def referenced_tables(sql: str, table_names: list) -> list:
+    """Tables of the catalog whose names appear as identifiers in sql."""
+    identifiers = {
+        identifier.strip('"[]').lower()
+        for identifier in re.findall(r'"(?:[^"]|"")*"|\[[^\]]*\]|[A-Za-z_][A-Za-z0-9_$#]*',
+                                     re.sub(r"'(?:[^']|'')*'", " ", sql))
+    }
+    return sorted(name for name in table_names if name.lower() in identifiers)
+
+
+RELATION_TOKEN_PATTERN = re.compile(r'"(?:[^"]|"")*"|\[[^\]]*\]|[A-Za-z_][A-Za-z0-9_$#]*|\S')
+# Words that can't be a function name or an alias, e.g. the IN of "IN (SELECT ...)".
+SQL_KEYWORDS = {
+    "select", "from", "where", "join", "inner", "left", "right", "full", "outer", "cross", "natural", "on",
+    "using", "group", "order", "by", "having", "limit", "offset", "fetch", "union", "intersect", "except",
+    "all", "distinct", "as", "and", "or", "not", "in", "exists", "any", "some", "with", "recursive",
+    "materialized", "lateral", "only", "values", "table", "window", "over", "filter", "within", "case",
+    "when", "then", "else", "end", "is", "null", "like", "ilike", "between", "return", "returning",
+}
+
+
+def identifier(token: str) -> str:
+    if token.startswith('"'):
+        return token[1:-1].replace('""', '"')
+    if token.startswith("["):
+        return token[1:-1].lower()
+    return token.lower()
+
+
+def is_identifier(token: str) -> bool:
+    return (token[0] in '"[' or token[0].isalpha() or token[0] == "_") and token.lower() not in SQL_KEYWORDS
+
+
+def read_relations(sql: str) -> tuple:
+    """
+    (relations, cte_names) of a query: relations are the (schema or None,
+    name) pairs read in FROM, JOIN and TABLE clauses, names of table
+    functions included; cte_names the names its WITH clause defines.
+    """
+    code = re.sub(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    tokens = RELATION_TOKEN_PATTERN.findall(code)
+    relations, cte_names = [], set()
+    # Whether each open parenthesis is a function call, where FROM is an
+    # argument keyword (EXTRACT(YEAR FROM ...)) rather than a clause.
+    calls = []
+    i = 0
+    while i < len(tokens):
+        token, lowered = tokens[i], tokens[i].lower()
+        if token == "(":
+            calls.append(i > 0 and is_identifier(tokens[i - 1]))
+        elif token == ")":
+            if calls:
+                calls.pop()
+        elif lowered == "as" and i + 1 < len(tokens):
+            following = i + 1
+            while following < len(tokens) and tokens[following].lower() in ("not", "materialized"):
+                following += 1
+            if following < len(tokens) and tokens[following] == "(":
+                # name [(columns)] AS [NOT MATERIALIZED] ( ... ) defines a CTE.
+                start = i - 1
+                if tokens[start] == ")":
+                    depth = 0
+                    while start >= 0:
+                        depth += tokens[start] == ")"
+                        depth -= tokens[start] == "("
+                        if depth == 0:
+                            break
+                        start -= 1
+                    start -= 1
+                if start >= 0 and is_identifier(tokens[start]):
+                    cte_names.add(identifier(tokens[start]))
+        elif lowered in ("from", "join") or (lowered == "table" and i == 0):
+            if lowered == "from" and calls and calls[-1]:
+                i += 1
+                continue
+            i += 1
+            while True:
+                while i < len(tokens) and tokens[i].lower() in ("only", "lateral"):
+                    i += 1
+                if i >= len(tokens) or not is_identifier(tokens[i]):
+                    break
+                parts = [identifier(tokens[i])]
+                i += 1
+                while i + 1 < len(tokens) and tokens[i] == "." and is_identifier(tokens[i + 1]):
+                    parts.append(identifier(tokens[i + 1]))
+                    i += 2
+                relations.append((parts[-2] if len(parts) > 1 else None, parts[-1]))
+                if i < len(tokens) and tokens[i] == "(":
+                    break
+                if i < len(tokens) and tokens[i].lower() == "as":
+                    i += 1
+                if i < len(tokens) and is_identifier(tokens[i]):
+                    i += 1
+                if i < len(tokens) and tokens[i] == ",":
+                    i += 1
+                    continue
+                break
+            continue
+        i += 1
+    return relations, cte_names
+
+
+def unknown_relations(sql: str, table_names: list, schema_name: str = None) -> list:
+    """
+    Relations sql reads that aren't tables of the catalog: views, tables of
+    other schemas, table functions. Their writes aren't versioned, so
+    results reading them must not be cached.
+    """
+    relations, cte_names = read_relations(sql)
+    tables = {name.lower() for name in table_names}
+    schema_name = schema_name.lower() if schema_name else None
+    return sorted({
+        f"{schema}.{name}" if schema else name
+        for schema, name in relations
+        if not (schema is None and name.lower() in cte_names)
+        and not (name.lower() in tables and (schema is None or schema.lower() == schema_name))
+    })
+
+
+class ResultCache:
+    """
+    LRU cache of result artifacts with a TTL and a byte budget.
+    Each entry keeps its own hard link (or copy) of the artifact under
+    RESULTS_DIR/cache, and every hit gets a fresh per-request artifact, so
+    evicting an entry never removes a file an agent was handed.
+    """
+
+    def __init__(self, results_directory=RESULTS_DIR, ttl=RESULT_CACHE_TTL,
+                 max_bytes=RESULT_CACHE_MAX_BYTES, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.results_directory = results_directory
+        self.directory = os.path.join(results_directory, "cache")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # key -> (version, handle, stored_at); least recently used first.
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def lookup(self, key, version):
+        """Returns a new ResultHandle for the cached result, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != version:
+                self.invalidations += 1
+                self._remove(key)
+                entry = None
+            elif entry is not None and time.monotonic() - entry[2] > self.ttl:
+                self.expirations += 1
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            cached = entry[1]
+
+        result_id = uuid.uuid4().hex
+        path = os.path.join(self.results_directory, f"{result_id}.{cached.format}")
+        try:
+            link_or_copy(cached.path, path)
+        except OSError as e:
+            # Evicted by another thread in the meantime.
+            logger.warning(f"Could not serve cached result: {e}")
+            return None
+        return ResultHandle(result_id=result_id, path=path, format=cached.format,
+                            columns=list(cached.columns), row_count=cached.row_count,
+                            bytes=cached.bytes)
+
+    def store(self, key, version, handle: ResultHandle):
+        if handle is None or handle.path is None or handle.bytes > self.max_bytes:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{handle.result_id}.{handle.format}")
+        try:
+            link_or_copy(handle.path, path)
+        except OSError as e:
+            logger.warning(f"Could not cache result: {e}")
+            return
+        cached = ResultHandle(result_id=handle.result_id, path=path, format=handle.format,
+                              columns=list(handle.columns), row_count=handle.row_count,
+                              bytes=handle.bytes)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, cached, time.monotonic())
+            self._bytes += cached.bytes
+            while self._entries and (self._bytes > self.max_bytes
+                                     or len(self._entries) > self.max_entries):
+                self.evictions += 1
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        # Called with the lock held.
+        _, cached, _ = self._entries.pop(key)
+        self._bytes -= cached.bytes
+        try:
+            os.remove(cached.path)
+        except OSError:
+            pass
+
+    def invalidate(self, catalog_key=None):
+        """Drops all entries, or only those of one catalog."""
+        with self._lock:
+            for key in [key for key in self._entries if catalog_key is None or key[0] == catalog_key]:
+                self.invalidations += 1
+                self._remove(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def link_or_copy(source, destination):
+    # Artifacts are never modified after they are written, so a hard link
+    # is as good as a copy and costs no I/O.
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+result_cache = ResultCache()
@@ -0,0 +1,226 @@
+"""
+Purpose:
+    Stream query results to a per-request artifact on disk, batch by batch,
+    instead of materialising them in memory and overwriting a shared file.
+"""
+
+import csv
+import datetime
+import decimal
+import json
+import os
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+RESULTS_DIR = os.getenv('RESULTS_DIR', 'results')
+RESULTS_FORMAT = os.getenv('RESULTS_FORMAT', 'jsonl')
+RESULTS_BATCH_SIZE = int(os.getenv('RESULTS_BATCH_SIZE', '1000'))
+# Rows parquet/arrow results hold back while a column is all NULL and its type unknown.
+RESULTS_ARROW_NULL_BUFFER_ROWS = int(os.getenv('RESULTS_ARROW_NULL_BUFFER_ROWS', '100000'))
+
+RESULT_FORMATS = ("jsonl", "csv", "parquet", "arrow")
+
+
+@dataclass
+class ResultHandle:
+    result_id: str
+    path: Optional[str]
+    format: Optional[str]
+    columns: List[str] = field(default_factory=list)
+    row_count: int = 0
+    bytes: int = 0
+    # Set when the SQL guard added a row limit and the result reached it.
+    row_limit: Optional[int] = None
+
+    @classmethod
+    def for_statement(cls, row_count: int) -> "ResultHandle":
+        """Handle for a statement that returns no rows (e.g. an UPDATE)."""
+        return cls(result_id=uuid.uuid4().hex, path=None, format=None, row_count=max(row_count, 0))
+
+    def to_dict(self) -> dict:
+        return {
+            "result_id": self.result_id,
+            "path": self.path,
+            "format": self.format,
+            "columns": self.columns,
+            "row_count": self.row_count,
+            "bytes": self.bytes,
+            "row_limit": self.row_limit,
+        }
+
+    def __str__(self):
+        # This is what agents see as the run_sql function result.
+        if self.path is None:
+            return f"Statement executed, {self.row_count} rows affected."
+        delivered = (f"Delivered {self.row_count} rows with columns [{', '.join(self.columns)}] "
+                     f"to {self.format} file {self.path} (result id {self.result_id}).")
+        if self.row_limit is not None:
+            delivered += f" Only the first {self.row_limit} rows were kept; filter or aggregate to see the rest."
+        return delivered
+
+
+def to_json_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+class JsonLinesSink:
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, rows):
+        self.file.writelines(
+            json.dumps(dict(zip(self.columns, row)), default=to_json_value) + "\n"
+            for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class CsvSink:
+    def __init__(self, path, columns):
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowSink:
+    """
+    Parquet or Arrow IPC file. The schema is inferred from the data; batches
+    with columns that are all NULL so far are held back until a later batch
+    shows those columns' types, and columns that never do are written as strings.
+    """
+
+    def __init__(self, path, columns, result_format):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError(f"Writing {result_format} results requires pyarrow")
+        self.pa = pyarrow
+        self.path = path
+        self.columns = columns
+        self.result_format = result_format
+        self.schema = None
+        self.writer = None
+        self.pending = []
+        self.pending_rows = 0
+
+    def write(self, rows):
+        arrays = {column: [row[i] for row in rows] for i, column in enumerate(self.columns)}
+        table = self.pa.Table.from_pydict(arrays)
+        if self.writer is not None:
+            # NULL-only batches and types unified with an earlier batch cast cleanly.
+            self.writer.write_table(table.cast(self.schema))
+            return
+        self.pending.append(table)
+        self.pending_rows += table.num_rows
+        schema = self.pa.unify_schemas([pending.schema for pending in self.pending])
+        if self.pending_rows < RESULTS_ARROW_NULL_BUFFER_ROWS and \
+                any(self.pa.types.is_null(schema_field.type) for schema_field in schema):
+            return
+        self.open(schema)
+
+    def open(self, schema):
+        self.schema = self.pa.schema([
+            schema_field.with_type(self.pa.string()) if self.pa.types.is_null(schema_field.type) else schema_field
+            for schema_field in schema
+        ])
+        if self.result_format == "parquet":
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+        else:
+            import pyarrow.ipc
+            self.writer = pyarrow.ipc.new_file(self.path, self.schema)
+        for table in self.pending:
+            self.writer.write_table(table.cast(self.schema))
+        self.pending = []
+
+    def close(self):
+        if self.writer is None:
+            # No rows: still produce a valid, empty file with the column names.
+            if not self.pending:
+                self.pending.append(self.pa.Table.from_pydict({column: [] for column in self.columns}))
+            self.open(self.pa.unify_schemas([pending.schema for pending in self.pending]))
+        self.writer.close()
+
+
+class ResultWriter:
+    def __init__(self, columns: list, result_format: str = RESULTS_FORMAT, directory: str = RESULTS_DIR):
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f"Unsupported result format {result_format}, expected one of {RESULT_FORMATS}")
+        os.makedirs(directory, exist_ok=True)
+        self.result_id = uuid.uuid4().hex
+        self.columns = list(columns)
+        self.format = result_format
+        self.path = os.path.join(directory, f"{self.result_id}.{result_format}")
+        self.row_count = 0
+        self.handle = None
+        if result_format == "jsonl":
+            self.sink = JsonLinesSink(self.path, self.columns)
+        elif result_format == "csv":
+            self.sink = CsvSink(self.path, self.columns)
+        else:
+            self.sink = ArrowSink(self.path, self.columns, result_format)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.discard()
+        else:
+            self.close()
+
+    def write_rows(self, rows):
+        if rows:
+            self.sink.write(rows)
+            self.row_count += len(rows)
+
+    def discard(self):
+        """Closes and deletes a partially written artifact."""
+        try:
+            self.sink.close()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def close(self) -> ResultHandle:
+        if self.handle is None:
+            self.sink.close()
+            self.handle = ResultHandle(
+                result_id=self.result_id,
+                path=self.path,
+                format=self.format,
+                columns=self.columns,
+                row_count=self.row_count,
+                bytes=os.path.getsize(self.path),
+            )
+        return self.handle
+
+
+def stream_cursor(cur, batch_size: int = RESULTS_BATCH_SIZE, result_format: str = RESULTS_FORMAT) -> ResultHandle:
+    """
+    Writes all rows of an executed DB-API cursor to a new result artifact
+    using fetchmany. The first batch is fetched before reading the column
+    names, since server-side cursors only describe themselves after a fetch.
+    """
+    rows = cur.fetchmany(batch_size)
+    columns = [column[0] for column in cur.description]
+    with ResultWriter(columns, result_format) as writer:
+        while rows:
+            writer.write_rows(rows)
+            rows = cur.fetchmany(batch_size)
+    return writer.handle
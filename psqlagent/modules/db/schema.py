@@ -0,0 +1,180 @@
+"""
+Purpose:
+    In-memory model of a database schema, built by the database managers
+    with a single bulk introspection query and consumed by the prompt and
+    embedding builders.
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+
+@dataclass
+class Column:
+    name: str
+    data_type: str
+    nullable: bool = True
+    comment: Optional[str] = None
+
+    def definition(self) -> str:
+        return f"name: {self.name}, data_type: {self.data_type}"
+
+
+@dataclass
+class ForeignKey:
+    name: str
+    columns: List[str]
+    ref_table: str
+    ref_columns: List[str]
+
+    def definition(self) -> str:
+        return f"({', '.join(self.columns)}) -> {self.ref_table}({', '.join(self.ref_columns)})"
+
+
+@dataclass
+class Index:
+    name: str
+    columns: List[str]
+    is_unique: bool = False
+    is_primary: bool = False
+
+
+@dataclass
+class Table:
+    name: str
+    columns: List[Column] = field(default_factory=list)
+    primary_key: List[str] = field(default_factory=list)
+    foreign_keys: List[ForeignKey] = field(default_factory=list)
+    indexes: List[Index] = field(default_factory=list)
+    comment: Optional[str] = None
+
+    @property
+    def definition(self) -> str:
+        """Column list in the `name: x, data_type: y` format used for embeddings."""
+        return "; ".join(column.definition() for column in self.columns)
+
+    @property
+    def search_text(self) -> str:
+        """Table and column names and comments, for lexical retrieval."""
+        # The name counts twice: it says more about the table than any one column.
+        parts = [self.name, self.name, self.comment]
+        for column in self.columns:
+            parts += [column.name, column.comment]
+        return " ".join(part for part in parts if part)
+
+    def column_definition(self, column: Column) -> str:
+        """One column with its table, in the embedding format; short enough to never be truncated."""
+        definition = f"table: {self.name}, {column.definition()}"
+        return f"{definition}, comment: {column.comment}" if column.comment else definition
+
+    def column_search_text(self, column: Column) -> str:
+        return " ".join(part for part in [self.name, column.name, column.name, column.comment] if part)
+
+    def prompt_definition(self, column_names: set = None) -> str:
+        """With column_names, only those columns and the foreign keys made of them are listed."""
+        columns = self.columns
+        foreign_keys = self.foreign_keys
+        if column_names is not None:
+            columns = [column for column in columns if column.name in column_names]
+            foreign_keys = [fk for fk in foreign_keys if set(fk.columns) <= column_names]
+        prompt = f"TABLE_NAME {self.name}: COLUMNS: [{'; '.join(column.definition() for column in columns)}]"
+        if self.primary_key:
+            prompt += f" PRIMARY_KEY: ({', '.join(self.primary_key)})"
+        if foreign_keys:
+            prompt += f" FOREIGN_KEYS: [{'; '.join(fk.definition() for fk in foreign_keys)}]"
+        return prompt
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Table":
+        return cls(
+            name=data["name"],
+            columns=[Column(**column) for column in data.get("columns") or []],
+            primary_key=list(data.get("primary_key") or []),
+            foreign_keys=[ForeignKey(**fk) for fk in data.get("foreign_keys") or []],
+            indexes=[Index(**index) for index in data.get("indexes") or []],
+            comment=data.get("comment"),
+        )
+
+
+@dataclass
+class Schema:
+    name: str
+    tables: Dict[str, Table] = field(default_factory=dict)
+    _fingerprint: Optional[str] = field(default=None, repr=False, compare=False)
+    _columns_by_key: Optional[dict] = field(default=None, repr=False, compare=False)
+    _foreign_key_graph: Optional[dict] = field(default=None, repr=False, compare=False)
+
+    def __contains__(self, table_name) -> bool:
+        return table_name in self.tables
+
+    def table_names(self) -> List[str]:
+        return list(self.tables.keys())
+
+    def definitions(self) -> Dict[str, str]:
+        return {name: table.definition for name, table in self.tables.items()}
+
+    def select(self, table_names: List[str] = None) -> List[Table]:
+        """The listed tables that exist, in order, or all tables if table_names is None."""
+        if table_names is None:
+            return list(self.tables.values())
+        return [self.tables[name] for name in table_names if name in self.tables]
+
+    def definition_map(self, table_name) -> Dict[str, str]:
+        """Definitions of table_name, or of all tables for '*'."""
+        if table_name == '*':
+            return self.definitions()
+        return {table.name: table.definition for table in self.select([table_name])}
+
+    def prompt_definitions(self, table_names: List[str], column_names: dict = None) -> str:
+        """column_names (table name -> set of column names) limits the columns listed per table."""
+        return "\n".join(
+            table.prompt_definition(column_names.get(table.name) if column_names is not None else None)
+            for table in self.select(table_names))
+
+    def search_texts(self) -> Dict[str, str]:
+        return {name: table.search_text for name, table in self.tables.items()}
+
+    def columns_by_key(self) -> Dict[str, Tuple[Table, Column]]:
+        """Every column under a "table.column" key, for column-level retrieval."""
+        if self._columns_by_key is None:
+            self._columns_by_key = {
+                f"{table.name}.{column.name}": (table, column)
+                for table in self.tables.values() for column in table.columns
+            }
+        return self._columns_by_key
+
+    def foreign_key_graph(self) -> Dict[str, Dict[str, List[Tuple[str, ForeignKey]]]]:
+        """
+        Tables joined by foreign keys, in both directions:
+        table -> {neighbour: [(name of the table owning the fk, fk)]}.
+        """
+        if self._foreign_key_graph is None:
+            graph = {name: {} for name in self.tables}
+            for table in self.tables.values():
+                for fk in table.foreign_keys:
+                    if fk.ref_table in graph and fk.ref_table != table.name:
+                        graph[table.name].setdefault(fk.ref_table, []).append((table.name, fk))
+                        graph[fk.ref_table].setdefault(table.name, []).append((table.name, fk))
+            self._foreign_key_graph = graph
+        return self._foreign_key_graph
+
+    def fingerprint(self) -> str:
+        """
+        Content hash of the schema, stable across processes and restarts
+        (unlike the managers' schema versions).
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256(self.name.encode("utf-8"))
+            for name in sorted(self.tables):
+                digest.update(b"\n" + self.tables[name].prompt_definition().encode("utf-8"))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    @classmethod
+    def from_dicts(cls, name: str, tables: List[dict]) -> "Schema":
+        schema = cls(name=name)
+        for data in tables:
+            table = Table.from_dict(data)
+            schema.tables[table.name] = table
+        return schema
@@ -1,20 +1,175 @@
+import itertools
+import json
+import uuid
 import pyodbc
-from psqlagent.modules.db.dbmanager import DatabaseManager
+from contextlib import contextmanager
+from psqlagent.modules.db.dbmanager import DatabaseManager, batched, UPSERT_BATCH_SIZE
+from psqlagent.modules.db.guard import showplan_estimate, timed_out, SQL_GUARD_MAX_SUBTREE_COST
+from psqlagent.modules.db.async_dbmanager import ThreadedDatabaseManager
+from psqlagent.modules.db.pool import get_pool, DATABASE_STATEMENT_TIMEOUT_MS
+from psqlagent.modules.db.results import ResultHandle, stream_cursor
+from psqlagent.modules.db.schema import Schema
+from psqlagent.modules.metrics import logger
+
+SCHEMA_FINGERPRINT_QUERY = """
+    SELECT COUNT(*), CHECKSUM_AGG(CHECKSUM(t.object_id, t.modify_date))
+    FROM sys.tables t
+    WHERE t.schema_id = SCHEMA_ID(?);
+"""
+
+# One row per table with columns, indexes and foreign keys aggregated as json,
+# so the whole schema is loaded in a single round trip. Table name filters and
+# ORDER BY are appended by introspect_schema.
+SCHEMA_INTROSPECTION_QUERY = """
+    SELECT
+        t.name,
+        CAST(tep.value AS nvarchar(4000)),
+        (
+            SELECT
+                c.name AS name,
+                TYPE_NAME(c.user_type_id) AS type_name,
+                c.max_length AS max_length,
+                c.precision AS precision,
+                c.scale AS scale,
+                c.is_nullable AS nullable,
+                CAST(cep.value AS nvarchar(4000)) AS comment
+            FROM sys.columns c
+            LEFT JOIN sys.extended_properties cep
+                ON cep.class = 1 AND cep.major_id = c.object_id
+                AND cep.minor_id = c.column_id AND cep.name = 'MS_Description'
+            WHERE c.object_id = t.object_id
+            ORDER BY c.column_id
+            FOR JSON PATH
+        ),
+        (
+            SELECT
+                i.name AS name,
+                i.is_unique AS is_unique,
+                i.is_primary_key AS is_primary,
+                (
+                    SELECT ic_col.name AS name
+                    FROM sys.index_columns ic
+                    JOIN sys.columns ic_col
+                        ON ic_col.object_id = ic.object_id AND ic_col.column_id = ic.column_id
+                    WHERE ic.object_id = i.object_id AND ic.index_id = i.index_id
+                        AND ic.is_included_column = 0
+                    ORDER BY ic.key_ordinal
+                    FOR JSON PATH
+                ) AS columns
+            FROM sys.indexes i
+            WHERE i.object_id = t.object_id AND i.type > 0
+            ORDER BY i.name
+            FOR JSON PATH
+        ),
+        (
+            SELECT
+                fk.name AS name,
+                OBJECT_NAME(fk.referenced_object_id) AS ref_table,
+                (
+                    SELECT pc.name AS [column], rc.name AS ref_column
+                    FROM sys.foreign_key_columns fkc
+                    JOIN sys.columns pc
+                        ON pc.object_id = fkc.parent_object_id AND pc.column_id = fkc.parent_column_id
+                    JOIN sys.columns rc
+                        ON rc.object_id = fkc.referenced_object_id AND rc.column_id = fkc.referenced_column_id
+                    WHERE fkc.constraint_object_id = fk.object_id
+                    ORDER BY fkc.constraint_column_id
+                    FOR JSON PATH
+                ) AS columns
+            FROM sys.foreign_keys fk
+            WHERE fk.parent_object_id = t.object_id
+            ORDER BY fk.name
+            FOR JSON PATH
+        )
+    FROM sys.tables t
+    LEFT JOIN sys.extended_properties tep
+        ON tep.class = 1 AND tep.major_id = t.object_id
+        AND tep.minor_id = 0 AND tep.name = 'MS_Description'
+    WHERE t.schema_id = SCHEMA_ID(?)
+"""
+
+# Last write seen by the index usage DMV plus row counts and the table's
+# modify_date (DDL), per table. Filters and ORDER BY are appended by
+# get_table_versions.
+TABLE_VERSIONS_QUERY = """
+    SELECT
+        t.name,
+        (
+            SELECT MAX(us.last_user_update)
+            FROM sys.dm_db_index_usage_stats us
+            WHERE us.database_id = DB_ID() AND us.object_id = t.object_id
+        ),
+        (
+            SELECT SUM(p.rows)
+            FROM sys.partitions p
+            WHERE p.object_id = t.object_id AND p.index_id IN (0, 1)
+        ),
+        t.modify_date
+    FROM sys.tables t
+    WHERE t.schema_id = SCHEMA_ID(?)
+"""
+
+
+def format_data_type(type_name, max_length=None, precision=None, scale=None):
+    if type_name in ("char", "varchar", "binary", "varbinary"):
+        return f"{type_name}({'max' if max_length == -1 else max_length})"
+    if type_name in ("nchar", "nvarchar"):
+        # sys.columns reports byte lengths; n-types use two bytes per character.
+        return f"{type_name}({'max' if max_length == -1 else max_length // 2})"
+    if type_name in ("decimal", "numeric"):
+        return f"{type_name}({precision},{scale})"
+    return type_name
+
+
+def is_connection_healthy(conn) -> bool:
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1")
+        cur.fetchall()
+    conn.rollback()
+    return True
+
+
+def reset_connection(conn):
+    conn.rollback()
+
 
 class SQLServerManager(DatabaseManager):
-    def __init__(self, schema_name='dbo'):
+    engine = "sqlserver"
+    max_plan_cost = SQL_GUARD_MAX_SUBTREE_COST
+
+    def __init__(self, schema_name='dbo', pooled=False,
+                 statement_timeout_ms=DATABASE_STATEMENT_TIMEOUT_MS):
         self.conn = None
+        self.url = None
+        self.pool = None
         self.schema_name = schema_name
+        self.pooled = pooled
+        self.statement_timeout_ms = statement_timeout_ms
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.conn is not None:
-            self.conn.close()
+            if self.pool is not None:
+                self.pool.checkin(self.conn)
+            else:
+                self.conn.close()
+            self.conn = None
 
     def connect_with_url(self, url):
-        self.conn = pyodbc.connect(url)
+        self.url = url
+        if self.pooled:
+            self.pool = get_pool(self.engine, url, lambda: pyodbc.connect(url),
+                                 is_connection_healthy, reset_connection)
+            self.conn = self.pool.checkout()
+        else:
+            self.conn = pyodbc.connect(url)
+        self.set_statement_timeout(self.statement_timeout_ms)
+
+    def set_statement_timeout(self, timeout_ms):
+        # pyodbc applies the query timeout client side, in whole seconds (0 = none).
+        self.conn.timeout = (int(timeout_ms) + 999) // 1000
 
     def upsert(self, table_name, _dict):
         keys = _dict.keys()
@@ -33,6 +188,49 @@ class SQLServerManager(DatabaseManager):
             cur.execute(query, list(values))
             self.conn.commit()
 
+    def upsert_many(self, table_name, rows, key_columns=("id",), batch_size=UPSERT_BATCH_SIZE) -> int:
+        # Each batch is sent to a #temp staging table with fast_executemany
+        # (one round trip per batch) and merged with a single MERGE that keeps
+        # the last row per key, since MERGE can't update a row twice.
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+        columns = list(first.keys())
+        column_list = ", ".join(columns)
+        staging = f"#psqlagent_upsert_{uuid.uuid4().hex[:12]}"
+        updates = [column for column in columns if column not in key_columns]
+        when_matched = (f"WHEN MATCHED THEN UPDATE SET {', '.join(f'target.{column} = source.{column}' for column in updates)} "
+                        if updates else "")
+        merge = (f"MERGE INTO {table_name} AS target "
+                 f"USING (SELECT {column_list} FROM (SELECT *, ROW_NUMBER() OVER ("
+                 f"PARTITION BY {', '.join(key_columns)} ORDER BY psqlagent_seq DESC) AS psqlagent_rank "
+                 f"FROM {staging}) AS ranked WHERE psqlagent_rank = 1) AS source "
+                 f"ON ({' AND '.join(f'target.{column} = source.{column}' for column in key_columns)}) "
+                 f"{when_matched}"
+                 f"WHEN NOT MATCHED THEN INSERT ({column_list}) "
+                 f"VALUES ({', '.join(f'source.{column}' for column in columns)});")
+        count = 0
+        try:
+            with self.conn.cursor() as cur:
+                cur.fast_executemany = True
+                # The UNION ALL keeps SELECT INTO from copying an IDENTITY column.
+                cur.execute(f"SELECT TOP 0 {column_list} INTO {staging} FROM {table_name} "
+                            f"UNION ALL SELECT TOP 0 {column_list} FROM {table_name}")
+                cur.execute(f"ALTER TABLE {staging} ADD psqlagent_seq BIGINT IDENTITY(1, 1)")
+                insert = f"INSERT INTO {staging} ({column_list}) VALUES ({', '.join(['?'] * len(columns))})"
+                for batch in batched(itertools.chain([first], rows), batch_size):
+                    cur.executemany(insert, [tuple(row[column] for column in columns) for row in batch])
+                    cur.execute(merge)
+                    cur.execute(f"TRUNCATE TABLE {staging}")
+                    count += len(batch)
+                cur.execute(f"DROP TABLE {staging}")
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return count
+
     def delete(self, table_name, _id):
         query = f"DELETE FROM {table_name} WHERE id = ?"
 
@@ -58,34 +256,23 @@ class SQLServerManager(DatabaseManager):
 
         return rows
 
-    def run_sql(self, sql):
+    def execute_sql(self, sql):
         try:
             with self.conn.cursor() as cur:
+                # pyodbc streams forward-only result sets, so fetchmany
+                # keeps memory bounded without an explicit server cursor.
                 cur.execute(sql)
-                return self.save_results(cur.fetchall())
+                if cur.description is None:
+                    return ResultHandle.for_statement(cur.rowcount)
+                return stream_cursor(cur)
         except Exception as e:
-            print("Error executing SQL:", e)
-
-    def save_results(self, result_data):
-        with open("results.txt", "w") as file:
-            file.write(str(result_data))
-        return "Successfully delivered results to json file."
-
-    def get_table_definitions(self, table_name):
-        select_query = """
-            SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH
-            FROM INFORMATION_SCHEMA.COLUMNS
-            WHERE TABLE_NAME = ?;
-        """
-        with self.conn.cursor() as cursor:
-            cursor.execute(select_query, (table_name,))
-            results = cursor.fetchall()
-            definition = [
-                f"name: {row[0]}, data_type: {row[1]}" +
-                (f"({row[2]})" if row[2] else "")
-                for row in results
-            ]
-            return "; ".join(definition)
+            # Roll back so a pooled connection isn't handed on inside an open,
+            # failed transaction.
+            self.conn.rollback()
+            # HYT00 is the ODBC query timeout.
+            if isinstance(e, pyodbc.OperationalError) and e.args and e.args[0] == "HYT00":
+                raise timed_out()
+            logger.error(f"Error executing SQL: {e}")
 
     def get_table_definitions_test(self, table_name):
         get_def_stmt = """
@@ -100,40 +287,106 @@ class SQLServerManager(DatabaseManager):
             create_table_stmt = create_table_stmt.rstrip(',\n') + "\n);"
             return create_table_stmt
 
-    def get_all_table_names(self):
-        query = f"SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = '{self.schema_name}'"
+    def explain(self, sql):
+        # SHOWPLAN has to be the only statement in its batch; while it is on,
+        # statements are compiled but not run.
         with self.conn.cursor() as cur:
-            cur.execute(query)
-            table_names = [row[0] for row in cur.fetchall()]
+            cur.execute("SET SHOWPLAN_XML ON")
+            try:
+                cur.execute(sql)
+                return cur.fetchone()[0]
+            finally:
+                cur.execute("SET SHOWPLAN_XML OFF")
 
-        return table_names
+    def get_plan_estimate(self, sql, plan=None):
+        return showplan_estimate(self.explain(sql) if plan is None else plan)
 
-    def get_table_definition_for_prompt(self, table_name):
-        table_definitions = []
-        if table_name == '*':
-            table_names = self.get_all_table_names()
-        else:
-            table_names = [table_name]
-        for name in table_names:
-            definition = self.get_table_definitions(name)
-            table_definitions.append(
-                f"TABLE_NAME {name}, COLUMNS: {{definition}}")
-        return "\n".join(table_definitions)
-
-    def get_table_definition_map_for_embedding(self, table_name) -> dict:
-        if table_name == '*':
-            table_names = self.get_all_table_names()
-        else:
-            table_names = [table_name]
-        definitions = {}
-        for name in table_names:
-            definitions[name] = self.get_table_definitions(name)
-        return definitions
-
-    def get_tables_definition_for_prompt(self, table_names: list):
-        table_definitions = []
-        for name in table_names:
-            definition = self.get_table_definitions(name)
-            table_definitions.append(
-                f"TABLE_NAME {name}: COLUMNS: [{definition}]")
-        return "\n".join(table_definitions)
+    @contextmanager
+    def statement_timeout(self, timeout_ms):
+        self.set_statement_timeout(min(timeout for timeout in (timeout_ms, self.statement_timeout_ms) if timeout))
+        try:
+            yield
+        finally:
+            self.set_statement_timeout(self.statement_timeout_ms)
+
+    def get_table_versions(self, table_names: list):
+        table_names = list(table_names)
+        query = TABLE_VERSIONS_QUERY + f" AND t.name IN ({','.join(['?'] * len(table_names))}) ORDER BY t.name;"
+        with self.conn.cursor() as cur:
+            cur.execute(query, [self.schema_name] + table_names)
+            return tuple(tuple(row) for row in cur.fetchall())
+
+    def introspect_schema(self, table_names: list = None) -> Schema:
+        query = SCHEMA_INTROSPECTION_QUERY
+        params = [self.schema_name]
+        if table_names is not None:
+            table_names = list(table_names)
+            if not table_names:
+                return Schema(name=self.schema_name)
+            query += f" AND t.name IN ({','.join(['?'] * len(table_names))})"
+            params += table_names
+        query += " ORDER BY t.name;"
+
+        with self.conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+
+        tables = []
+        for name, comment, columns, indexes, foreign_keys in rows:
+            columns = json.loads(columns) if columns else []
+            indexes = json.loads(indexes) if indexes else []
+            foreign_keys = json.loads(foreign_keys) if foreign_keys else []
+            indexes = [
+                {
+                    "name": index["name"],
+                    "columns": [column["name"] for column in index.get("columns", [])],
+                    "is_unique": index.get("is_unique", False),
+                    "is_primary": index.get("is_primary", False),
+                }
+                for index in indexes
+            ]
+            primary_key = next(
+                (index["columns"] for index in indexes if index["is_primary"]), [])
+            tables.append({
+                "name": name,
+                "comment": comment,
+                "columns": [
+                    {
+                        "name": column["name"],
+                        "data_type": format_data_type(
+                            column["type_name"], column.get("max_length"),
+                            column.get("precision"), column.get("scale")),
+                        "nullable": column.get("nullable", True),
+                        "comment": column.get("comment"),
+                    }
+                    for column in columns
+                ],
+                "primary_key": primary_key,
+                "foreign_keys": [
+                    {
+                        "name": fk["name"],
+                        "columns": [pair["column"] for pair in fk.get("columns", [])],
+                        "ref_table": fk["ref_table"],
+                        "ref_columns": [pair["ref_column"] for pair in fk.get("columns", [])],
+                    }
+                    for fk in foreign_keys
+                ],
+                "indexes": indexes,
+            })
+        return Schema.from_dicts(self.schema_name, tables)
+
+    def get_schema_version(self):
+        # sys.tables.modify_date moves on every ALTER TABLE, so the count plus
+        # a checksum of modify dates changes whenever a table is created,
+        # dropped or altered.
+        with self.conn.cursor() as cur:
+            cur.execute(SCHEMA_FINGERPRINT_QUERY, (self.schema_name,))
+            row = cur.fetchone()
+        return ("fingerprint", row[0], row[1])
+
+
+class AsyncSQLServerManager(ThreadedDatabaseManager):
+    """pyodbc has no async driver, so SQL Server calls run on a dedicated thread."""
+
+    def __init__(self, schema_name='dbo', pooled=False):
+        super().__init__(SQLServerManager(schema_name=schema_name, pooled=pooled))
@@ -0,0 +1,150 @@
+"""
+Purpose:
+    Embedding backends for DatabaseEmbedder, chosen with EMBEDDING_BACKEND:
+        bert      bert-base-uncased pooler output (the original setup)
+        sentence  a distilled sentence-embedding model, all-MiniLM-L6-v2
+                  (384 dims, about a fifth of BERT's size), mean pooled
+        onnx      a sentence model exported to ONNX and run with onnxruntime:
+                  optimum-cli export onnx --model <model> <EMBEDDING_ONNX_DIR>
+    EMBEDDING_QUANTIZE=int8 quantizes the linear layers to int8 (torch
+    dynamic quantization, or onnxruntime's for the onnx backend).
+    A backend's name identifies its embeddings, so the embedding store
+    re-embeds tables when the backend changes.
+"""
+
+import os
+from abc import ABC, abstractmethod
+import numpy as np
+
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'bert')
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME')
+EMBEDDING_QUANTIZE = os.getenv('EMBEDDING_QUANTIZE', '')
+EMBEDDING_ONNX_DIR = os.getenv('EMBEDDING_ONNX_DIR', '.onnx')
+EMBEDDING_MAX_LENGTH = int(os.getenv('EMBEDDING_MAX_LENGTH', '512'))
+
+DEFAULT_MODELS = {
+    "bert": "bert-base-uncased",
+    "sentence": "sentence-transformers/all-MiniLM-L6-v2",
+    "onnx": "sentence-transformers/all-MiniLM-L6-v2",
+}
+QUANTIZATIONS = ("", "int8")
+
+
+def mean_pool(hidden_states, attention_mask) -> np.ndarray:
+    """Average of the token embeddings, ignoring padding."""
+    mask = attention_mask[..., None].astype(np.float32)
+    return (hidden_states * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+
+class EmbeddingBackend(ABC):
+    """Embeds batches of texts into (len(texts), dim) float32 arrays."""
+    name = None
+    # The EMBEDDING_BACKEND value it implements.
+    kind = None
+    dim = None
+    tokenizer = None
+    max_length = EMBEDDING_MAX_LENGTH
+
+    def token_lengths(self, texts: list) -> list:
+        return [len(input_ids) for input_ids in
+                self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]]
+
+    @abstractmethod
+    def embed(self, texts: list) -> np.ndarray:
+        pass
+
+
+class TransformerBackend(EmbeddingBackend):
+    def __init__(self, model_name: str, pooling: str = "pooler", quantize: str = "",
+                 max_length: int = EMBEDDING_MAX_LENGTH):
+        """pooling is "pooler" (BERT's pooler output) or "mean" (sentence-embedding models)."""
+        # torch and transformers take seconds to import, so only embedders load them.
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        if quantize == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.pooling = pooling
+        self.kind = "bert" if pooling == "pooler" else "sentence"
+        self.max_length = max_length
+        self.dim = model.config.hidden_size
+        # The original BERT setup keeps its plain name, so existing stores stay valid.
+        suffix = "" if pooling == "pooler" else f":{pooling}"
+        self.name = f"{model_name}{suffix}{':' + quantize if quantize else ''}"
+
+    def embed(self, texts: list) -> np.ndarray:
+        import torch
+        with torch.inference_mode():
+            inputs = self.tokenizer(texts, return_tensors="pt",
+                                    truncation=True, padding=True, max_length=self.max_length)
+            outputs = self.model(**inputs)
+            if self.pooling == "pooler":
+                return outputs["pooler_output"].numpy().astype(np.float32)
+            return mean_pool(outputs["last_hidden_state"].numpy(), inputs["attention_mask"].numpy())
+
+
+class OnnxBackend(EmbeddingBackend):
+    def __init__(self, model_dir: str, model_name: str, quantize: str = "", num_threads: int = None,
+                 max_length: int = EMBEDDING_MAX_LENGTH):
+        """model_dir holds model.onnx and the tokenizer files, as written by optimum-cli."""
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx embedding backend needs onnxruntime (pip install onnxruntime)")
+        from transformers import AutoTokenizer
+        model_path = os.path.join(model_dir, "model.onnx")
+        if quantize == "int8":
+            model_path = quantized_onnx_model(model_path)
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = int(num_threads)
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+        self.dim = self.session.get_outputs()[0].shape[-1]
+        self.kind = "onnx"
+        self.name = f"{model_name}:mean:onnx{':' + quantize if quantize else ''}"
+
+    def embed(self, texts: list) -> np.ndarray:
+        inputs = self.tokenizer(texts, return_tensors="np",
+                                truncation=True, padding=True, max_length=self.max_length)
+        feed = {key: value.astype(np.int64) for key, value in inputs.items() if key in self.input_names}
+        hidden_states = self.session.run(None, feed)[0]
+        # Sentence-transformers exports may already return pooled embeddings.
+        if hidden_states.ndim == 2:
+            return hidden_states.astype(np.float32)
+        return mean_pool(hidden_states, inputs["attention_mask"])
+
+
+def quantized_onnx_model(model_path: str) -> str:
+    """Path of an int8 copy of model_path, quantized once and kept next to it."""
+    quantized_path = model_path[:-len(".onnx")] + "-int8.onnx"
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        # Written aside and renamed, so workers starting together never load half a file.
+        tmp_path = f"{quantized_path}.{os.getpid()}.tmp"
+        quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, quantized_path)
+    return quantized_path
+
+
+def create_embedding_backend(backend: str = None, model_name: str = None, quantize: str = None,
+                             num_threads: int = None) -> EmbeddingBackend:
+    """The backend configured by EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME and EMBEDDING_QUANTIZE."""
+    backend = backend or EMBEDDING_BACKEND
+    quantize = EMBEDDING_QUANTIZE if quantize is None else quantize
+    if backend not in DEFAULT_MODELS:
+        raise ValueError(f"Unknown embedding backend {backend}, expected one of {', '.join(DEFAULT_MODELS)}")
+    if quantize not in QUANTIZATIONS:
+        raise ValueError(f"Unknown embedding quantization {quantize}, expected int8 or nothing")
+    model_name = model_name or EMBEDDING_MODEL_NAME or DEFAULT_MODELS[backend]
+    if backend == "onnx":
+        return OnnxBackend(EMBEDDING_ONNX_DIR, model_name, quantize=quantize, num_threads=num_threads)
+    import torch
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    return TransformerBackend(model_name, pooling="pooler" if backend == "bert" else "mean", quantize=quantize)
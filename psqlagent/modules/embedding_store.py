@@ -0,0 +1,202 @@
+"""
+Purpose:
+    Persist table embeddings on disk so they survive restarts and are shared
+    by every worker process without copying.
+    Embeddings live in one contiguous matrix file opened through a memory map;
+    a json index maps each table name to its row and definition hash.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+EMBEDDING_STORE_DIR = os.getenv('EMBEDDING_STORE_DIR', '.embeddings')
+EMBEDDING_STORE_DTYPE = os.getenv('EMBEDDING_STORE_DTYPE', 'float32')
+
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+MIN_CAPACITY = 64
+
+
+def definition_hash(model_name: str, definition: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{definition}".encode("utf-8")).hexdigest()
+
+
+class FileLock:
+    """Exclusive inter-process lock on a file, used to serialise store writers."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+
+
+class EmbeddingStore:
+    def __init__(self, directory: str, model_name: str, dim: int, dtype: str = EMBEDDING_STORE_DTYPE):
+        self.directory = directory
+        self.model_name = model_name
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.index = self._empty_index()
+        self.matrix = None
+        self._index_signature = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.reload()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    @property
+    def matrix_path(self):
+        # The layout is part of the file name, so a change of dim or dtype
+        # starts a new file instead of shrinking one other processes have mapped.
+        return os.path.join(self.directory, f"embeddings-{self.dim}-{self.dtype.name}.bin")
+
+    def _empty_index(self):
+        return {"dim": self.dim, "dtype": self.dtype.name, "capacity": 0, "rows": {}}
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            return self._empty_index()
+        if index.get("dim") != self.dim or index.get("dtype") != self.dtype.name:
+            return self._empty_index()
+        return index
+
+    def _write_index(self, index):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(index, file)
+        os.replace(tmp_path, self.index_path)
+
+    def _open_matrix(self, capacity, mode="r"):
+        if capacity == 0:
+            return None
+        return np.memmap(self.matrix_path, dtype=self.dtype, mode=mode, shape=(capacity, self.dim))
+
+    def reload(self):
+        """Re-reads the index and remaps the matrix if another process changed them."""
+        try:
+            stat = os.stat(self.index_path)
+            # The index is replaced atomically, so a new inode means a new index.
+            signature = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        if signature is not None and signature == self._index_signature:
+            return
+        self.index = self._read_index()
+        self._index_signature = signature
+        self.matrix = self._open_matrix(self.index["capacity"])
+
+    @property
+    def version(self):
+        """Changes whenever any process writes a new index."""
+        return self._index_signature
+
+    def __contains__(self, table_name) -> bool:
+        return table_name in self.index["rows"]
+
+    def __len__(self) -> int:
+        return len(self.index["rows"])
+
+    def get(self, table_name: str):
+        """Returns the embedding of table_name as a read-only view into the memory map."""
+        return self.matrix[self.index["rows"][table_name]["row"]]
+
+    def stale_tables(self, definitions: dict) -> list:
+        rows = self.index["rows"]
+        return [
+            name for name, definition in definitions.items()
+            if rows.get(name, {}).get("hash") != definition_hash(self.model_name, definition)
+        ]
+
+    def sync(self, definitions: dict, embed) -> list:
+        """
+        Makes the store hold embeddings for exactly the tables in definitions.
+        embed(texts) must return an array of shape (len(texts), dim) and is only
+        called for tables that are new or whose definition hash changed.
+        Returns the names of the (re-)embedded tables.
+        """
+        with self._lock:
+            self.reload()
+            if not self.stale_tables(definitions) and set(self.index["rows"]) <= set(definitions):
+                return []
+
+            with FileLock(os.path.join(self.directory, LOCK_FILE)):
+                # Another process may have written while we waited for the lock.
+                self._index_signature = None
+                self.reload()
+                rows = self.index["rows"]
+                stale = self.stale_tables(definitions)
+                removed = [name for name in rows if name not in definitions]
+                if not stale and not removed:
+                    return []
+
+                capacity = self.index["capacity"]
+                # Changed tables are written to unused rows and only become
+                # visible when the index is swapped, so readers holding the
+                # previous index never see a half-written row.
+                occupied = {entry["row"] for entry in rows.values()}
+                free_rows = [row for row in range(capacity) if row not in occupied]
+                if len(free_rows) < len(stale):
+                    new_capacity = max(MIN_CAPACITY, capacity * 2, len(occupied) + len(stale))
+                    free_rows += list(range(capacity, new_capacity))
+                    capacity = new_capacity
+                    with open(self.matrix_path, "ab") as file:
+                        # Only ever grow the file; other processes may have it mapped.
+                        if file.tell() < capacity * self.dim * self.dtype.itemsize:
+                            file.truncate(capacity * self.dim * self.dtype.itemsize)
+
+                new_rows = {
+                    name: entry for name, entry in rows.items()
+                    if name in definitions and name not in stale
+                }
+                if stale:
+                    embeddings = np.asarray(embed([definitions[name] for name in stale]))
+                    matrix = self._open_matrix(capacity, mode="r+")
+                    for name, embedding, row in zip(stale, embeddings, free_rows):
+                        matrix[row] = embedding
+                        new_rows[name] = {
+                            "row": row,
+                            "hash": definition_hash(self.model_name, definitions[name]),
+                        }
+                    matrix.flush()
+                    del matrix
+
+                self._write_index({
+                    "dim": self.dim,
+                    "dtype": self.dtype.name,
+                    "capacity": capacity,
+                    "rows": new_rows,
+                })
+                self._index_signature = None
+                self.reload()
+                return stale
@@ -1,49 +1,196 @@
-from transformers import BertTokenizer, BertModel
-from sklearn.metrics.pairwise import cosine_similarity
-import re
+import numpy as np
+import os
+import threading
+from psqlagent.modules.embedding_backends import EmbeddingBackend, create_embedding_backend
+from psqlagent.modules.embedding_store import EmbeddingStore, EMBEDDING_STORE_DIR
+from psqlagent.modules.lexical import LexicalIndex, reciprocal_rank_fusion, RETRIEVAL_CANDIDATES
+from psqlagent.modules.retrieval import EmbeddingIndex
+from psqlagent.modules.metrics import span
+
+EMBEDDING_NUM_THREADS = os.getenv('EMBEDDING_NUM_THREADS')
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
 
 class DatabaseEmbedder:
-    def __init__(self):
-        self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-        self.model = BertModel.from_pretrained('bert-base-uncased')
+    def __init__(self, model_name: str = None, num_threads: int = None,
+                 store_dir: str = EMBEDDING_STORE_DIR, backend: EmbeddingBackend = None):
+        """Without a backend, the one configured by EMBEDDING_BACKEND is loaded (see embedding_backends)."""
+        self.backend = backend or create_embedding_backend(model_name=model_name, num_threads=num_threads)
+        self.model_name = self.backend.name
+        self.dim = self.backend.dim
+        self.store_dir = store_dir
+        self.store = None
         self.map_name_to_embeddings = {}
         self.map_name_to_table_def = {}
+        self.index = None
+        self._index_version = None
+        self.map_name_to_search_text = {}
+        self.lexical_index = None
+        self._lock = threading.Lock()
 
 
     def add_table(self, table_name: str, text_representation: str):
+        # The embedder is long-lived, so unchanged tables keep their embeddings.
+        if self.map_name_to_table_def.get(table_name) == text_representation:
+            return
         self.map_name_to_embeddings[table_name] = self.compute_embeddings(
             text_representation
         )
         self.map_name_to_table_def[table_name] = text_representation
+        self.index = None
+        self.lexical_index = None
+
+
+    def add_tables(self, map_table_name_to_table_def: dict, batch_size: int = EMBEDDING_BATCH_SIZE,
+                   progress=None):
+        """Embeds new or changed tables in batches; see embed_texts."""
+        changed = [
+            table_name for table_name, table_def in map_table_name_to_table_def.items()
+            if self.map_name_to_table_def.get(table_name) != table_def
+        ]
+        if not changed:
+            return
+        embeddings = self.embed_texts(
+            [map_table_name_to_table_def[table_name] for table_name in changed],
+            batch_size=batch_size, progress=progress)
+        for table_name, embedding in zip(changed, embeddings):
+            self.map_name_to_embeddings[table_name] = embedding.reshape(1, -1)
+            self.map_name_to_table_def[table_name] = map_table_name_to_table_def[table_name]
+        self.index = None
+        self.lexical_index = None
+
+
+    def open_store(self, store_name: str) -> EmbeddingStore:
+        directory = os.path.join(self.store_dir, store_name)
+        if self.store is None or self.store.directory != directory:
+            self.store = EmbeddingStore(directory, self.model_name, self.dim)
+        return self.store
+
+
+    def sync_tables(self, map_table_name_to_table_def: dict, store_name: str = None,
+                    batch_size: int = EMBEDDING_BATCH_SIZE, progress=None, search_texts: dict = None):
+        """
+        Makes the indexed tables match map_table_name_to_table_def,
+        embedding only new or changed tables and dropping removed ones.
+        With a store_name the embeddings are kept in the on-disk store, so
+        they survive restarts and are shared with other worker processes.
+        search_texts (Schema.search_texts) is what the lexical index matches;
+        without it, the table name and definition are used.
+        """
+        with self._lock:
+            if search_texts is None:
+                search_texts = {name: f"{name} {table_def}" for name, table_def in map_table_name_to_table_def.items()}
+            if search_texts != self.map_name_to_search_text:
+                self.map_name_to_search_text = dict(search_texts)
+                self.lexical_index = None
+            if store_name is not None and self.store_dir:
+                store = self.open_store(store_name)
+                store.sync(
+                    map_table_name_to_table_def,
+                    lambda texts: self.embed_texts(texts, batch_size=batch_size, progress=progress))
+                version = (store.directory, store.version)
+                if version != self._index_version or map_table_name_to_table_def.keys() != self.map_name_to_table_def.keys():
+                    # Searches run in place on the memory-mapped matrix.
+                    self.index = EmbeddingIndex.from_store(store, map_table_name_to_table_def)
+                    self._index_version = version
+                self.map_name_to_table_def = dict(map_table_name_to_table_def)
+                return
+            for table_name in list(self.map_name_to_table_def):
+                if table_name not in map_table_name_to_table_def:
+                    del self.map_name_to_table_def[table_name]
+                    del self.map_name_to_embeddings[table_name]
+                    self.index = None
+            self.add_tables(map_table_name_to_table_def, batch_size=batch_size, progress=progress)
 
 
     def compute_embeddings(self, text: str):
-        inputs = self.tokenizer(text, return_tensors="pt",
-                                truncation=True, padding=True, max_length=512)
-        outputs = self.model(**inputs)
-        return outputs["pooler_output"].detach().numpy()
+        with span("embedding", model=self.model_name):
+            return self.backend.embed([text])
+
+
+    def embed_texts(self, texts: list, batch_size: int = EMBEDDING_BATCH_SIZE, progress=None):
+        """
+        Embeds texts in batches of batch_size. Texts are bucketed by token
+        length so each batch pads to a similar length and little compute is
+        spent on padding. progress(done, total) is called after every batch.
+        Returns a (len(texts), dim) array in the order of texts.
+        """
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return embeddings
+        lengths = self.backend.token_lengths(texts)
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+        done = 0
+        with span("embedding", model=self.model_name) as embedding_span:
+            embedding_span.set(texts=len(texts))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                embeddings[batch] = self.backend.embed([texts[i] for i in batch])
+                done += len(batch)
+                if progress is not None:
+                    progress(done, len(texts))
+        return embeddings
 
 
+    def warm_up(self):
+        """Runs one forward pass so lazy initialisation isn't paid by the first request."""
+        self.compute_embeddings("warm up")
+
+
+    def get_index(self) -> EmbeddingIndex:
+        if self.index is None:
+            self.index = EmbeddingIndex.from_embeddings(self.map_name_to_embeddings)
+            self._index_version = None
+        return self.index
+
+
+    def get_lexical_index(self) -> LexicalIndex:
+        if self.lexical_index is None:
+            # Tables added without a search text are found by name and definition.
+            documents = {name: self.map_name_to_search_text.get(name) or f"{name} {table_def}"
+                         for name, table_def in self.map_name_to_table_def.items()}
+            self.lexical_index = LexicalIndex(documents)
+        return self.lexical_index
+
     def get_similar_tables_via_embeddings(self, query: str, n=3) -> list:
         query_embeddings = self.compute_embeddings(query)
-        similarities = {}
-        for table_name, table_embeddings in self.map_name_to_embeddings.items():
-            similarities =  {   
-                table: cosine_similarity(query_embeddings, table_embeddings)[0][0] 
-                for table, table_embeddings in self.map_name_to_embeddings.items()
-            }
-        return sorted(similarities, key = similarities.get, reverse=True)[:n]
+        with span("similarity_search") as search_span:
+            index = self.get_index()
+            search_span.set(tables=len(index))
+            return [table_name for table_name, _ in index.search(query_embeddings, n)]
+
+    def get_similar_tables_via_lexical(self, query: str, n=3) -> list:
+        with span("lexical_search") as search_span:
+            index = self.get_lexical_index()
+            search_span.set(tables=len(index))
+            return [table_name for table_name, _ in index.search(query, n)]
 
     def get_similar_table_names_via_wordmatch(self, query: str) -> list:
-        query_words = re.sub(r'[,";\']', '', query.lower()).split(" ")
-        similarities = []
-        for table_name in self.map_name_to_table_def.keys():
-            if table_name.lower() in query_words:
-                similarities.append(table_name)
-        return similarities
-
-    def get_similar_tables(self, query: str, n=3)-> set:
-        similar_tables_via_embeddings = self.get_similar_tables_via_embeddings(query, n)
-        similar_tables_via_wordmatch = self.get_similar_table_names_via_wordmatch(query)
-        return list(set(similar_tables_via_wordmatch + similar_tables_via_embeddings))
+        return self.get_lexical_index().exact_names(query)
+
+    def get_similar_tables(self, query: str, n=3) -> list:
+        """
+        Tables named in the query, then the n best of the embedding and
+        BM25 rankings fused by reciprocal rank.
+        """
+        candidates = max(n, RETRIEVAL_CANDIDATES)
+        with self._lock:
+            similar_tables_via_embeddings = self.get_similar_tables_via_embeddings(query, candidates)
+            similar_tables_via_lexical = self.get_similar_tables_via_lexical(query, candidates)
+            similar_tables_via_wordmatch = self.get_similar_table_names_via_wordmatch(query)
+        fused = reciprocal_rank_fusion([similar_tables_via_embeddings, similar_tables_via_lexical])
+        return list(dict.fromkeys(similar_tables_via_wordmatch + fused[:n]))
+
+
+_database_embedder = None
+_database_embedder_lock = threading.Lock()
 
+def get_database_embedder() -> DatabaseEmbedder:
+    """
+    Returns the process-wide embedder, loading the model on first use.
+    Shared by the API (created in its lifespan) and the CLI.
+    """
+    global _database_embedder
+    with _database_embedder_lock:
+        if _database_embedder is None:
+            _database_embedder = DatabaseEmbedder(num_threads=EMBEDDING_NUM_THREADS)
+        return _database_embedder
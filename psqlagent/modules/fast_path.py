@@ -0,0 +1,171 @@
+"""
+Purpose:
+    Answer a question with a single LLM call: generate SQL, validate it
+    locally and with EXPLAIN, and run it. Callers escalate to the full agent
+    conversation only when this fails.
+"""
+
+import asyncio
+import json
+import re
+import threading
+from psqlagent.agents.prompts import FAST_PATH_SQL_PROMPT
+from psqlagent.modules import llm
+from psqlagent.modules.db.guard import QueryRejected
+from psqlagent.modules.db.result_cache import is_query
+from psqlagent.modules.metrics import logger
+
+QUERY_MODES = ("agents", "fast")
+
+# Escalation reasons, also used as counter names.
+NO_SQL = "no_sql"
+NOT_READ_ONLY = "not_read_only"
+EXPLAIN_FAILED = "explain_failed"
+REJECTED_BY_GUARD = "rejected_by_guard"
+EXECUTION_FAILED = "execution_failed"
+
+
+def extract_sql(text: str) -> str:
+    """Takes the SQL out of a reply that may wrap it in a markdown code block."""
+    if not text:
+        return ""
+    match = re.search(r"```(?:sql)?\s*(.*?)```", text, re.DOTALL | re.IGNORECASE)
+    sql = match.group(1) if match else text
+    return sql.strip().rstrip(";").strip()
+
+
+def check_sql(sql: str):
+    """Local validation; returns an escalation reason or None."""
+    if not sql:
+        return NO_SQL
+    # Only queries: the fast path plans them with EXPLAIN before running them.
+    if not is_query(sql):
+        return NOT_READ_ONLY
+    return None
+
+
+class FastPathResult:
+    def __init__(self, prompt: str, reply: str):
+        self.prompt = prompt
+        self.reply = reply
+        self.sql = extract_sql(reply)
+        self.result = None
+        self.escalation_reason = None
+        self.error = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.escalation_reason is None
+
+    def escalate(self, reason: str, error=None):
+        self.escalation_reason = reason
+        self.error = str(error) if error is not None else None
+        logger.info(f"Fast path escalating ({reason}): {self.error or self.sql}")
+        return self
+
+    @property
+    def usage(self) -> llm.TokenUsage:
+        usage = llm.TokenUsage()
+        usage.add("FastPath", llm.DEFAULT_MODEL,
+                  llm.count_tokens(self.prompt), llm.count_tokens(self.reply or ""))
+        return usage
+
+    def get_cost_and_tokens(self):
+        usage = self.usage
+        return round(usage.cost, 4), usage.total_tokens
+
+    def messages(self) -> list:
+        # Same shape as the data team's messages: the SQL call, its result and a closing note.
+        # Nobody reviewed this SQL, so unlike the data team it is not APPROVED.
+        return [
+            {"content": None, "function_call": {"name": "run_sql", "arguments": json.dumps({"sql": self.sql})}},
+            {"role": "function", "name": "run_sql", "content": str(self.result)},
+            "Answered by the fast path (single LLM call, SQL not reviewed)",
+        ]
+
+
+def generate_sql(prompt: str) -> FastPathResult:
+    fast_path_prompt = f"{prompt}\n\n{FAST_PATH_SQL_PROMPT}"
+    return FastPathResult(fast_path_prompt, llm.prompt(fast_path_prompt, model=llm.DEFAULT_MODEL, temperature=0))
+
+
+def run_fast_path(prompt: str, db) -> FastPathResult:
+    """Generates, validates and runs SQL with a blocking DatabaseManager."""
+    fast_path = generate_sql(prompt)
+    reason = check_sql(fast_path.sql)
+    if reason is not None:
+        return fast_path.escalate(reason)
+    try:
+        # Planned as run_sql will run it, so a cache miss reuses this plan.
+        plan = db.explain(db.limit_rows(fast_path.sql))
+    except Exception as e:
+        return fast_path.escalate(EXPLAIN_FAILED, e)
+    try:
+        fast_path.result = db.run_sql(fast_path.sql, plan=plan)
+    except QueryRejected as e:
+        return fast_path.escalate(REJECTED_BY_GUARD, e)
+    if fast_path.result is None:
+        return fast_path.escalate(EXECUTION_FAILED)
+    return fast_path
+
+
+async def run_fast_path_async(prompt: str, db) -> FastPathResult:
+    """Same as run_fast_path for an AsyncDatabaseManager; the LLM call runs in a thread."""
+    fast_path = await asyncio.to_thread(generate_sql, prompt)
+    reason = check_sql(fast_path.sql)
+    if reason is not None:
+        return fast_path.escalate(reason)
+    try:
+        # Planned as run_sql will run it, so a cache miss reuses this plan.
+        plan = await db.explain(db.limit_rows(fast_path.sql))
+    except Exception as e:
+        return fast_path.escalate(EXPLAIN_FAILED, e)
+    try:
+        fast_path.result = await db.run_sql(fast_path.sql, plan=plan)
+    except QueryRejected as e:
+        return fast_path.escalate(REJECTED_BY_GUARD, e)
+    if fast_path.result is None:
+        return fast_path.escalate(EXECUTION_FAILED)
+    return fast_path
+
+
+class QueryPathStats:
+    """Latency and cost counters per query path (fast, escalated, agents, ...)."""
+
+    def __init__(self):
+        self._paths = {}
+        self._escalations = {}
+        self._lock = threading.Lock()
+
+    def record(self, path: str, seconds: float, cost: float = 0.0, tokens: int = 0, success: bool = True):
+        with self._lock:
+            stats = self._paths.setdefault(path, {
+                "requests": 0, "successes": 0, "seconds_total": 0.0, "seconds_max": 0.0,
+                "cost_total": 0.0, "tokens_total": 0,
+            })
+            stats["requests"] += 1
+            stats["successes"] += int(bool(success))
+            stats["seconds_total"] += seconds
+            stats["seconds_max"] = max(stats["seconds_max"], seconds)
+            stats["cost_total"] += cost
+            stats["tokens_total"] += tokens
+
+    def record_escalation(self, reason: str):
+        with self._lock:
+            self._escalations[reason] = self._escalations.get(reason, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            paths = {
+                path: {
+                    **stats,
+                    "seconds_avg": stats["seconds_total"] / stats["requests"],
+                    "cost_avg": stats["cost_total"] / stats["requests"],
+                }
+                for path, stats in self._paths.items()
+            }
+            return {"paths": paths, "escalations": dict(self._escalations)}
+
+
+query_path_stats = QueryPathStats()
+
@@ -0,0 +1,94 @@
+"""
+Purpose:
+    BM25 lexical retrieval over tables. Table names, column names and
+    comments are split into words (snake_case, camelCase), stemmed and kept
+    in an inverted index, so a query only touches the postings of its own
+    words instead of scanning every table. Rankings are combined with the
+    embedding search by reciprocal rank fusion.
+"""
+
+import os
+import re
+import numpy as np
+from psqlagent.modules.retrieval import top_k
+
+LEXICAL_BM25_K1 = float(os.getenv('LEXICAL_BM25_K1', '1.2'))
+LEXICAL_BM25_B = float(os.getenv('LEXICAL_BM25_B', '0.75'))
+# How many results of each retriever are fused, and the fusion constant.
+RETRIEVAL_CANDIDATES = int(os.getenv('RETRIEVAL_CANDIDATES', '20'))
+RETRIEVAL_RRF_K = int(os.getenv('RETRIEVAL_RRF_K', '60'))
+
+WORD_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def stem(word: str) -> str:
+    """Light suffix stripping, enough to match plurals and verb forms of identifiers."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("sses"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    if len(word) > 5 and word.endswith("ing"):
+        return word[:-3]
+    if len(word) > 4 and word.endswith("ed"):
+        return word[:-2]
+    return word
+
+
+def tokenize(text: str) -> list:
+    """Lowercase stems of the words of snake_case, camelCase or free text."""
+    return [stem(word.lower()) for word in WORD_PATTERN.findall(text or "")]
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RETRIEVAL_RRF_K) -> list:
+    """Merges best-first lists of names; names ranked high by several lists come first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, name in enumerate(ranking):
+            scores[name] = scores.get(name, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda name: -scores[name])
+
+
+class LexicalIndex:
+    def __init__(self, documents: dict, k1: float = LEXICAL_BM25_K1, b: float = LEXICAL_BM25_B):
+        """documents maps each table name to the text it is found by."""
+        self.names = list(documents)
+        self.names_by_lower = {name.lower(): name for name in self.names}
+        term_frequencies = {}
+        lengths = np.zeros(len(self.names), dtype=np.float32)
+        for doc_id, name in enumerate(self.names):
+            terms = tokenize(documents[name])
+            lengths[doc_id] = len(terms)
+            for term in terms:
+                postings = term_frequencies.setdefault(term, {})
+                postings[doc_id] = postings.get(doc_id, 0) + 1
+
+        # BM25 weights are precomputed per posting, so a search only sums them.
+        average_length = float(lengths.mean()) if len(self.names) else 0.0
+        norms = k1 * (1 - b + b * lengths / average_length) if average_length else np.full_like(lengths, k1)
+        self.postings = {}
+        for term, postings in term_frequencies.items():
+            doc_ids = np.fromiter(postings.keys(), dtype=np.int32, count=len(postings))
+            frequencies = np.fromiter(postings.values(), dtype=np.float32, count=len(postings))
+            idf = np.log(1 + (len(self.names) - len(postings) + 0.5) / (len(postings) + 0.5))
+            weights = idf * frequencies * (k1 + 1) / (frequencies + norms[doc_ids])
+            self.postings[term] = (doc_ids, weights.astype(np.float32))
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, query: str, k: int) -> list:
+        """The k best (name, score) pairs for query, best first; tables sharing no word are left out."""
+        postings = [self.postings[term] for term in set(tokenize(query)) if term in self.postings]
+        if not postings:
+            return []
+        scores = np.zeros(len(self.names), dtype=np.float32)
+        for doc_ids, weights in postings:
+            scores[doc_ids] += weights
+        return [(self.names[idx], float(scores[idx])) for idx in top_k(scores, k) if scores[idx] > 0]
+
+    def exact_names(self, query: str) -> list:
+        """Tables whose whole name appears as a word of query."""
+        words = re.sub(r'[,";\']', '', query.lower()).split()
+        return [self.names_by_lower[word] for word in dict.fromkeys(words) if word in self.names_by_lower]
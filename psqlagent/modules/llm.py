@@ -4,18 +4,17 @@ Purpose:
     Provide supporting prompt engineering functions.
 """
 
+import functools
 import sys
+import threading
 from dotenv import load_dotenv
 import os
 from typing import Any, Dict, Tuple
-import openai
-import tiktoken
+from psqlagent.modules.completion_cache import completion_key, get_completion_cache, COMPLETION_CACHE_ENABLED
+from psqlagent.modules.metrics import span, record_llm_call
 
 # load .env file
 load_dotenv()
-assert os.environ.get("OPENAI_APIKEY")
-# get openai api key
-openai.api_key = os.environ.get("OPENAI_APIKEY")
 
 # ------------------ helpers ------------------
 
@@ -41,9 +40,27 @@ def response_parser(response: Dict[str, Any]):
     return safe_get(response, "choices.0.message.content")
 
 
+def get_openai():
+    """
+    Imports openai on first use, which keeps it out of startup, and sets
+    the API key from OPENAI_APIKEY.
+    """
+    import openai
+    if not openai.api_key:
+        openai.api_key = os.environ.get("OPENAI_APIKEY")
+    return openai
+
+
 # ------------------ content generators ------------------
-def prompt(prompt: str, model: str = "gpt-4") -> str:
+def prompt(prompt: str, model: str = "gpt-4", use_cache: bool = COMPLETION_CACHE_ENABLED,
+           temperature: float = None) -> str:
+    """
+    Returns the completion of prompt. Only deterministic completions are
+    cached: with use_cache the temperature defaults to 0, and any other
+    temperature skips the cache.
+    """
     # validate the openai api key - if it's not valid, raise an error
+    openai = get_openai()
     if not openai.api_key:
         sys.exit(
             """
@@ -52,16 +69,36 @@ def prompt(prompt: str, model: str = "gpt-4") -> str:
                 export OPENAI_API_KEY=<your openai apikey>
             """
         )
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=[
-            {
-                "role": "user",
-                "content": prompt,
-            }
-        ],
-    )
-    return response_parser(response)
+    messages = [
+        {
+            "role": "user",
+            "content": prompt,
+        }
+    ]
+    if use_cache and temperature is None:
+        temperature = 0
+    use_cache = use_cache and temperature == 0
+    params = {} if temperature is None else {"temperature": temperature}
+    with span("llm_call", agent="prompt", model=model) as llm_span:
+        content = None
+        if use_cache:
+            key = completion_key(model, messages, params=params)
+            content = get_completion_cache().get(key, agent="prompt")
+        cached = content is not None
+        if not cached:
+            response = openai.ChatCompletion.create(
+                model=model,
+                messages=messages,
+                **params,
+            )
+            content = response_parser(response)
+            if use_cache and content is not None:
+                get_completion_cache().put(key, content, model=model)
+        input_tokens, output_tokens = count_tokens(prompt, model), count_tokens(content or "", model)
+        llm_span.labels["cache"] = "hit" if cached else "miss"
+        llm_span.set(input_tokens=input_tokens, output_tokens=output_tokens)
+        record_llm_call("prompt", model, input_tokens, output_tokens, cached)
+    return content
 
 
 def add_cap_ref(
@@ -79,13 +116,137 @@ def add_cap_ref(
     new_prompt = f"""User request: ```{prompt.strip().capitalize()}```. {prompt_suffix}\n\n{cap_ref}\n\n{cap_ref_content}"""
     return new_prompt
 
-def count_tokens(text: str)-> int:
-    enc = tiktoken.get_encoding("cl100k_base")
-    return len(enc.encode(text))
+# USD per 1K (input, output) tokens.
+MODEL_PRICING = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4-1106-preview": (0.01, 0.03),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+}
+DEFAULT_MODEL = "gpt-4"
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str = DEFAULT_MODEL) -> "tiktoken.Encoding":
+    """Loads the tokenizer of model once per process."""
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    return len(get_encoding(model).encode(text))
+
+
+def message_text(message) -> str:
+    """The text of a conversation message: its content, or its function call."""
+    if message is None:
+        return ""
+    if isinstance(message, dict):
+        content = message.get("content", None) or message.get("function_call", None)
+        return str(content) if content else ""
+    return str(message)
+
+
+def count_message_tokens(message, model: str = DEFAULT_MODEL) -> int:
+    text = message_text(message)
+    return count_tokens(text, model) if text else 0
+
+
+class HistoryTokenCounter:
+    """
+    Running token totals of chat histories. Histories only grow, so each
+    count tokenizes just the messages added since the previous one; a
+    history that no longer starts with the counted messages is recounted.
+    """
+
+    def __init__(self):
+        # key -> (messages counted, last message counted, tokens)
+        self._totals = {}
+
+    def count(self, key, messages: list, model: str = DEFAULT_MODEL) -> int:
+        counted, last, total = self._totals.get(key, (0, None, 0))
+        if counted > len(messages) or (counted and messages[counted - 1] != last):
+            counted, total = 0, 0
+        total += sum(count_message_tokens(message, model) for message in messages[counted:])
+        self._totals[key] = (len(messages), messages[-1] if messages else None, total)
+        return total
+
+
+def estimate_price(model: str, input_tokens: int, output_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICING.get(model, MODEL_PRICING[DEFAULT_MODEL])
+    return (input_tokens / 1000) * input_price + (output_tokens / 1000) * output_price
+
 
 def estimate_price_and_tokens(text: str) -> Tuple[float, int]:
     COST_PER_1K_TOKENS = 0.06
     tokens = count_tokens(text)
     price = (tokens / 1000) * COST_PER_1K_TOKENS
     rounded_price = round(price, 2)
-    return rounded_price, tokens
\ No newline at end of file
+    return rounded_price, tokens
+
+
+class TokenUsage:
+    """
+    Input/output tokens and estimated cost of LLM calls, per agent and per
+    model. Broadcast branches add to it from their worker threads.
+    """
+
+    def __init__(self):
+        # (agent, model) -> [calls, input_tokens, output_tokens]
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def add(self, agent: str, model: str, input_tokens: int, output_tokens: int):
+        with self._lock:
+            usage = self._usage.setdefault((agent, model), [0, 0, 0])
+            usage[0] += 1
+            usage[1] += input_tokens
+            usage[2] += output_tokens
+
+    def merge(self, other: "TokenUsage") -> "TokenUsage":
+        for (agent, model), (calls, input_tokens, output_tokens) in other._usage.items():
+            usage = self._usage.setdefault((agent, model), [0, 0, 0])
+            usage[0] += calls
+            usage[1] += input_tokens
+            usage[2] += output_tokens
+        return self
+
+    @property
+    def input_tokens(self) -> int:
+        return sum(usage[1] for usage in self._usage.values())
+
+    @property
+    def output_tokens(self) -> int:
+        return sum(usage[2] for usage in self._usage.values())
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    @property
+    def cost(self) -> float:
+        return sum(estimate_price(model, usage[1], usage[2]) for (_, model), usage in self._usage.items())
+
+    def _breakdown(self, index: int) -> dict:
+        breakdown = {}
+        for key, (calls, input_tokens, output_tokens) in self._usage.items():
+            entry = breakdown.setdefault(key[index], {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0})
+            entry["calls"] += calls
+            entry["input_tokens"] += input_tokens
+            entry["output_tokens"] += output_tokens
+            entry["cost"] += estimate_price(key[1], input_tokens, output_tokens)
+        return breakdown
+
+    def to_dict(self) -> dict:
+        return {
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": self.cost,
+            "agents": self._breakdown(0),
+            "models": self._breakdown(1),
+        }
@@ -0,0 +1,188 @@
+"""
+Purpose:
+    Per-stage latency and LLM token metrics. Code wraps each pipeline stage
+    (schema introspection, embedding, similarity search, agent turns, LLM
+    calls, run_sql) in a span; spans are aggregated into histograms that the
+    API exports in the Prometheus text format, and logged with the id of the
+    request they belong to.
+"""
+
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+METRICS_LOG_LEVEL = os.getenv('METRICS_LOG_LEVEL', 'INFO')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+request_id = contextvars.ContextVar("request_id", default="-")
+
+logger = logging.getLogger("psqlagent")
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+def configure_logging(level: str = METRICS_LOG_LEVEL):
+    """Logs psqlagent records with their request id; safe to call more than once."""
+    if any(isinstance(f, RequestIdFilter) for f in logger.filters):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    logger.addFilter(RequestIdFilter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def new_request_id(value: str = None) -> str:
+    value = value or uuid.uuid4().hex[:16]
+    request_id.set(value)
+    return value
+
+
+def in_context(fn):
+    """
+    Binds fn to a copy of the current context, so work handed to a thread
+    pool keeps the request id of the code that submitted it.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        # name -> (type, help, {sorted label tuple -> Histogram or float})
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _series(self, name: str, kind: str, help_text: str) -> dict:
+        return self._metrics.setdefault(name, (kind, help_text, {}))[2]
+
+    @staticmethod
+    def _key(labels: dict) -> tuple:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def observe(self, name: str, value: float, help_text: str = "", **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series(name, "histogram", help_text)
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, help_text: str = "", **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series(name, "counter", help_text)
+            series[key] = series.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, series) in sorted(self._metrics.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(series.items()):
+                    if kind == "counter":
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+                        continue
+                    for bound, count in zip(value.buckets, value.counts):
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {value.count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# Called with (stage, labels, seconds) after every span, e.g. to keep raw samples.
+span_listeners = []
+
+
+class Span:
+    def __init__(self, stage: str, labels: dict):
+        self.stage = stage
+        self.labels = labels
+        # Logged with the span but not used as metric labels.
+        self.fields = {}
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """
+    Times the block as stage; labels become metric labels and may be
+    updated through the yielded Span (e.g. a cache hit or miss).
+    """
+    current = Span(stage, labels)
+    started_at = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        seconds = time.perf_counter() - started_at
+        metrics.observe("psqlagent_stage_duration_seconds", seconds,
+                        "Time spent per pipeline stage.", stage=stage, **current.labels)
+        if error is not None:
+            metrics.increment("psqlagent_stage_errors_total", 1,
+                              "Pipeline stages that raised.", stage=stage, **current.labels)
+        for listener in span_listeners:
+            listener(stage, current.labels, seconds)
+        details = {**current.labels, **current.fields}
+        if error is not None:
+            details["error"] = type(error).__name__
+        logger.info(" ".join([f"span={stage}", f"seconds={seconds:.3f}"] + [f"{name}={value}" for name, value in details.items()]))
+
+
+def record_llm_call(agent: str, model: str, input_tokens: int, output_tokens: int, cached: bool):
+    labels = {"agent": agent, "model": model, "cache": "hit" if cached else "miss"}
+    metrics.increment("psqlagent_llm_calls_total", 1, "LLM calls, including cache hits.", **labels)
+    metrics.increment("psqlagent_llm_tokens_total", input_tokens, "LLM tokens by direction.",
+                      direction="input", **labels)
+    metrics.increment("psqlagent_llm_tokens_total", output_tokens, "LLM tokens by direction.",
+                      direction="output", **labels)
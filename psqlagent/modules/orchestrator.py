@@ -1,12 +1,41 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import List, Optional, Tuple
 import autogen
 from . import llm
+from .metrics import span, in_context, logger
+
+BROADCAST_TIMEOUT = float(os.getenv('BROADCAST_TIMEOUT', '120'))
+
+
+def to_oai_message(agent: autogen.ConversableAgent, message, role: str) -> dict:
+    """message as agent._append_oai_message would add it to a chat history, without adding it."""
+    message = agent._message_to_dict(message)
+    oai_message = {k: message[k] for k in ("content", "function_call", "name", "context") if k in message}
+    if "content" not in oai_message:
+        if "function_call" not in oai_message:
+            raise ValueError("Message can't be converted into a ChatCompletion message")
+        oai_message["content"] = None
+    oai_message["role"] = "function" if message.get("role") == "function" else role
+    if "function_call" in oai_message:
+        oai_message["role"] = "assistant"
+    return oai_message
+
 
 class Orchestrator:
     def __init__(self, name: str, agents: List[autogen.ConversableAgent]):
         self.name = name
         self.agents = agents
         self.messages = []
+        # Filled by the agents' LLM calls (agent_config.cached_oai_reply),
+        # which count the tokens they send and receive.
+        self.usage = llm.TokenUsage()
+        for agent in agents:
+            agent.token_usage = self.usage
+        # Set when a broadcast stops waiting for replies that are still running
+        # LLM calls and functions with the agents.
+        self.abandoned_replies = False
         self.complete_keyword = "APPROVED"
         self.error_keyword = "ERROR"
 
@@ -46,44 +75,30 @@ class Orchestrator:
         self.messages.append(message)
 
     def get_message_as_str(self):
-        messages_as_str = ""
-        for message in self.messages:
-            if message is None:
-                continue
-            if isinstance(message, dict):
-                content_from_dict = message.get("content", None)
-                function_call_from_dict = message.get("function_call", None)
-                content = content_from_dict or function_call_from_dict
-                if not content:
-                    continue
-                messages_as_str += str(content)
-            else:
-                messages_as_str += str(message)
-        return messages_as_str
-    
+        return "".join(llm.message_text(message) for message in self.messages)
+
     def get_cost_and_tokens(self):
-        return llm.estimate_price_and_tokens(self.get_message_as_str())
+        return round(self.usage.cost, 4), self.usage.total_tokens
 
     def basic_chat(self,
                    agent_a: autogen.ConversableAgent,
                    agent_b: autogen.ConversableAgent,
                    message: str):
 
-        print(
-            f"BasicChat between A: {agent_a.name} and B: {agent_b.name}")
+        logger.info(f"BasicChat between A: {agent_a.name} and B: {agent_b.name}")
 
-        agent_a.send(message, agent_b)
-        reply = agent_b.generate_reply(sender=agent_a)
+        with span("agent_turn", agent=agent_b.name):
+            agent_a.send(message, agent_b)
+            reply = agent_b.generate_reply(sender=agent_a)
         self.add_messages(reply)
-        print(f"BasicChat response from {agent_b.name} replied with: {reply}")
+        logger.info(f"BasicChat response from {agent_b.name} replied with: {reply}")
 
     def function_chat(self,
                       agent_a: autogen.ConversableAgent,
                       agent_b: autogen.ConversableAgent,
                       message: str):
 
-        print(
-            f"FunctionChat between A: {agent_a.name} and B: {agent_b.name}")
+        logger.info(f"FunctionChat between A: {agent_a.name} and B: {agent_b.name}")
 
         self.basic_chat(agent_a, agent_a, message)
         assert self.last_message_is_content
@@ -95,10 +110,7 @@ class Orchestrator:
         For example
         >>> "Agent A" -> "Agent B" -> "Agent C"
         """
-        print(
-            f"------------ {self.name} is starting a sequential conversation ---------")
-        print(
-            f"\n\nStarting sequential conversation with {self.total_agents} agents\n\n")
+        logger.info(f"{self.name} is starting a sequential conversation with {self.total_agents} agents")
 
         self.add_messages(prompt)
         # return True, self.messages
@@ -107,8 +119,7 @@ class Orchestrator:
             agent_a = self.agents[idx]
             agent_b = self.agents[idx + 1]
 
-            print(
-                f"\n ****** Running iteration {idx} between A: {agent_a.name} and B: {agent_b.name} ****************")
+            logger.info(f"Running iteration {idx} between A: {agent_a.name} and B: {agent_b.name}")
 
             # agent_a -> chat -> agent_b
             if self.last_message_is_str:
@@ -119,46 +130,127 @@ class Orchestrator:
                 self.function_chat(agent_a, agent_b, self.latest_message)
 
             if idx == self.total_agents - 2:
-                print(f"---- Conversation ended with: {agent_b.name} -----")
-                print(f"Final message: {self.latest_message}")
+                logger.info(f"Conversation ended with: {agent_b.name}")
+                logger.info(f"Final message: {self.latest_message}")
 
                 was_successful = False
                 if self.latest_message is not None:
                     was_successful = self.complete_keyword in self.latest_message
-                print("Successfull" if was_successful else "Unsuccessfull X")
+                logger.info("Successful" if was_successful else "Unsuccessful")
 
                 return was_successful, self.messages[1:]
 
-    def broadcast_conversation(self, prompt: str) -> Tuple[bool, List[str]]:
+    def broadcast_reply(self,
+                        agent_a: autogen.ConversableAgent,
+                        agent_b: autogen.ConversableAgent,
+                        message) -> list:
+        """
+        One broadcast branch, run on a worker thread: agent_b's reply to
+        message, followed by the result if it is a call to its own function.
+        Replies are generated on copies of the chat histories; the agents'
+        own histories are only updated by record_broadcast_reply, on the
+        calling thread, so a reply that is given up on never lands in them.
         """
-        Runs a broadcast conversation between all agents
+        with span("agent_turn", agent=agent_b.name):
+            history = list(agent_b.chat_messages.get(agent_a, [])) + [to_oai_message(agent_b, message, "user")]
+            replies = [agent_b.generate_reply(messages=history, sender=agent_a)]
+            reply = replies[0]
+            if isinstance(reply, dict) and reply.get("function_call", None) and self.has_function(agent_b):
+                own_history = list(agent_b.chat_messages.get(agent_b, [])) + [
+                    to_oai_message(agent_b, reply, "assistant"), to_oai_message(agent_b, reply, "user")]
+                replies.append(agent_b.generate_reply(messages=own_history, sender=agent_b))
+        return replies
+
+    def record_broadcast_reply(self,
+                               agent_a: autogen.ConversableAgent,
+                               agent_b: autogen.ConversableAgent,
+                               message, replies: list):
+        """Adds a completed broadcast branch to the agents' histories, as send would have."""
+        agent_a._append_oai_message(message, "assistant", agent_b)
+        agent_b._append_oai_message(message, "user", agent_a)
+        if len(replies) > 1:
+            agent_b._append_oai_message(replies[0], "assistant", agent_b)
+            agent_b._append_oai_message(replies[0], "user", agent_b)
+
+    def is_approved(self, message) -> bool:
+        return message is not None and self.complete_keyword in llm.message_text(message)
+
+    def broadcast_conversation(self, prompt: str, timeout: float = BROADCAST_TIMEOUT,
+                               stop_on_approved: bool = True) -> Tuple[bool, List[str]]:
+        """
+        Runs a broadcast conversation between all agents, with every target
+        agent replying concurrently
         For example
         >>> "Agent A" -> "Agent B"
         >>> "Agent A" -> "Agent C"
         >>> "Agent A" -> "Agent D"
+
+        Agents that don't reply within timeout seconds get an ERROR message
+        instead; with stop_on_approved, the first APPROVED reply ends the
+        broadcast and the agents still running are not waited for. Replies
+        are added to the messages in agent order, not completion order.
         """
-        print(
-            f"\nStarting broadcast conversation with {self.total_agents} agents\n\n")
+        logger.info(f"Starting broadcast conversation with {self.total_agents} agents")
 
         self.add_messages(prompt)
         broadcast_agent = self.agents[0]
+        targets = self.agents[1:]
+
+        executor = ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="broadcast")
+        futures = {
+            executor.submit(in_context(self.broadcast_reply), broadcast_agent, agent, prompt): idx
+            for idx, agent in enumerate(targets)
+        }
+        deadline = time.monotonic() + timeout
+        replies = {}
+        failed = set()
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                idx = futures[future]
+                try:
+                    replies[idx] = future.result()
+                except Exception as e:
+                    logger.warning(f"Broadcast to {targets[idx].name} failed: {e}")
+                    replies[idx] = [f"{self.error_keyword}: {targets[idx].name} failed: {e}"]
+                    failed.add(idx)
+            if stop_on_approved and any(self.is_approved(reply[-1]) for reply in replies.values()):
+                break
+        # Threads can't be interrupted; late replies are simply ignored, and
+        # never reach the agents' histories.
+        executor.shutdown(wait=False, cancel_futures=True)
+        if pending:
+            self.abandoned_replies = True
+        stopped_early = bool(pending) and stop_on_approved and any(
+            self.is_approved(reply[-1]) for reply in replies.values())
+
+        for idx, agent in enumerate(targets):
+            if idx not in replies:
+                if stopped_early:
+                    logger.info(f"Broadcast to {agent.name} skipped, already APPROVED")
+                    continue
+                logger.warning(f"Broadcast to {agent.name} timed out after {timeout}s")
+                replies[idx] = [f"{self.error_keyword}: {agent.name} did not reply within {timeout}s"]
+                self.add_messages(replies[idx][0])
+                continue
 
-        for idx, agent in enumerate(self.agents[1:]):  # skip the first agent
-
-            print(
-                f"\n ******  Running iteration {idx} between A: {agent_a.name} and B: {agent_b.name} ****************")
-
-            # agent_a -> chat -> agent_b
-            if self.last_message_is_str:
-                self.basic_chat(agent_a, agent_b, self.latest_message)
+            if idx in failed:
+                self.add_messages(replies[idx][0])
+                continue
 
-            # agent_a -> function -> agent_b
-            if self.last_message_is_func_call and self.has_function(agent_a):
-                self.function_chat(agent_a, agent_b, self.latest_message)
+            logger.info(f"Broadcast reply {idx} between A: {broadcast_agent.name} and B: {agent.name}")
+            self.record_broadcast_reply(broadcast_agent, agent, prompt, replies[idx])
+            reply, *function_result = replies[idx]
+            self.add_messages(reply)
+            logger.info(f"Broadcast response from {agent.name} replied with: {reply}")
+            if function_result:
+                self.add_messages(function_result[0])
 
-        was_successful = False
-        if self.latest_message is not None:
-            was_successful = self.complete_keyword in self.latest_message
-        print("Successfull" if was_successful else "Unsuccessfull X")
+        was_successful = any(self.is_approved(message) for message in self.messages[1:])
+        logger.info("Successful" if was_successful else "Unsuccessful")
 
         return was_successful, self.messages
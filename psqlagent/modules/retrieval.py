@@ -0,0 +1,102 @@
+"""
+Purpose:
+    Top-k cosine similarity search over table embeddings.
+    Embeddings are kept in one matrix and scored with a single matrix-vector
+    product; past a size threshold an approximate nearest neighbour index
+    (hnswlib, if installed) is used instead.
+"""
+
+import os
+import numpy as np
+
+EMBEDDING_ANN_THRESHOLD = int(os.getenv('EMBEDDING_ANN_THRESHOLD', '20000'))
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+def top_k(scores, k: int):
+    """Indices of the k highest scores, best first, using partial selection."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class EmbeddingIndex:
+    def __init__(self, names: list, matrix, ann_threshold: int = EMBEDDING_ANN_THRESHOLD):
+        """
+        names[i] labels row i of matrix; rows labelled None are ignored, which
+        lets the index search a memory-mapped store in place without copying it.
+        """
+        self.names = list(names)
+        self.matrix = matrix
+        valid = np.array([name is not None for name in self.names], dtype=bool)
+        self.size = int(valid.sum())
+        if self.size == 0:
+            self.inverse_norms = None
+            self.ann = None
+            return
+
+        norms = np.linalg.norm(matrix, axis=1).astype(np.float32)
+        norms[norms == 0] = 1.0
+        self.inverse_norms = np.where(valid, 1.0 / norms, 0.0).astype(np.float32)
+        # Unused rows score -inf so they are never selected.
+        self.mask = np.where(valid, 0.0, -np.inf).astype(np.float32)
+
+        self.ann = None
+        if ann_threshold and self.size >= ann_threshold and hnswlib is not None:
+            self.ann = self._build_ann(np.flatnonzero(valid))
+
+    @classmethod
+    def from_embeddings(cls, embeddings: dict, **kwargs) -> "EmbeddingIndex":
+        names = list(embeddings.keys())
+        if not names:
+            return cls([], np.empty((0, 0), dtype=np.float32), **kwargs)
+        matrix = np.vstack([np.asarray(embeddings[name]).reshape(1, -1) for name in names])
+        return cls(names, matrix.astype(np.float32), **kwargs)
+
+    @classmethod
+    def from_store(cls, store, table_names, **kwargs) -> "EmbeddingIndex":
+        """Indexes table_names directly on the store's memory-mapped matrix."""
+        names = [None] * store.index["capacity"]
+        for name in table_names:
+            if name in store:
+                names[store.index["rows"][name]["row"]] = name
+        return cls(names, store.matrix, **kwargs)
+
+    def _build_ann(self, rows):
+        vectors = np.asarray(self.matrix[rows], dtype=np.float32) * self.inverse_norms[rows, None]
+        index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        index.init_index(max_elements=len(rows), ef_construction=200, M=16)
+        index.add_items(vectors, rows)
+        index.set_ef(64)
+        return index
+
+    def __len__(self) -> int:
+        return self.size
+
+    def scores(self, query):
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / (np.linalg.norm(query) or 1.0)
+        return (self.matrix @ query) * self.inverse_norms + self.mask
+
+    def search(self, query, k: int = 3) -> list:
+        """Returns up to k (table_name, cosine_similarity) pairs, best first."""
+        if self.size == 0:
+            return []
+        k = min(k, self.size)
+        if self.ann is not None:
+            query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+            query = query / (np.linalg.norm(query) or 1.0)
+            rows, distances = self.ann.knn_query(query, k=max(k, 1))
+            return [(self.names[row], 1.0 - float(distance))
+                    for row, distance in zip(rows[0], distances[0])]
+        scores = self.scores(query)
+        return [(self.names[row], float(scores[row])) for row in top_k(scores, k)]
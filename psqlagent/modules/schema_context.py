@@ -0,0 +1,153 @@
+"""
+Purpose:
+    Build the TABLE_DEFINITIONS prompt context within a token budget.
+    Tables are written in a compact one-line encoding, ranked by relevance to
+    the user query; key columns always come first, the remaining columns are
+    added by relevance until the budget is spent, and whatever doesn't fit is
+    summarised instead of cut off mid-table.
+"""
+
+import os
+import re
+from psqlagent.modules.lexical import tokenize
+from psqlagent.modules.metrics import span
+
+SCHEMA_CONTEXT_TOKEN_BUDGET = int(os.getenv('SCHEMA_CONTEXT_TOKEN_BUDGET', '1500'))
+
+FORMAT_LINE = "Format: table(column type [PK] [-> ref_table.ref_column], ...); +N = N columns not shown"
+
+TYPE_ABBREVIATIONS = [
+    (r"\bcharacter varying\b", "varchar"),
+    (r"\btimestamp(\(\d+\))? without time zone\b", r"timestamp\1"),
+    (r"\btimestamp(\(\d+\))? with time zone\b", r"timestamptz\1"),
+    (r"\btime(\(\d+\))? without time zone\b", r"time\1"),
+    (r"\bdouble precision\b", "float8"),
+    (r"\binteger\b", "int"),
+    (r"\bboolean\b", "bool"),
+    (r"\bcharacter\b", "char"),
+]
+
+
+def compact_type(data_type: str) -> str:
+    for pattern, replacement in TYPE_ABBREVIATIONS:
+        data_type = re.sub(pattern, replacement, data_type)
+    return data_type
+
+
+def identifier_terms(text: str) -> set:
+    """Stemmed lowercase words of snake_case, camelCase or free text."""
+    return set(tokenize(text))
+
+
+def default_count_tokens(text: str) -> int:
+    from psqlagent.modules import llm
+    return llm.count_tokens(text)
+
+
+class SchemaContextBuilder:
+    def __init__(self, token_budget: int = SCHEMA_CONTEXT_TOKEN_BUDGET, count_tokens=None):
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens or default_count_tokens
+
+    @staticmethod
+    def key_columns(table) -> set:
+        keys = set(table.primary_key)
+        for fk in table.foreign_keys:
+            keys.update(fk.columns)
+        return keys
+
+    @staticmethod
+    def column_relevance(column, terms: set) -> float:
+        score = len(identifier_terms(column.name) & terms)
+        if column.comment:
+            score += 0.5 * len(identifier_terms(column.comment) & terms)
+        return score
+
+    def table_relevance(self, table, terms: set) -> float:
+        score = 2 * len(identifier_terms(table.name) & terms)
+        if table.columns:
+            score += max(self.column_relevance(column, terms) for column in table.columns)
+        return score
+
+    @staticmethod
+    def render_column(table, column) -> str:
+        rendered = f"{column.name} {compact_type(column.data_type)}"
+        if column.name in table.primary_key:
+            rendered += " PK"
+        for fk in table.foreign_keys:
+            if column.name in fk.columns:
+                ref_column = fk.ref_columns[fk.columns.index(column.name)]
+                rendered += f" -> {fk.ref_table}.{ref_column}"
+        return rendered
+
+    def render_table(self, table, column_names: set) -> str:
+        columns = [self.render_column(table, column) for column in table.columns if column.name in column_names]
+        omitted = len(table.columns) - len(columns)
+        if omitted:
+            columns.append(f"+{omitted}")
+        return f"{table.name}({', '.join(columns)})"
+
+    def render(self, selected: list, omitted_tables: int) -> str:
+        lines = [FORMAT_LINE] + [self.render_table(table, column_names) for table, column_names in selected]
+        if omitted_tables:
+            lines.append(f"... {omitted_tables} more tables not shown")
+        return "\n".join(lines)
+
+    def build(self, tables: list, query: str = "", column_names: dict = None) -> str:
+        """
+        Returns the context for tables (most relevant first, ties kept in the
+        given order) within token_budget tokens. column_names (table name ->
+        set of column names, e.g. a SubSchema's columns) limits the columns
+        that may be shown; the rest are counted as not shown.
+        """
+        with span("schema_context") as context_span:
+            context_span.set(tables=len(tables), token_budget=self.token_budget)
+            return self._build(tables, query, column_names)
+
+    def _build(self, tables: list, query: str, column_names: dict = None) -> str:
+        def shown(table) -> set:
+            if column_names is None:
+                return {column.name for column in table.columns}
+            return set(column_names.get(table.name, ()))
+
+        terms = identifier_terms(query)
+        ranked = sorted(enumerate(tables), key=lambda item: (-self.table_relevance(item[1], terms), item[0]))
+        ranked = [table for _, table in ranked]
+        if self.token_budget is None:
+            return self.render([(table, shown(table)) for table in ranked], 0)
+
+        # Reserve room for the omitted tables note so adding it can't overflow.
+        budget = self.token_budget - self.count_tokens(FORMAT_LINE) - 12
+
+        # Every table that fits gets its key columns, in relevance order.
+        selected = []
+        used = 0
+        for table in ranked:
+            keys = self.key_columns(table) & shown(table)
+            cost = self.count_tokens(self.render_table(table, keys)) + 1
+            if used + cost <= budget:
+                selected.append((table, keys))
+                used += cost
+
+        # Then the remaining columns, most relevant first; ties go round robin
+        # over the tables in column order so a wide table can't starve the rest.
+        candidates = sorted(
+            (-self.column_relevance(column, terms), position, rank, column)
+            for rank, (table, keys) in enumerate(selected)
+            for position, column in enumerate(table.columns)
+            if column.name not in keys and column.name in shown(table)
+        )
+        for _, _, rank, column in candidates:
+            table, keys = selected[rank]
+            cost = self.count_tokens(f", {self.render_column(table, column)}")
+            if used + cost <= budget:
+                keys.add(column.name)
+                used += cost
+
+        context = self.render(selected, len(ranked) - len(selected))
+        # The per-column estimates ignore tokens merged across separators;
+        # drop the least relevant tables until the real count fits.
+        while selected and self.count_tokens(context) > self.token_budget:
+            selected.pop()
+            context = self.render(selected, len(ranked) - len(selected))
+        return context
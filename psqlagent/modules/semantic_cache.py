@@ -0,0 +1,244 @@
+"""
+Purpose:
+    Answer paraphrases of questions the data team already solved without
+    running the agent conversation. Approved SQL is stored with the embedding
+    of the question that produced it and the fingerprint of the schema it was
+    written against; a new question close enough to a stored one, and
+    mentioning the same tables, numbers and quoted values, reuses its SQL.
+    Off by default: embeddings can't tell "this month" from "last month".
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import numpy as np
+from psqlagent.modules.lexical import tokenize
+
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+# Questions are embedded with a mean-pooled sentence model, whatever the table backend.
+SEMANTIC_CACHE_BACKEND = os.getenv('SEMANTIC_CACHE_BACKEND', 'sentence')
+SEMANTIC_CACHE_MODEL_NAME = os.getenv('SEMANTIC_CACHE_MODEL_NAME')
+# Cosine similarity from which two questions are paraphrases, per backend kind;
+# see benchmarks/bench_semantic_cache.py to calibrate. BERT's pooler output is
+# anisotropic (unrelated questions score above 0.9), hence its much higher bar.
+SEMANTIC_CACHE_THRESHOLDS = {"sentence": 0.9, "onnx": 0.9, "bert": 0.99}
+# Overrides the per-backend threshold when set.
+SEMANTIC_CACHE_THRESHOLD = os.getenv('SEMANTIC_CACHE_THRESHOLD')
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '1000'))
+SEMANTIC_CACHE_PATH = os.getenv('SEMANTIC_CACHE_PATH')
+
+
+# Numbers and quoted values, which paraphrases have to share.
+# Quotes must stand apart from words, so apostrophes (the manager's) aren't quotes.
+LITERAL_PATTERN = re.compile(r"""(?<!\w)'([^']*)'(?!\w)|(?<!\w)"([^"]*)"(?!\w)|(\d+(?:[.,]\d+)*)""")
+
+
+def question_literals(question: str) -> frozenset:
+    """The numbers and quoted values of question, e.g. {"2023", "5", "pending"}."""
+    return frozenset(next(group for group in match.groups() if group is not None).lower().replace(",", "")
+                     for match in LITERAL_PATTERN.finditer(question))
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def question_embedder(table_embedder):
+    """
+    table_embedder if its backend is a mean-pooled sentence model, otherwise
+    an in-memory embedder on SEMANTIC_CACHE_BACKEND.
+    """
+    if table_embedder.backend.kind in ("sentence", "onnx"):
+        return table_embedder
+    from psqlagent.modules.embedding_backends import create_embedding_backend, DEFAULT_MODELS
+    from psqlagent.modules.embeddings import DatabaseEmbedder
+    backend = create_embedding_backend(
+        SEMANTIC_CACHE_BACKEND, model_name=SEMANTIC_CACHE_MODEL_NAME or DEFAULT_MODELS[SEMANTIC_CACHE_BACKEND])
+    return DatabaseEmbedder(store_dir=None, backend=backend)
+
+
+def semantic_cache_threshold(kind: str) -> float:
+    if SEMANTIC_CACHE_THRESHOLD:
+        return float(SEMANTIC_CACHE_THRESHOLD)
+    return SEMANTIC_CACHE_THRESHOLDS.get(kind, max(SEMANTIC_CACHE_THRESHOLDS.values()))
+
+
+def approved_sql(success: bool, messages: list):
+    """Returns the last SQL the analyst ran in an approved conversation, or None."""
+    if not success:
+        return None
+    for message in reversed(messages):
+        if not isinstance(message, dict):
+            continue
+        function_call = message.get("function_call")
+        if not function_call or function_call.get("name") != "run_sql":
+            continue
+        try:
+            return json.loads(function_call.get("arguments") or "{}").get("sql")
+        except json.JSONDecodeError:
+            return None
+    return None
+
+
+class SemanticCache:
+    """
+    Per catalog, a small matrix of normalized question embeddings searched by
+    cosine similarity. Entries only match while the schema fingerprint they
+    were stored with is current and the new question mentions the same
+    tables, and the least recently used are evicted past max_entries.
+    """
+
+    def __init__(self, embedder, threshold: float = None,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, path: str = SEMANTIC_CACHE_PATH):
+        """embedder embeds the questions (see question_embedder); threshold defaults to its backend's."""
+        self.embedder = embedder
+        self.threshold = semantic_cache_threshold(embedder.backend.kind) if threshold is None else threshold
+        self.max_entries = max_entries
+        self.path = path
+        # catalog_id -> list of entry dicts, and the matching embedding matrix.
+        self._entries = {}
+        self._matrices = {}
+        self._lock = threading.Lock()
+        # (schema fingerprint, {table name: its name's words}) for mentioned_tables.
+        self._table_terms = (None, {})
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def embed(self, text: str) -> np.ndarray:
+        return normalize(self.embedder.embed_texts([text])[0])
+
+    def mentioned_tables(self, schema, question: str) -> frozenset:
+        """Tables of schema all of whose name's words (stemmed) appear in question."""
+        fingerprint, table_terms = self._table_terms
+        if fingerprint != schema.fingerprint():
+            table_terms = {name: frozenset(tokenize(name)) for name in schema.table_names()}
+            self._table_terms = (schema.fingerprint(), table_terms)
+        words = set(tokenize(question))
+        return frozenset(name for name, terms in table_terms.items() if terms and terms <= words)
+
+    def lookup(self, catalog_id: str, fingerprint: str, question: str, embedding: np.ndarray = None,
+               tables: frozenset = frozenset()):
+        """
+        Returns the cached entry (question, sql, similarity, ...) closest to
+        question if it is above the threshold and was stored for the same
+        mentioned tables and literals (question_literals), otherwise None.
+        """
+        literals = question_literals(question)
+        if embedding is None:
+            embedding = self.embed(question)
+        with self._lock:
+            entries = self._entries.get(catalog_id, [])
+            best = None
+            if entries:
+                scores = self._matrices[catalog_id] @ embedding
+                for i in np.argsort(-scores):
+                    if scores[i] < self.threshold:
+                        break
+                    entry = entries[i]
+                    if (entry["fingerprint"], entry["tables"], entry["literals"]) == (fingerprint, tables, literals):
+                        best = i
+                        break
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry = entries[best]
+            entry["hits"] += 1
+            entry["last_used_at"] = time.time()
+            return {**entry, "similarity": float(scores[best])}
+
+    def store(self, catalog_id: str, fingerprint: str, question: str, sql: str, embedding: np.ndarray = None,
+              tables: frozenset = frozenset()):
+        if embedding is None:
+            embedding = self.embed(question)
+        with self._lock:
+            entries = self._entries.setdefault(catalog_id, [])
+            # Replace an entry for the same question instead of duplicating it.
+            entries[:] = [entry for entry in entries
+                          if (entry["question"], entry["fingerprint"]) != (question, fingerprint)]
+            now = time.time()
+            entries.append({
+                "question": question,
+                "sql": sql,
+                "fingerprint": fingerprint,
+                "tables": frozenset(tables),
+                "literals": question_literals(question),
+                "embedding": np.asarray(embedding, dtype=np.float32),
+                "created_at": now,
+                "last_used_at": now,
+                "hits": 0,
+            })
+            if len(entries) > self.max_entries:
+                entries.sort(key=lambda entry: entry["last_used_at"])
+                del entries[:len(entries) - self.max_entries]
+            self._matrices[catalog_id] = np.stack([entry["embedding"] for entry in entries])
+            self.stores += 1
+        if self.path is not None:
+            self.save()
+
+    def invalidate(self, catalog_id: str = None):
+        with self._lock:
+            if catalog_id is None:
+                self._entries.clear()
+                self._matrices.clear()
+            else:
+                self._entries.pop(catalog_id, None)
+                self._matrices.pop(catalog_id, None)
+
+    def save(self):
+        """Writes questions and SQL to path; embeddings are recomputed on load."""
+        with self._lock:
+            data = {
+                "model_name": self.embedder.model_name,
+                "catalogs": {
+                    catalog_id: [
+                        {**{key: value for key, value in entry.items() if key not in ("embedding", "literals")},
+                         "tables": sorted(entry["tables"])}
+                        for entry in entries
+                    ]
+                    for catalog_id, entries in self._entries.items()
+                },
+            }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as file:
+            data = json.load(file)
+        entries_by_catalog = {}
+        for catalog_id, entries in data.get("catalogs", {}).items():
+            if not entries:
+                continue
+            embeddings = normalize(self.embedder.embed_texts([entry["question"] for entry in entries]))
+            for entry, embedding in zip(entries, embeddings):
+                entry["embedding"] = embedding
+                entry["tables"] = frozenset(entry.get("tables", ()))
+                entry["literals"] = question_literals(entry["question"])
+            entries_by_catalog[catalog_id] = entries
+        with self._lock:
+            self._entries = entries_by_catalog
+            self._matrices = {
+                catalog_id: np.stack([entry["embedding"] for entry in entries])
+                for catalog_id, entries in entries_by_catalog.items()
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": sum(len(entries) for entries in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "threshold": self.threshold,
+            }
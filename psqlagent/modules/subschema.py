@@ -0,0 +1,130 @@
+"""
+Purpose:
+    Pick the minimal sub-schema a query needs. Columns are indexed one by
+    one (short texts, so wide tables lose nothing to truncation), the best
+    matching columns select the tables, and the foreign-key graph adds the
+    tables and key columns on the join paths between them. Only matched,
+    key and join columns of those tables are shown to the LLM; the tables
+    the table path picks (named verbatim or best ranked) are always merged
+    in with all their columns, so the sub-schema never loses a table the
+    table path would have shown.
+"""
+
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List
+from psqlagent.modules.embeddings import DatabaseEmbedder, EMBEDDING_BATCH_SIZE
+from psqlagent.modules.metrics import span
+
+SUBSCHEMA_ENABLED = os.getenv('SUBSCHEMA_ENABLED', 'false').lower() == 'true'
+# Columns retrieved per query, tables they may select, and the longest join path followed.
+SUBSCHEMA_COLUMNS = int(os.getenv('SUBSCHEMA_COLUMNS', '15'))
+SUBSCHEMA_MAX_TABLES = int(os.getenv('SUBSCHEMA_MAX_TABLES', '5'))
+SUBSCHEMA_MAX_HOPS = int(os.getenv('SUBSCHEMA_MAX_HOPS', '3'))
+
+
+@dataclass
+class SubSchema:
+    tables: List[str] = field(default_factory=list)
+    columns: Dict[str, set] = field(default_factory=dict)
+    join_tables: List[str] = field(default_factory=list)
+
+
+def join_path(graph: dict, start: str, targets: set, max_hops: int):
+    """Shortest list of tables from start to any of targets, or None if more than max_hops away."""
+    previous = {start: None}
+    frontier = deque([(start, 0)])
+    while frontier:
+        table, hops = frontier.popleft()
+        if table in targets:
+            path = []
+            while table is not None:
+                path.append(table)
+                table = previous[table]
+            return path
+        if hops == max_hops:
+            continue
+        for neighbour in graph.get(table, {}):
+            if neighbour not in previous:
+                previous[neighbour] = table
+                frontier.append((neighbour, hops + 1))
+    return None
+
+
+def expand_join_paths(graph: dict, seeds: list, max_hops: int = SUBSCHEMA_MAX_HOPS):
+    """
+    Connects seeds (most relevant first) greedily: each one joins the tables
+    picked so far by its shortest foreign-key path. Seeds with no path within
+    max_hops are kept on their own. Returns the join tables added and the
+    (owning table, fk) edges used.
+    """
+    picked = set(seeds[:1])
+    join_tables, edges = [], []
+    for seed in seeds[1:]:
+        if seed in picked:
+            continue
+        path = join_path(graph, seed, picked, max_hops)
+        picked.add(seed)
+        if path is None:
+            continue
+        for table, neighbour in zip(path, path[1:]):
+            edges.append(graph[table][neighbour][0])
+        for table in path[1:-1]:
+            if table not in picked:
+                picked.add(table)
+                join_tables.append(table)
+    return join_tables, edges
+
+
+class ColumnRetriever:
+    def __init__(self, table_embedder: DatabaseEmbedder, n_columns: int = SUBSCHEMA_COLUMNS,
+                 max_tables: int = SUBSCHEMA_MAX_TABLES, max_hops: int = SUBSCHEMA_MAX_HOPS):
+        """Columns are embedded with table_embedder's backend, in a store of their own."""
+        self.embedder = DatabaseEmbedder(store_dir=table_embedder.store_dir, backend=table_embedder.backend)
+        self.n_columns = n_columns
+        self.max_tables = max_tables
+        self.max_hops = max_hops
+        self._synced = None
+
+    def sync(self, schema, store_name: str = None, batch_size: int = EMBEDDING_BATCH_SIZE, progress=None):
+        """Indexes the columns of schema; a no-op while the schema is unchanged."""
+        if self._synced == (schema.fingerprint(), store_name):
+            return
+        columns_by_key = schema.columns_by_key()
+        definitions = {key: table.column_definition(column) for key, (table, column) in columns_by_key.items()}
+        search_texts = {key: table.column_search_text(column) for key, (table, column) in columns_by_key.items()}
+        self.embedder.sync_tables(
+            definitions, store_name=f"{store_name}-columns" if store_name else None,
+            batch_size=batch_size, progress=progress, search_texts=search_texts)
+        self._synced = (schema.fingerprint(), store_name)
+
+    def subschema(self, schema, query: str, table_names: list = ()) -> SubSchema:
+        """table_names are the table path's tables (DatabaseEmbedder.get_similar_tables), kept whole."""
+        with span("subschema") as subschema_span:
+            columns_by_key = schema.columns_by_key()
+            matched, scores = {}, {}
+            # The column index ranks "table.column" keys like the table index ranks tables.
+            # A table scores the reciprocal ranks of its columns, so several good
+            # matches outweigh a single stray one.
+            for rank, key in enumerate(self.embedder.get_similar_tables(query, self.n_columns)):
+                if key not in columns_by_key:
+                    continue
+                table, column = columns_by_key[key]
+                matched.setdefault(table.name, set()).add(column.name)
+                scores[table.name] = scores.get(table.name, 0.0) + 1.0 / (rank + 1)
+
+            whole_tables = [name for name in table_names if name in schema.tables]
+            ranked = [name for name in sorted(matched, key=lambda name: -scores[name]) if name not in whole_tables]
+            seeds = whole_tables + ranked[:max(self.max_tables - len(whole_tables), 0)]
+            join_tables, edges = expand_join_paths(schema.foreign_key_graph(), seeds, self.max_hops)
+            tables = seeds + join_tables
+            columns = {name: set(schema.tables[name].primary_key) | matched.get(name, set()) for name in tables}
+            for name in whole_tables:
+                columns[name] = {column.name for column in schema.tables[name].columns}
+            for table_name, fk in edges:
+                columns[table_name].update(fk.columns)
+                columns[fk.ref_table].update(fk.ref_columns)
+            subschema_span.set(tables=len(tables), join_tables=len(join_tables),
+                               columns=sum(len(names) for names in columns.values()))
+            return SubSchema(tables=tables, columns=columns, join_tables=join_tables)
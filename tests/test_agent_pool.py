@@ -0,0 +1,82 @@
+import threading
+import pytest
+from psqlagent.agents.pool import AgentTeamPool, AgentPoolTimeout
+
+
+class FakeAgent:
+    def __init__(self):
+        self.resets = 0
+
+    def reset(self):
+        self.resets += 1
+
+
+def build_team():
+    return [FakeAgent(), FakeAgent()]
+
+
+def test_checkout_builds_lazily_and_resets_the_team():
+    pool = AgentTeamPool(build_team, size=2)
+    team = pool.checkout()
+    assert [agent.resets for agent in team] == [1, 1]
+    assert pool.stats()["created"] == 1 and pool.stats()["in_use"] == 1
+
+
+def test_checked_in_team_is_reused():
+    pool = AgentTeamPool(build_team, size=1)
+    team = pool.checkout()
+    pool.checkin(team)
+    assert pool.checkout() is team
+    assert team[0].resets == 2
+    assert pool.stats()["created"] == 1
+
+
+def test_concurrent_checkouts_get_different_teams():
+    pool = AgentTeamPool(build_team, size=2)
+    assert pool.checkout() is not pool.checkout()
+
+
+def test_checkout_times_out_when_every_team_is_in_use():
+    pool = AgentTeamPool(build_team, size=1, checkout_timeout=0.05)
+    pool.checkout()
+    with pytest.raises(AgentPoolTimeout):
+        pool.checkout()
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_checkout_waits_for_a_checkin():
+    pool = AgentTeamPool(build_team, size=1, checkout_timeout=5)
+    team = pool.checkout()
+    timer = threading.Timer(0.05, pool.checkin, [team])
+    timer.start()
+    assert pool.checkout() is team
+    timer.join()
+
+
+def test_discarded_team_is_rebuilt():
+    pool = AgentTeamPool(build_team, size=1, checkout_timeout=0.05)
+    team = pool.checkout()
+    pool.checkin(team, discard=True)
+    assert pool.checkout() is not team
+    assert pool.stats()["created"] == 2 and pool.stats()["discarded"] == 1
+
+
+def test_failed_build_frees_its_slot():
+    builds = iter([RuntimeError("no key"), None])
+
+    def flaky_build_team():
+        error = next(builds)
+        if error is not None:
+            raise error
+        return build_team()
+
+    pool = AgentTeamPool(flaky_build_team, size=1, checkout_timeout=0.05)
+    with pytest.raises(RuntimeError):
+        pool.checkout()
+    assert len(pool.checkout()) == 2
+
+
+def test_fill_builds_every_team():
+    pool = AgentTeamPool(build_team, size=3)
+    pool.fill()
+    assert pool.stats()["idle"] == 3 and pool.stats()["created"] == 3
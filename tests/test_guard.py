@@ -0,0 +1,61 @@
+import pytest
+from psqlagent.modules.db.guard import (
+    add_row_limit, check_plan, plan_failed, postgres_plan_estimate, showplan_estimate, PlanEstimate, QueryRejected,
+)
+
+
+def test_row_limit_added_to_unlimited_queries():
+    assert add_row_limit("SELECT * FROM orders", "postgres", 10) == "SELECT * FROM orders\nLIMIT 10"
+    assert add_row_limit("select distinct status from orders", "sqlserver", 10) == \
+        "select distinct TOP (10) status from orders"
+
+
+def test_limit_inside_a_subquery_or_literal_does_not_count():
+    sql = "SELECT * FROM (SELECT * FROM orders LIMIT 5) o WHERE note = 'limit 3'"
+    assert add_row_limit(sql, "postgres", 10) == f"{sql}\nLIMIT 10"
+
+
+def test_row_limit_after_a_trailing_comment():
+    assert add_row_limit("SELECT * FROM orders -- all of them", "postgres", 10) == \
+        "SELECT * FROM orders -- all of them\nLIMIT 10"
+
+
+def test_sqlserver_set_operations_and_offsets_are_untouched():
+    for sql in ["SELECT id FROM orders UNION SELECT id FROM refunds",
+                "SELECT * FROM orders ORDER BY id OFFSET 10 ROWS FETCH NEXT 5 ROWS ONLY"]:
+        assert add_row_limit(sql, "sqlserver", 10) is sql
+
+
+def test_writes_and_disabled_limits_are_untouched():
+    assert add_row_limit("DELETE FROM orders", "postgres", 10) == "DELETE FROM orders"
+    assert add_row_limit("SELECT * FROM orders", "postgres", 0) == "SELECT * FROM orders"
+
+
+def test_check_plan_rejects_costly_or_large_plans():
+    check_plan(PlanEstimate(cost=100, rows=10), max_cost=1000, max_rows=100)
+    check_plan(None, max_cost=1)
+    with pytest.raises(QueryRejected, match="estimated cost 5,000"):
+        check_plan(PlanEstimate(cost=5000, rows=10), max_cost=1000, max_rows=100)
+    with pytest.raises(QueryRejected, match="500 rows"):
+        check_plan(PlanEstimate(cost=100, rows=500), max_cost=1000, max_rows=100)
+
+
+def test_check_plan_limits_of_zero_are_disabled():
+    check_plan(PlanEstimate(cost=1e12, rows=1e12), max_cost=0, max_rows=0)
+
+
+def test_plan_estimates():
+    plan = '[{"Plan": {"Node Type": "Seq Scan", "Total Cost": 431.5, "Plan Rows": 1200}}]'
+    assert postgres_plan_estimate(plan) == PlanEstimate(cost=431.5, rows=1200)
+    showplan = """<ShowPlanXML xmlns="http://schemas.microsoft.com/sqlserver/2004/07/showplan"><BatchSequence><Batch>
+        <Statements>
+          <StmtSimple StatementSubTreeCost="0.5" StatementEstRows="3" />
+          <StmtSimple StatementSubTreeCost="12.25" StatementEstRows="800" />
+        </Statements></Batch></BatchSequence></ShowPlanXML>"""
+    assert showplan_estimate(showplan) == PlanEstimate(cost=12.25, rows=800)
+    assert showplan_estimate("<ShowPlanXML />") is None
+
+
+def test_plan_failed_keeps_the_first_line_of_the_error():
+    error = plan_failed(Exception('relation "nope" does not exist\nLINE 1: SELECT * FROM nope'))
+    assert str(error) == 'Query rejected before running, it could not be planned: relation "nope" does not exist'
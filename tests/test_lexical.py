@@ -0,0 +1,60 @@
+import math
+from psqlagent.modules.lexical import reciprocal_rank_fusion, tokenize, LexicalIndex
+
+DOCUMENTS = {
+    "customers": "customers: customer_id, first_name, last_name, country",
+    "orders": "orders: order_id, customer_id, order_date, status, total_amount",
+    "order_items": "order_items: order_id, product_id, quantity, unit_price",
+    "products": "products: product_id, productName, list_price, category",
+    "shipments": "shipments: shipment_id, order_id, carrier, shipped_at",
+}
+
+
+def test_tokenize_splits_and_stems_identifiers():
+    assert tokenize("productName list_price") == ["product", "name", "list", "price"]
+    assert tokenize("Categories shipped_at SHIPPING") == ["category", "shipp", "at", "shipp"]
+
+
+def test_search_ranks_tables_sharing_the_query_words():
+    index = LexicalIndex(DOCUMENTS)
+    names = [name for name, _ in index.search("which carrier shipped the order", 5)]
+    assert names[0] == "shipments"
+    assert "customers" not in names and "products" not in names
+
+
+def test_rare_words_weigh_more():
+    index = LexicalIndex(DOCUMENTS)
+    # "category" only appears in products, "order" in three tables.
+    assert index.search("order category", 1)[0][0] == "products"
+
+
+def test_search_without_shared_words_is_empty():
+    assert LexicalIndex(DOCUMENTS).search("employee salaries", 5) == []
+    assert LexicalIndex({}).search("orders", 5) == []
+
+
+def test_bm25_score_of_a_single_term():
+    index = LexicalIndex({"a": "apple banana", "b": "cherry"}, k1=1.2, b=0.75)
+    idf = math.log(1 + (2 - 1 + 0.5) / (1 + 0.5))
+    # Document "a" has two terms against an average length of 1.5.
+    expected = idf * 1 * 2.2 / (1 + 1.2 * (1 - 0.75 + 0.75 * 2 / 1.5))
+    assert math.isclose(index.search("apple", 1)[0][1], expected, rel_tol=1e-5)
+
+
+def test_exact_names():
+    index = LexicalIndex(DOCUMENTS)
+    assert index.exact_names('List "orders" and order_items, then orders again') == ["orders", "order_items"]
+    assert index.exact_names("count the order items") == []
+
+
+def test_reciprocal_rank_fusion_prefers_agreement():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "a"], ["b", "d"]], k=60)
+    assert fused[0] == "b"
+    assert set(fused) == {"a", "b", "c", "d"}
+    assert fused[-1] == "d"
+
+
+def test_reciprocal_rank_fusion_scores():
+    # With k=0, first places score 1 and second places 1/2.
+    assert reciprocal_rank_fusion([["x", "y"], ["y"]], k=0) == ["y", "x"]
+    assert reciprocal_rank_fusion([]) == []
@@ -0,0 +1,77 @@
+import pytest
+from psqlagent.modules.db.guard import add_row_limit, needs_plan_check, QueryRejected
+from psqlagent.modules.db.result_cache import is_cacheable, is_query, is_read_only
+
+
+def test_select_is_a_cacheable_query():
+    assert is_query("SELECT * FROM orders;")
+    assert is_cacheable("select id from orders where note = 'update; delete'")
+
+
+def test_cte_is_read_only_and_cacheable():
+    sql = "WITH recent AS (SELECT * FROM orders WHERE id > 10) SELECT count(*) FROM recent"
+    assert is_read_only(sql)
+    assert is_cacheable(sql)
+    assert is_read_only("with recursive t(n) as (values (1) union all select n + 1 from t where n < 5) select * from t")
+
+
+def test_writable_cte_is_a_write():
+    for sql in ["WITH gone AS (DELETE FROM orders WHERE id = 1 RETURNING *) SELECT * FROM gone",
+                "with moved as (update orders set status = 'x' returning id) select id from moved",
+                "WITH new AS (INSERT INTO orders (id) VALUES (1) RETURNING id) SELECT id FROM new"]:
+        assert not is_read_only(sql)
+        assert not is_cacheable(sql)
+
+
+def test_explain_is_read_only_but_not_cached():
+    assert is_read_only("EXPLAIN SELECT * FROM orders")
+    assert is_read_only("EXPLAIN (FORMAT JSON) DELETE FROM orders")
+    assert is_read_only("explain analyze with t as (select 1) select * from t")
+    assert not is_cacheable("EXPLAIN SELECT * FROM orders")
+
+
+def test_explain_analyze_of_a_write_is_a_write():
+    assert not is_read_only("EXPLAIN ANALYZE DELETE FROM orders")
+    assert not is_read_only("EXPLAIN (ANALYZE, BUFFERS) UPDATE orders SET status = 'x'")
+
+
+def test_show_is_read_only():
+    assert is_read_only("SHOW search_path")
+    assert not is_cacheable("SHOW search_path")
+
+
+def test_writes_and_batches_are_not_read_only():
+    for sql in ["DELETE FROM orders", "SELECT * INTO backup FROM orders", "SELECT * FROM orders FOR UPDATE",
+                "SELECT 1; DROP TABLE orders", "EXPLAIN SELECT 1; DROP TABLE orders"]:
+        assert not is_read_only(sql)
+
+
+def test_row_limit_on_cte_but_not_explain_or_show():
+    cte = "WITH t AS (SELECT * FROM orders) SELECT * FROM t"
+    assert add_row_limit(cte, "postgres", 10) == f"{cte}\nLIMIT 10"
+    assert add_row_limit(cte, "sqlserver", 10) == "WITH t AS (SELECT * FROM orders) SELECT TOP (10) * FROM t"
+    assert add_row_limit("EXPLAIN SELECT * FROM orders", "postgres", 10) == "EXPLAIN SELECT * FROM orders"
+    assert add_row_limit("SHOW search_path", "postgres", 10) == "SHOW search_path"
+
+
+def test_row_limit_leaves_limited_queries_untouched():
+    for sql in ["SELECT * FROM orders LIMIT 5000;", "SELECT * FROM orders LIMIT 5000  \n",
+                "  select * from orders fetch first 10 rows only ;"]:
+        assert add_row_limit(sql, "postgres", 1000) is sql
+    for sql in ["SELECT TOP 5000 * FROM orders;", "SELECT TOP (10) * FROM orders \n"]:
+        assert add_row_limit(sql, "sqlserver", 1000) is sql
+
+
+def test_row_limit_strips_the_trailing_semicolon_when_it_adds_one():
+    assert add_row_limit("SELECT * FROM orders;  ", "postgres", 10) == "SELECT * FROM orders\nLIMIT 10"
+    assert add_row_limit("SELECT * FROM orders;\n", "sqlserver", 10) == "SELECT TOP (10) * FROM orders"
+
+
+def test_only_plannable_statements_are_plan_checked():
+    assert needs_plan_check("WITH t AS (SELECT 1) SELECT * FROM t")
+    assert needs_plan_check("UPDATE orders SET status = 'x'")
+    assert not needs_plan_check("EXPLAIN SELECT * FROM orders")
+    assert not needs_plan_check("SHOW search_path")
+    for sql in ["CREATE TABLE t (id int)", "DROP TABLE orders", "SELECT 1; DROP TABLE orders"]:
+        with pytest.raises(QueryRejected, match="only single SELECT"):
+            needs_plan_check(sql)
@@ -0,0 +1,119 @@
+import os
+import uuid
+import pytest
+from psqlagent.modules.db import result_cache as result_cache_module
+from psqlagent.modules.db.result_cache import referenced_tables, unknown_relations, ResultCache
+from psqlagent.modules.db.results import ResultHandle
+
+TABLES = ["orders", "customers"]
+
+
+def test_catalog_tables_are_known():
+    assert unknown_relations("select * from orders, customers", TABLES, "public") == []
+    assert unknown_relations("SELECT * FROM public.orders o JOIN customers c ON c.id = o.customer_id",
+                             TABLES, "public") == []
+    assert unknown_relations("table orders", TABLES, "public") == []
+
+
+def test_views_and_other_schemas_are_unknown():
+    assert unknown_relations("select * from order_totals", TABLES, "public") == ["order_totals"]
+    assert unknown_relations("select * from archive.orders", TABLES, "public") == ["archive.orders"]
+    assert unknown_relations("select * from orders where id in (select order_id from refunds)",
+                             TABLES, "public") == ["refunds"]
+    assert unknown_relations("select * from generate_series(1, 3)", TABLES, "public") == ["generate_series"]
+
+
+def test_ctes_literals_and_function_arguments_are_not_relations():
+    assert unknown_relations("with recent as (select * from orders) select * from recent", TABLES, "public") == []
+    assert unknown_relations("select extract(year from created_at), 'from x' from orders -- from y",
+                             TABLES, "public") == []
+    assert unknown_relations("select * from (select * from customers) c", TABLES, "public") == []
+
+
+def test_referenced_tables():
+    assert referenced_tables("select * from orders o join customers c on true", TABLES) == ["customers", "orders"]
+    assert referenced_tables("select 'orders' from customers", TABLES) == ["customers"]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache_module, "time", clock)
+    return clock
+
+
+def artifact(directory, content: bytes) -> ResultHandle:
+    result_id = uuid.uuid4().hex
+    path = os.path.join(directory, f"{result_id}.csv")
+    with open(path, "wb") as f:
+        f.write(content)
+    return ResultHandle(result_id=result_id, path=path, format="csv", columns=["id"], row_count=1,
+                        bytes=len(content))
+
+
+def test_hit_serves_a_fresh_copy(tmp_path, clock):
+    cache = ResultCache(results_directory=str(tmp_path))
+    handle = artifact(str(tmp_path), b"id\n1\n")
+    cache.store("k", 1, handle)
+    hit = cache.lookup("k", 1)
+    assert hit.path != handle.path and hit.row_count == 1
+    with open(hit.path, "rb") as f:
+        assert f.read() == b"id\n1\n"
+    assert cache.stats()["hits"] == 1
+
+
+def test_new_version_invalidates(tmp_path, clock):
+    cache = ResultCache(results_directory=str(tmp_path))
+    cache.store("k", 1, artifact(str(tmp_path), b"id\n1\n"))
+    assert cache.lookup("k", 2) is None
+    assert cache.lookup("k", 1) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = ResultCache(results_directory=str(tmp_path), ttl=60)
+    cache.store("k", 1, artifact(str(tmp_path), b"id\n1\n"))
+    clock.now += 59
+    assert cache.lookup("k", 1) is not None
+    clock.now += 2
+    assert cache.lookup("k", 1) is None
+    assert cache.stats()["expirations"] == 1
+    assert os.listdir(cache.directory) == []
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = ResultCache(results_directory=str(tmp_path), max_entries=2)
+    for key in ("a", "b"):
+        cache.store(key, 1, artifact(str(tmp_path), b"id\n1\n"))
+    assert cache.lookup("a", 1) is not None
+    cache.store("c", 1, artifact(str(tmp_path), b"id\n1\n"))
+    assert cache.lookup("b", 1) is None
+    assert cache.lookup("a", 1) is not None and cache.lookup("c", 1) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_budget(tmp_path, clock):
+    cache = ResultCache(results_directory=str(tmp_path), max_bytes=10)
+    cache.store("big", 1, artifact(str(tmp_path), b"x" * 11))
+    assert cache.stats()["entries"] == 0
+    cache.store("a", 1, artifact(str(tmp_path), b"x" * 6))
+    cache.store("b", 1, artifact(str(tmp_path), b"x" * 6))
+    assert cache.stats()["entries"] == 1 and cache.stats()["bytes"] == 6
+    assert cache.lookup("b", 1) is not None
+
+
+def test_invalidate_one_catalog(tmp_path, clock):
+    cache = ResultCache(results_directory=str(tmp_path))
+    cache.store(("pg", "sql"), 1, artifact(str(tmp_path), b"id\n1\n"))
+    cache.store(("mssql", "sql"), 1, artifact(str(tmp_path), b"id\n1\n"))
+    cache.invalidate("pg")
+    assert cache.lookup(("pg", "sql"), 1) is None
+    assert cache.lookup(("mssql", "sql"), 1) is not None
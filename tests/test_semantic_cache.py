@@ -0,0 +1,77 @@
+import numpy as np
+from types import SimpleNamespace
+from psqlagent.modules.db.schema import Schema
+from psqlagent.modules.semantic_cache import question_literals, SemanticCache
+
+QUESTION = "How many orders were placed in 2023?"
+PARAPHRASE = "What is the number of orders placed in 2023?"
+
+
+class FakeEmbedder:
+    """Embeds the known questions as fixed unit vectors, anything else as an unrelated one."""
+
+    def __init__(self, vectors: dict):
+        self.vectors = vectors
+        self.backend = SimpleNamespace(kind="fake")
+        self.model_name = "fake"
+
+    def embed_texts(self, texts):
+        return np.array([self.vectors.get(text, [0.0, 0.0, 1.0]) for text in texts], dtype=np.float32)
+
+
+def cache(**vectors):
+    embedder = FakeEmbedder({
+        QUESTION: [1.0, 0.0, 0.0],
+        PARAPHRASE: [0.95, 0.3122, 0.0],
+        **vectors,
+    })
+    return SemanticCache(embedder, threshold=0.9, path=None)
+
+
+def test_paraphrase_above_the_threshold_hits():
+    semantic_cache = cache()
+    semantic_cache.store("db", "fp", QUESTION, "SELECT count(*) FROM orders", tables=frozenset({"orders"}))
+    entry = semantic_cache.lookup("db", "fp", PARAPHRASE, tables=frozenset({"orders"}))
+    assert entry["sql"] == "SELECT count(*) FROM orders"
+    assert entry["similarity"] > 0.9
+    assert semantic_cache.hits == 1
+
+
+def test_unrelated_question_misses():
+    semantic_cache = cache()
+    semantic_cache.store("db", "fp", QUESTION, "SELECT count(*) FROM orders")
+    assert semantic_cache.lookup("db", "fp", "Which customers churned?") is None
+    assert semantic_cache.misses == 1
+
+
+def test_other_schema_catalog_or_tables_miss():
+    semantic_cache = cache()
+    semantic_cache.store("db", "fp", QUESTION, "SELECT count(*) FROM orders", tables=frozenset({"orders"}))
+    assert semantic_cache.lookup("db", "new-fp", PARAPHRASE, tables=frozenset({"orders"})) is None
+    assert semantic_cache.lookup("other-db", "fp", PARAPHRASE, tables=frozenset({"orders"})) is None
+    assert semantic_cache.lookup("db", "fp", PARAPHRASE, tables=frozenset({"refunds"})) is None
+
+
+def test_different_literals_miss():
+    semantic_cache = cache(**{"How many orders were placed in 2022?": [1.0, 0.0, 0.0]})
+    semantic_cache.store("db", "fp", QUESTION, "SELECT count(*) FROM orders WHERE year = 2023")
+    assert semantic_cache.lookup("db", "fp", "How many orders were placed in 2022?") is None
+
+
+def test_question_literals():
+    assert question_literals("Orders over 1,000 with status 'Pending' in \"EU\"") == {"1000", "pending", "eu"}
+    assert question_literals("What is the manager's salary?") == frozenset()
+
+
+def test_mentioned_tables():
+    schema = Schema.from_dicts("public", [{"name": "orders"}, {"name": "order_items"}, {"name": "customers"}])
+    assert cache().mentioned_tables(schema, "Which customers placed the most orders?") == {"orders", "customers"}
+
+
+def test_least_recently_used_entries_are_evicted():
+    semantic_cache = cache(**{"Which customers churned?": [0.0, 1.0, 0.0]})
+    semantic_cache.max_entries = 1
+    semantic_cache.store("db", "fp", QUESTION, "SELECT 1")
+    semantic_cache.store("db", "fp", "Which customers churned?", "SELECT 2")
+    assert semantic_cache.lookup("db", "fp", QUESTION) is None
+    assert semantic_cache.lookup("db", "fp", "Which customers churned?")["sql"] == "SELECT 2"
@@ -0,0 +1,60 @@
+import math
+import threading
+from psqlagent.modules import llm
+from psqlagent.modules.llm import estimate_price, HistoryTokenCounter, TokenUsage
+
+
+def test_usage_per_agent_and_model():
+    usage = TokenUsage()
+    usage.add("engineer", "gpt-4", 1000, 100)
+    usage.add("engineer", "gpt-4", 500, 50)
+    usage.add("analyst", "gpt-3.5-turbo", 2000, 200)
+    summary = usage.to_dict()
+    assert (summary["input_tokens"], summary["output_tokens"], summary["total_tokens"]) == (3500, 350, 3850)
+    assert summary["agents"]["engineer"]["calls"] == 2
+    assert summary["models"]["gpt-3.5-turbo"]["input_tokens"] == 2000
+    assert math.isclose(summary["cost"], 1.5 * 0.03 + 0.15 * 0.06 + 2 * 0.0015 + 0.2 * 0.002)
+
+
+def test_unknown_models_are_priced_as_the_default():
+    assert estimate_price("some-new-model", 1000, 1000) == estimate_price(llm.DEFAULT_MODEL, 1000, 1000)
+
+
+def test_merge():
+    usage, other = TokenUsage(), TokenUsage()
+    usage.add("engineer", "gpt-4", 10, 1)
+    other.add("engineer", "gpt-4", 20, 2)
+    other.add("fast_path", "gpt-4", 30, 3)
+    usage.merge(other)
+    assert usage.to_dict()["agents"]["engineer"] == {
+        "calls": 2, "input_tokens": 30, "output_tokens": 3, "cost": estimate_price("gpt-4", 30, 3)}
+    assert usage.total_tokens == 66
+
+
+def test_concurrent_adds_are_all_counted():
+    usage = TokenUsage()
+    threads = [threading.Thread(target=lambda: [usage.add("a", "gpt-4", 1, 1) for _ in range(1000)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert usage.to_dict()["agents"]["a"]["calls"] == 4000
+
+
+def test_history_counter_only_counts_new_messages(monkeypatch):
+    counted = []
+
+    def count_message_tokens(message, model=llm.DEFAULT_MODEL):
+        counted.append(message["content"])
+        return len(message["content"].split())
+
+    monkeypatch.setattr(llm, "count_message_tokens", count_message_tokens)
+    counter = HistoryTokenCounter()
+    history = [{"content": "system prompt"}, {"content": "how many orders"}]
+    assert counter.count("analyst", history) == 5
+    history.append({"content": "twelve"})
+    assert counter.count("analyst", history) == 6
+    assert counted == ["system prompt", "how many orders", "twelve"]
+    # A history that doesn't start with the counted messages is recounted.
+    assert counter.count("analyst", [{"content": "other prompt"}]) == 2